@@ -1,6 +1,5 @@
-from regex import Str, Num, KeywordPatterns, Operators
+from regex import Str, UnfinishedStr, LongString, LongComment, UnfinishedLongBracket, Num, KeywordPatterns, group, esc, register
 from objects import TokenSpecification
-import re
 
 
 class lua:
@@ -46,6 +45,34 @@ class lua:
         RBRACKET = "RBRACKET"
         LBRACE = "LBRACE"
         RBRACE = "RBRACE"
+        UNKNOWN = "UNKNOWN"
+        PLUS = "PLUS"
+        MINUS = "MINUS"
+        STAR = "STAR"
+        FORWARDSLASH = "FORWARDSLASH"
+        PERCENT = "PERCENT"
+        CARET = "CARET"
+        HASHTAG = "HASHTAG"
+        AMPERSAND = "AMPERSAND"
+        TILDE = "TILDE"
+        PIPE = "PIPE"
+        LSHIFT = "LSHIFT"
+        RSHIFT = "RSHIFT"
+        DOUBLEFORWARDSLASH = "DOUBLEFORWARDSLASH"
+        DOUBLEEQUALS = "DOUBLEEQUALS"
+        TILDEEQUALS = "TILDEEQUALS"
+        LESSTHANEQUALS = "LESSTHANEQUALS"
+        MORETHANEQUALS = "MORETHANEQUALS"
+        GREATERTHAN = "GREATERTHAN"
+        LESSTHAN = "LESSTHAN"
+        EQUALS = "EQUALS"
+        SEMICOLON = "SEMICOLON"
+        COLON = "COLON"
+        DOUBLECOLON = "DOUBLECOLON"
+        COMMA = "COMMA"
+        DOT = "DOT"
+        DOTDOT = "DOTDOT"
+        DOTDOTDOT = "DOTDOTDOT"
         types = None
     
     class keyword:
@@ -77,7 +104,7 @@ class lua:
             return [lua.keyword.AND, lua.keyword.BREAK, lua.keyword.DO, lua.keyword.ELSE, lua.keyword.ELSEIF, lua.keyword.END, lua.keyword.FALSE, lua.keyword.FOR, lua.keyword.FUNCTION, lua.keyword.GOTO, lua.keyword.IF, lua.keyword.IN, lua.keyword.LOCAL, lua.keyword.NIL, lua.keyword.NOT, lua.keyword.OR, lua.keyword.REPEAT, lua.keyword.RETURN, lua.keyword.THEN, lua.keyword.TRUE, lua.keyword.UNTIL, lua.keyword.WHILE]
         @staticmethod
         def iskeyword(string: str) -> bool:
-            return string in lua.keyword.all()
+            return string in lua.keyword.names
         
     class literal:
         LEFTPAREN = "("
@@ -164,20 +191,51 @@ LUA_KEYWORDS = [
 ]
 
 
+lua.keyword.names = frozenset(lua.keyword.all())
+
+# every lua.literal that is an operator or separator has a token kind of the same name
+OPERATOR_NAMES = [
+    "PLUS", "MINUS", "STAR", "FORWARDSLASH", "PERCENT", "CARET", "HASHTAG", "AMPERSAND", "TILDE", "PIPE",
+    "LSHIFT", "RSHIFT", "DOUBLEFORWARDSLASH", "DOUBLEEQUALS", "TILDEEQUALS", "LESSTHANEQUALS",
+    "MORETHANEQUALS", "GREATERTHAN", "LESSTHAN", "EQUALS", "SEMICOLON", "COLON", "DOUBLECOLON",
+    "COMMA", "DOT", "DOTDOT", "DOTDOTDOT",
+]
+
+# lexeme -> token kind, looked up once per NAME, KEYWORD or OPERATOR match
+KEYWORD_KINDS = {keyword: keyword.upper() for keyword in lua.keyword.all()}
+OPERATOR_KINDS = {getattr(lua.literal, name): getattr(lua.token, name) for name in OPERATOR_NAMES}
+LEXEME_KINDS = {**KEYWORD_KINDS, **OPERATOR_KINDS}
+LEXEME_BYTE_KINDS = {lexeme.encode(): kind for lexeme, kind in LEXEME_KINDS.items()}
+# specification types whose matches are refined through LEXEME_KINDS
+CLASSIFIED_TYPES = frozenset((lua.token.NAME, lua.token.KEYWORD, lua.token.OPERATOR))
+# token types the parser skips over
+TRIVIA_TYPES = frozenset((lua.token.WHITESPACE, lua.token.NEWLINE, lua.token.INDENT, lua.token.DEDENT, lua.token.COMMENT))
+
+# longest operator first, so `...` wins over `..` and `~=` over `~`; a `-`
+# followed by another one starts a comment
+OperatorPattern = group(*[esc(operator) + ("(?!-)" if operator == lua.literal.MINUS else "")
+                          for operator in sorted(OPERATOR_KINDS, key=len, reverse=True)])
+register(OperatorPattern=OperatorPattern)
+
+
 specification_token_indent = TokenSpecification(lua.token.INDENT, r"\t")
 spcification_token_dedent =  TokenSpecification(lua.token.DEDENT, ""   )
 
 token_specification = [
-    TokenSpecification(lua.token.COMMENT,     r'--.*\n'                              ),                  # Single line comment
+    # tried last, so the lookaheads below keep `[` and `--` from taking a long bracket apart
+    TokenSpecification(lua.token.UNKNOWN,     UnfinishedLongBracket                  ),                  # Long bracket missing its closer
+    TokenSpecification(lua.token.STRING,      LongString                             ),                  # [[ ... ]], [==[ ... ]==]
+    TokenSpecification(lua.token.COMMENT,     LongComment                            ),                  # Multi Line Comment, --[[ ... ]]
+    TokenSpecification(lua.token.COMMENT,     r'--(?!\[=*\[).*\n?'                   ),                  # Single line comment
+    TokenSpecification(lua.token.UNKNOWN,     UnfinishedStr                          ),                  # String missing its closing quote
     TokenSpecification(lua.token.STRING,      Str                                    ),                        # String literals
-    TokenSpecification(lua.token.COMMENT,     re.compile(r'--\[\[.*\]\]--', re.DOTALL)),          # Multi Line Comment
     TokenSpecification(lua.token.KEYWORD,     KeywordPatterns                        ),
     TokenSpecification(lua.token.NUMBER,      Num                                    ),                        # Integer or decimal number
     TokenSpecification(lua.token.NAME,        r'\b[A-Za-z_][A-Za-z0-9_]*\b'          ),  # Identifiers
-    TokenSpecification(lua.token.OPERATOR,    Operators                              ),                  # Lua operators
+    TokenSpecification(lua.token.OPERATOR,    OperatorPattern                        ),                  # Lua operators
     TokenSpecification(lua.token.LBRACKET,    r"\{"                                  ),
     TokenSpecification(lua.token.RBRACKET,    r"\}"                                  ),
-    TokenSpecification(lua.token.LBRACE,      r"\["                                  ),
+    TokenSpecification(lua.token.LBRACE,      r"\[(?!=*\[)"                           ),
     TokenSpecification(lua.token.RBRACE,      r"\]"                                  ),
     TokenSpecification(lua.token.LPAREN,      r"\("                                  ),
     TokenSpecification(lua.token.RPAREN,      r"\)"                                  ),
@@ -1,4 +1,7 @@
-from typing_extensions import TypeAlias as Alias
+try:
+    from typing import TypeAlias as Alias
+except ImportError:
+    from typing_extensions import TypeAlias as Alias
 
 LuaToken: Alias = str
 LuaKeyword: Alias = str
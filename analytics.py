@@ -0,0 +1,222 @@
+import sys
+import json
+import argparse
+import functools
+import multiprocessing
+from functools import partial
+from typing import Iterable
+from Lua import lua
+from tokenarray import TokenArray, token_kinds, kind_codes
+from tokenizer import tokenize_lua_array, mapped_file
+from cache import shared_cache
+from corpus import collect
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# identifiers longer than this are counted as this long
+MAX_NAME_LENGTH = 64
+NAME = kind_codes[lua.token.NAME]
+COMMENT = kind_codes[lua.token.COMMENT]
+UNKNOWN = kind_codes[lua.token.UNKNOWN]
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise ImportError("analytics needs numpy, install it with `pip install numpy`")
+
+
+@functools.cache
+def row_dtype():
+    """ the per file row: sizes and counts, the tokens of every kind and the
+    identifiers of every length """
+    require_numpy()
+    return np.dtype([
+        ("bytes", np.int64), ("lines", np.int64), ("tokens", np.int64),
+        ("unknown_tokens", np.int64), ("unknown_bytes", np.int64),
+        ("comment_tokens", np.int64), ("comment_bytes", np.int64),
+        ("names", np.int64), ("name_bytes", np.int64),
+        ("kinds", np.int64, (len(token_kinds),)),
+        ("name_lengths", np.int64, (MAX_NAME_LENGTH + 1,)),
+        ("error", np.bool_),
+    ])
+
+
+def token_columns(tokens: TokenArray) -> tuple:
+    """ the kind codes, starts and ends of `tokens` as numpy arrays over the
+    same memory """
+    require_numpy()
+    return (np.frombuffer(tokens.kinds, dtype=np.uint8), np.frombuffer(tokens.starts, dtype=np.int64),
+            np.frombuffer(tokens.ends, dtype=np.int64))
+
+
+def file_row(tokens: TokenArray, size: int = None):
+    """ the statistics of one tokenized file as a row of `row_dtype()`.
+    `size` defaults to the length of the source. """
+    row = np.zeros((), dtype=row_dtype())
+    kinds, starts, ends = token_columns(tokens)
+    lengths = ends - starts
+    source = tokens.source
+    row["bytes"] = len(source) if size is None else size
+    if isinstance(source, str):
+        row["lines"] = source.count("\n") + 1
+    else:
+        row["lines"] = np.count_nonzero(np.frombuffer(source, dtype=np.uint8) == 10) + 1
+    row["tokens"] = len(kinds)
+    histogram = np.bincount(kinds, minlength=len(token_kinds))
+    row["kinds"] = histogram[:len(token_kinds)]
+    row["unknown_tokens"] = histogram[UNKNOWN]
+    row["unknown_bytes"] = lengths[kinds == UNKNOWN].sum()
+    row["comment_tokens"] = histogram[COMMENT]
+    row["comment_bytes"] = lengths[kinds == COMMENT].sum()
+    names = lengths[kinds == NAME]
+    row["names"] = len(names)
+    row["name_bytes"] = names.sum()
+    row["name_lengths"] = np.bincount(np.minimum(names, MAX_NAME_LENGTH), minlength=MAX_NAME_LENGTH + 1)
+    return row
+
+
+def scan_row(path: str, cache_dir: str = None):
+    """ `file_row` of a file, scanned through a memory map; a file that
+    cannot be read gives an empty row with `error` set """
+    try:
+        with mapped_file(path) as content:
+            tokens = shared_cache(cache_dir).tokenize(content) if cache_dir else tokenize_lua_array(content)
+            return file_row(tokens)
+    except (OSError, ValueError):
+        row = np.zeros((), dtype=row_dtype())
+        row["error"] = True
+        return row
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict:
+    if len(values) == 0:
+        return {}
+    return {f"p{point}": float(value) for point, value in zip(points, np.percentile(values, points))}
+
+
+def ratio(numerator, denominator):
+    """ element wise `numerator / denominator`, 0 where the denominator is 0 """
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=np.asarray(denominator) != 0)
+
+
+class CorpusStats:
+    """ token statistics of a corpus, one row of `row_dtype()` per file.
+
+    Files are added as tokenizer output, which is read through numpy views
+    of its columns without building a `Token` per token. The rows are
+    collected into one structured array, so every report is a handful of
+    vectorized operations over the whole corpus.
+
+    Needs numpy.
+    """
+
+    def __init__(self):
+        require_numpy()
+        self.paths: list[str] = []
+        self.pending = []
+        self.table = np.zeros(0, dtype=row_dtype())
+
+    def add(self, path: str, row) -> None:
+        self.paths.append(path)
+        self.pending.append(row)
+
+    def add_tokens(self, path: str, tokens: TokenArray, size: int = None) -> None:
+        self.add(path, file_row(tokens, size))
+
+    @property
+    def rows(self):
+        """ the structured array of all rows, in the order they were added """
+        if self.pending:
+            self.table = np.concatenate([self.table, np.stack(self.pending)])
+            self.pending = []
+        return self.table
+
+    @classmethod
+    def scan(cls, paths: Iterable[str], workers: int = None, chunksize: int = None, cache_dir: str = None) -> "CorpusStats":
+        """ tokenize every file of `paths` (files, directories or glob
+        patterns, as `corpus.collect` takes them) across a process pool """
+        retv = cls()
+        files = collect(paths)
+        job = partial(scan_row, cache_dir=cache_dir)
+        workers = workers or multiprocessing.cpu_count()
+        if workers == 1 or len(files) < 2:
+            rows = map(job, files)
+            retv.pending.extend(rows)
+        else:
+            if chunksize is None:
+                chunksize = max(1, min(256, len(files) // (workers * 8)))
+            with multiprocessing.Pool(workers) as pool:
+                retv.pending.extend(pool.imap(job, files, chunksize))
+        retv.paths.extend(files)
+        return retv
+
+    def report(self, top: int = 10) -> dict:
+        """ corpus wide totals and distributions, json serializable """
+        rows = self.rows
+        ok = rows[~rows["error"]]
+        kinds = ok["kinds"].sum(axis=0)
+        lengths = ok["name_lengths"].sum(axis=0)
+        names = int(lengths.sum())
+        name_cdf = np.cumsum(lengths)
+        bytes_per_token = ratio(ok["bytes"], ok["tokens"])
+        comment_density = ratio(ok["comment_bytes"], ok["bytes"])
+        unknown_rate = ratio(ok["unknown_tokens"], ok["tokens"])
+        worst = np.argsort(-unknown_rate, kind="stable")[:top]
+        paths = np.asarray(self.paths, dtype=object)[~rows["error"]] if len(self.paths) == len(rows) else None
+        return {
+            "files": int(len(rows)),
+            "errors": int(rows["error"].sum()),
+            "bytes": int(ok["bytes"].sum()),
+            "lines": int(ok["lines"].sum()),
+            "tokens": int(ok["tokens"].sum()),
+            "kinds": {token_kinds[code]: int(count) for code, count in enumerate(kinds) if count},
+            "names": {
+                "count": names,
+                "mean_length": float(ok["name_bytes"].sum() / names) if names else 0.0,
+                "lengths": {(f"{length}+" if length == MAX_NAME_LENGTH else str(length)): int(count)
+                            for length, count in enumerate(lengths) if count},
+                **{f"p{point}": int(np.searchsorted(name_cdf, names * point / 100)) for point in (50, 90, 99) if names},
+            },
+            "comment_density": {"corpus": float(ratio(ok["comment_bytes"].sum(), ok["bytes"].sum())), **percentiles(comment_density)},
+            "unknown_rate": {"corpus": float(ratio(ok["unknown_tokens"].sum(), ok["tokens"].sum())),
+                             "files_with_unknown": int(np.count_nonzero(ok["unknown_tokens"])), **percentiles(unknown_rate)},
+            "bytes_per_token": {"corpus": float(ratio(ok["bytes"].sum(), ok["tokens"].sum())), **percentiles(bytes_per_token)},
+            "most_unknown": [] if paths is None else
+                [{"path": paths[index], "unknown_rate": float(unknown_rate[index])} for index in worst if unknown_rate[index] > 0],
+        }
+
+    def save(self, path: str) -> None:
+        """ write the rows, and the paths next to them, as a `.npz` file """
+        np.savez(path, rows=self.rows, paths=np.asarray(self.paths, dtype=str))
+
+    @classmethod
+    def load(cls, path: str) -> "CorpusStats":
+        retv = cls()
+        with np.load(path) as data:
+            retv.table = data["rows"]
+            retv.paths = data["paths"].tolist()
+        return retv
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="token statistics of a corpus of lua files, as JSON")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--cache", default=None, help="token cache directory")
+    parser.add_argument("--rows", default=None, help="also save the per file rows to this .npz file")
+    parser.add_argument("--top", type=int, default=10, help="files with the most UNKNOWN tokens to list")
+    args = parser.parse_args(argv)
+
+    stats = CorpusStats.scan(args.paths, args.workers, cache_dir=args.cache)
+    if args.rows:
+        stats.save(args.rows)
+    json.dump(stats.report(args.top), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
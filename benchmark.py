@@ -0,0 +1,402 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable
+from tokenizer import scan_tokens, layout_tokens, tokenize_lua, tokenize_lua_array
+from regex import registry, compile_pattern
+from regexaudit import audit
+from Lua import token_specification
+from nodes import LuaParser, parse_lua
+
+
+KB = 1024
+MB = 1024 * KB
+SIZES = {"1KB": KB, "10KB": 10 * KB, "100KB": 100 * KB, "1MB": MB, "10MB": 10 * MB, "100MB": 100 * MB}
+
+
+@dataclass
+class Mix:
+    """ relative weights of the statements `generate_lua` writes, and how
+    deep blocks may nest """
+    strings: float = 1.0
+    comments: float = 1.0
+    numbers: float = 1.0
+    names: float = 1.0
+    blocks: float = 0.5
+    depth: int = 4
+
+
+def generate_lua(size: int, mix: Mix = None, seed: int = 0) -> str:
+    """ generate at least `size` characters of synthetic lua.
+
+    The same size, mix and seed always give the same source.
+    """
+    mix = mix or Mix()
+    rng = random.Random(seed)
+    names = [f"{a}{b}" for a in "abcdefghxyz" for b in ("", "1", "_tmp", "Value", "count")]
+    words = ["hello", "world", "lua", "token", "parser", "value", "--", "'quoted'", "end", "%d"]
+
+    def name():
+        return rng.choice(names)
+
+    def number():
+        return rng.choice((str(rng.randint(0, 100000)), f"{rng.random() * 1000:.4f}",
+                           hex(rng.randint(0, 65535)), f"{rng.randint(1, 9)}e{rng.randint(-5, 5)}"))
+
+    def string():
+        return '"' + " ".join(rng.choice(words) for i in range(rng.randint(1, 8))).replace('"', "") + '"'
+
+    def expression():
+        return f"{name()} {rng.choice(('+', '-', '*', '/', '..', '==', '~=', '<='))} {number()}"
+
+    kinds = ["string", "comment", "number", "name", "block"]
+    weights = [mix.strings, mix.comments, mix.numbers, mix.names, mix.blocks]
+    lines = []
+    length = 0
+    depth = 0
+    while length < size or depth:
+        indent = "    " * depth
+        kind = rng.choices(kinds, weights)[0]
+        if length >= size or (depth and rng.random() < 0.2):
+            line = "end"
+            depth -= 1
+            indent = "    " * depth
+        elif kind == "string":
+            line = f"local {name()} = {string()}"
+        elif kind == "comment":
+            if rng.random() < 0.2:
+                line = "--[[\n" + indent + "    " + " ".join(rng.choice(words) for i in range(6)) + "\n" + indent + "]]--"
+            else:
+                line = "-- " + " ".join(rng.choice(words) for i in range(rng.randint(1, 10)))
+        elif kind == "number":
+            line = f"{name()} = {number()}"
+        elif kind == "name":
+            line = f"{name()} = {expression()}"
+        elif depth < mix.depth:
+            line = rng.choice((f"if {expression()} then", f"while {expression()} do",
+                               f"for {name()} = 1, {rng.randint(2, 99)} do",
+                               f"function {name()}({name()}, {name()})"))
+            depth += 1
+        else:
+            line = f"print({string()}, {name()})"
+        line = indent + line + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)
+
+
+# inputs that drive backtracking patterns or rescanning lexers quadratic,
+# each made of `size` characters or a little more
+ADVERSARIAL = {
+    "open long brackets": lambda size: "[==[ ]=] ]] " * (size // 12),
+    "quotes per line": lambda size: ('"' * 999 + "\n") * (size // 1000 + 1),
+    "escaped quotes": lambda size: ('"' + '\\"' * 500 + "\n") * (size // 1002 + 1),
+    "near closers": lambda size: "[==[" + "]=]" * (size // 3) + "]==]",
+    "comment openers": lambda size: ("--[=" * 250 + "\n") * (size // 1001 + 1),
+    "escaped newlines": lambda size: "'" + "\\\n" * (size // 2),
+}
+
+
+def timed(function: Callable, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    retv = function(*args)
+    return time.perf_counter() - start, retv
+
+
+def peak_memory(function: Callable, *args) -> int:
+    """ peak traced allocation of `function(*args)`, in bytes """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_tokenizer(code: str, repeat: int) -> dict:
+    phases = {"scan": [], "layout": [], "tokenize_lua": [], "tokenize_lua_array": []}
+    tokens = 0
+    for i in range(repeat):
+        d, scanned = timed(scan_tokens, code)
+        phases["scan"].append(d)
+        d, laid_out = timed(lambda: list(layout_tokens(scanned)))
+        phases["layout"].append(d)
+        del scanned, laid_out
+        d, tokens = timed(tokenize_lua, code)
+        phases["tokenize_lua"].append(d)
+        tokens = len(tokens)
+        d, array = timed(tokenize_lua_array, code)
+        phases["tokenize_lua_array"].append(d)
+        del array
+    seconds = min(phases["tokenize_lua"])
+    return {
+        "tokens": tokens,
+        "seconds": seconds,
+        "tokens_per_second": tokens / seconds,
+        "mb_per_second": len(code) / MB / seconds,
+        "phases": {phase: min(times) for phase, times in phases.items()},
+        "peak_bytes": peak_memory(tokenize_lua, code),
+        "peak_bytes_array": peak_memory(tokenize_lua_array, code),
+    }
+
+
+def bench_parser(code: str, repeat: int) -> dict:
+    """ time tokenizing and parsing as separate phases, and as the fused
+    `parse_lua` pipeline the other numbers are reported for; `parse_lazy`
+    is the pipeline leaving function bodies unparsed """
+    phases = {"tokenize": [], "parse": [], "parse_lua": [], "parse_lazy": []}
+    tokens = 0
+    error = None
+    for i in range(repeat):
+        d, array = timed(tokenize_lua_array, code)
+        phases["tokenize"].append(d)
+        tokens = len(array)
+        try:
+            d, chunk = timed(LuaParser(array).parse_chunk)
+            phases["parse"].append(d)
+            del array, chunk
+            d, chunk = timed(parse_lua, code)
+            phases["parse_lua"].append(d)
+            del chunk
+            d, chunk = timed(parse_lua, code, None, True)
+            phases["parse_lazy"].append(d)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            break
+    if error is not None:
+        return {"tokens": tokens, "error": error}
+    seconds = min(phases["parse_lua"])
+    return {
+        "tokens": tokens,
+        "seconds": seconds,
+        "tokens_per_second": tokens / seconds,
+        "mb_per_second": len(code) / MB / seconds,
+        "phases": {phase: min(times) for phase, times in phases.items()},
+        "peak_bytes": peak_memory(parse_lua, code),
+    }
+
+
+def import_time(module: str = "tokenizer") -> dict:
+    """ import `module` in a fresh interpreter under `-X importtime`.
+
+    Returns:
+        dict: the cumulative import time of `module` in seconds, and whatever
+        the import wrote to stdout (an import should not write anything)
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    cumulative = 0
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:"):
+            fields = line.split("|")
+            if fields[-1].strip() == module:
+                cumulative = int(fields[1])
+    return {"module": module, "seconds": cumulative / 1e6, "output": process.stdout}
+
+
+def bench_adversarial(size: int, repeat: int, scale: int = 4) -> dict:
+    """ time `scan_tokens` on each `ADVERSARIAL` input at `size` and
+    `scale` times `size` characters.
+
+    Returns:
+        dict: per input, the seconds at both sizes and their ratio, the
+        growth, which stays near `scale` while scanning is linear
+    """
+    results = {}
+    for name, make in ADVERSARIAL.items():
+        seconds = []
+        for n in (size, size * scale):
+            code = make(n)
+            seconds.append(min(timed(scan_tokens, code)[0] for i in range(repeat)))
+        results[name] = {"chars": size, "scale": scale, "seconds": seconds[0], "seconds_scaled": seconds[1],
+                         "growth": seconds[1] / max(seconds[0], 1e-9)}
+    return results
+
+
+def bench_patterns(size: int, repeat: int, seed: int = 0) -> dict:
+    """ time every registered pattern of `regex.py`, and every pattern of
+    `token_specification` (as `T<index>`), alone over a generated source
+    and each `ADVERSARIAL` input of `size` characters, with its `audit`.
+
+    Returns:
+        dict: per pattern, the seconds and matches per input, their total
+        seconds and the audit findings
+    """
+    inputs = {"generated": generate_lua(size, seed=seed)}
+    inputs.update((name, make(size)) for name, make in ADVERSARIAL.items())
+    patterns = dict(registry)
+    patterns.update((f"T{index}", spec.pattern) for index, spec in enumerate(token_specification))
+    results = {}
+    for name, pattern in patterns.items():
+        compiled = compile_pattern(pattern)
+        result = results[name] = {"seconds": {}, "matches": {}, "audit": audit(pattern)}
+        for input_name, text in inputs.items():
+            seconds = []
+            for i in range(repeat):
+                d, matches = timed(lambda: sum(1 for find in compiled.finditer(text)))
+                seconds.append(d)
+            result["seconds"][input_name] = min(seconds)
+            result["matches"][input_name] = matches
+        result["total"] = sum(result["seconds"].values())
+    return dict(sorted(results.items(), key=lambda item: -item[1]["total"]))
+
+
+def check_patterns(report: dict) -> list[str]:
+    """ audit findings of the `token_specification` patterns, the ones the
+    tokenizer runs """
+    return [f"{name} ({token_specification[int(name[1:])].type}): {severity}, {description}"
+            for name, result in report.get("patterns", {}).items() if name[0] == "T" and name[1:].isdigit()
+            for severity, description in result["audit"]]
+
+
+def check_adversarial(report: dict, tolerance: float = 2.0) -> list[str]:
+    """ adversarial inputs whose scanning time grew more than `tolerance`
+    times faster than their size """
+    problems = []
+    for name, result in report.get("adversarial", {}).items():
+        if result["growth"] > result["scale"] * tolerance:
+            problems.append(f"{name}: {result['scale']}x the input took {result['growth']:.1f}x the time")
+    return problems
+
+
+def run(sizes: list[str], mix: Mix, repeat: int = 3, seed: int = 0, parser: bool = True,
+        adversarial: str = None, patterns: str = None) -> dict:
+    """ benchmark the tokenizer (and the parser) on generated sources of each
+    size, the tokenizer on the adversarial inputs at size `adversarial` and
+    every pattern alone on inputs of size `patterns` """
+    results = {}
+    for size in sizes:
+        code = generate_lua(SIZES[size], mix, seed)
+        results[f"tokenizer/{size}"] = bench_tokenizer(code, repeat)
+        if parser:
+            results[f"parser/{size}"] = bench_parser(code, repeat)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "mix": asdict(mix),
+        "seed": seed,
+        "import": import_time(),
+        "results": results,
+    }
+    if adversarial:
+        report["adversarial"] = bench_adversarial(SIZES[adversarial], repeat)
+    if patterns:
+        report["patterns"] = bench_patterns(SIZES[patterns], repeat, seed)
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.10) -> list[str]:
+    """ regressions of `report` against `baseline`: results that got more
+    than `threshold` slower or use that much more memory """
+    regressions = []
+    if "import" in report and "import" in baseline:
+        before, after = baseline["import"]["seconds"], report["import"]["seconds"]
+        if after > before * (1 + threshold):
+            regressions.append(f"import {report['import']['module']} seconds: {before:.6g} -> {after:.6g}")
+    for key, result in report["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if base is None or "error" in result or "error" in base:
+            continue
+        for metric in ("seconds", "peak_bytes", "peak_bytes_array"):
+            if metric in result and metric in base and result[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{key} {metric}: {base[metric]:.6g} -> {result[metric]:.6g} "
+                                   f"(+{(result[metric] / base[metric] - 1) * 100:.1f}%)")
+    return regressions
+
+
+def check_import(report: dict, budget: float) -> list[str]:
+    """ problems with the import of the tokenizer: writing output, or taking
+    longer than `budget` seconds """
+    problems = []
+    result = report["import"]
+    if result["output"]:
+        problems.append(f"importing {result['module']} wrote to stdout: {result['output'][:80]!r}")
+    if result["seconds"] > budget:
+        problems.append(f"importing {result['module']} took {result['seconds'] * 1000:.1f}ms, over the {budget * 1000:.0f}ms budget")
+    return problems
+
+
+def format_report(report: dict) -> str:
+    lines = [f"import {report['import']['module']}: {report['import']['seconds'] * 1000:.1f}ms",
+             f"{'benchmark':<20}{'tokens':>10}{'tok/s':>14}{'MB/s':>10}{'peak MB':>10}  phases"]
+    for key, result in report["results"].items():
+        if "error" in result:
+            lines.append(f"{key:<20}{result['tokens']:>10}  {result['error'][:80]}")
+            continue
+        phases = " ".join(f"{phase}={seconds * 1000:.2f}ms" for phase, seconds in result["phases"].items())
+        lines.append(f"{key:<20}{result['tokens']:>10}{result['tokens_per_second']:>14.0f}"
+                     f"{result['mb_per_second']:>10.2f}{result['peak_bytes'] / MB:>10.2f}  {phases}")
+    if "adversarial" in report:
+        lines.append(f"{'adversarial input':<20}{'seconds':>10}{'scaled':>14}{'growth':>10}")
+        for name, result in report["adversarial"].items():
+            lines.append(f"{name:<20}{result['seconds']:>10.4f}{result['seconds_scaled']:>14.4f}{result['growth']:>10.2f}")
+    if "patterns" in report:
+        lines.append(f"{'pattern':<20}{'total ms':>10}{'slowest input':>22}{'ms':>10}  audit")
+        for name, result in report["patterns"].items():
+            slowest = max(result["seconds"], key=result["seconds"].get)
+            findings = "; ".join(f"{severity}: {description}" for severity, description in result["audit"])
+            lines.append(f"{name:<20}{result['total'] * 1000:>10.2f}{slowest:>22}{result['seconds'][slowest] * 1000:>10.2f}  {findings}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="benchmark the lua tokenizer and parser")
+    parser.add_argument("--sizes", nargs="+", default=["1KB", "10KB", "100KB", "1MB"], choices=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--strings", type=float, default=1.0)
+    parser.add_argument("--comments", type=float, default=1.0)
+    parser.add_argument("--numbers", type=float, default=1.0)
+    parser.add_argument("--names", type=float, default=1.0)
+    parser.add_argument("--blocks", type=float, default=0.5)
+    parser.add_argument("--depth", type=int, default=4, help="deepest block nesting")
+    parser.add_argument("--no-parser", action="store_true", help="only benchmark the tokenizer")
+    parser.add_argument("--baseline", help="JSON baseline to compare against")
+    parser.add_argument("--save", help="write the results as JSON, e.g. to make a new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging (default 10%%)")
+    parser.add_argument("--import-budget", type=float, default=100, help="allowed import time of the tokenizer in ms")
+    parser.add_argument("--adversarial", nargs="?", const="100KB", choices=list(SIZES),
+                        help="also scan the adversarial inputs at this size and 4x it (default 100KB)")
+    parser.add_argument("--patterns", nargs="?", const="10KB", choices=list(SIZES),
+                        help="also time and audit every pattern alone on inputs of this size (default 10KB)")
+    args = parser.parse_args(argv)
+
+    mix = Mix(args.strings, args.comments, args.numbers, args.names, args.blocks, args.depth)
+    report = run(args.sizes, mix, args.repeat, args.seed, not args.no_parser, args.adversarial, args.patterns)
+    print(format_report(report))
+    failed = False
+    for problem in check_import(report, args.import_budget / 1000):
+        print(f"IMPORT {problem}")
+        failed = True
+    for problem in check_adversarial(report):
+        print(f"NONLINEAR {problem}")
+        failed = True
+    for problem in check_patterns(report):
+        print(f"BACKTRACKING {problem}")
+        failed = True
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
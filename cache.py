@@ -0,0 +1,197 @@
+import os
+import sys
+import mmap
+import pickle
+import time
+import hashlib
+import functools
+import tempfile
+import nodes
+from Lua import token_specification
+from tokenarray import TokenArray, token_kinds
+from tokenstream import pack_tokens, unpack_tokens
+from tokenizer import tokenize_lua_array
+from tokenstats import TokenizerStats
+from nodes import LuaParser, Chunk, Arena
+
+
+# bumped whenever the layout of the entries changes
+FORMAT_VERSION = 3
+
+
+def specification_hash() -> str:
+    """ hash of everything that decides what the tokenizer produces """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{FORMAT_VERSION}:{sys.byteorder}".encode())
+    for spec in token_specification:
+        pattern = spec.pattern
+        if not isinstance(pattern, str):
+            pattern = f"{pattern.pattern}/{pattern.flags}"
+        h.update(f"{spec.type}\0{pattern}\0".encode())
+    h.update("\0".join(token_kinds).encode())
+    return h.hexdigest()
+
+
+def parser_hash() -> str:
+    """ hash of the tokenizer specification and the parser source """
+    h = hashlib.blake2b(specification_hash().encode(), digest_size=16)
+    with open(nodes.__file__, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+class TokenCache:
+    """ a content addressed on disk cache of tokenizer and parser output.
+
+    Entries are keyed by a hash of the source and a hash of the token
+    specification (and of the parser, for ASTs), so changing the grammar
+    misses instead of loading stale results. Token arrays are stored in the
+    `tokenstream` format, without a pool, and read back through mmap; ASTs
+    are pickled as the flat arrays of an `Arena`, so a deep tree does not
+    make pickle recurse.
+
+    Writes go to a temporary file that is renamed into place, and a hit
+    touches the entry's mtime, so several processes can share a directory.
+    Once the entries grow past `max_bytes` the least recently used ones are
+    removed, down to 90% of the budget.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.token_salt = specification_hash()
+        self.parse_salt = None
+        self.size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, code: str | bytes, salt: str) -> str:
+        # text and bytes sources with the same content have different offsets
+        if isinstance(code, str):
+            h = hashlib.blake2b(code.encode("utf-8", "surrogatepass"), digest_size=20)
+            h.update(b"str")
+        else:
+            h = hashlib.blake2b(code, digest_size=20)
+            h.update(b"bytes")
+        h.update(salt.encode())
+        return h.hexdigest()
+
+    def path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def read(self, path: str):
+        """ map an entry, or return None on a miss """
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return mapped
+
+    def write(self, path: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.unlink(temp)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.size is None:
+            self.size = self.usage()
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        retv = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith((".tok", ".ast")):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    retv.append((stat.st_mtime, stat.st_size, entry.path))
+        return retv
+
+    def usage(self) -> int:
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self) -> None:
+        """ remove least recently used entries until the cache fits in 90% of its budget """
+        entries = sorted(self.entries())
+        size = sum(size for mtime, size, path in entries)
+        target = self.max_bytes * 9 // 10
+        for mtime, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self.size = size
+
+    def tokenize(self, code: str | bytes, stats: TokenizerStats = None) -> TokenArray:
+        """ `tokenize_lua_array(code, stats)`, from the cache when possible;
+        a hit is recorded in `stats` as the "cache" phase """
+        path = self.path(self.key(code, self.token_salt), ".tok")
+        began = time.perf_counter()
+        mapped = self.read(path)
+        if mapped is not None:
+            with mapped:
+                try:
+                    tokens = unpack_tokens(mapped, code, copy=True)
+                except ValueError:
+                    pass
+                else:
+                    if stats is not None:
+                        stats.add_phase("cache", time.perf_counter() - began)
+                        stats.add_token_array(tokens)
+                    return tokens
+        tokens = tokenize_lua_array(code, stats)
+        self.write(path, pack_tokens(tokens, pool=False))
+        return tokens
+
+    def parse(self, code: str | bytes, tokens: TokenArray = None) -> Chunk:
+        """ parse `code` with `LuaParser`, from the cache when possible.
+        Sources that fail to parse are not cached.
+        """
+        if self.parse_salt is None:
+            self.parse_salt = parser_hash()
+        path = self.path(self.key(code, self.parse_salt), ".ast")
+        mapped = self.read(path)
+        if mapped is not None:
+            with mapped:
+                try:
+                    arena, root = pickle.loads(mapped)
+                    return arena.to_node(root)
+                except Exception:
+                    pass
+        if tokens is None:
+            tokens = self.tokenize(code)
+        arena = Arena()
+        root = LuaParser(tokens, arena).parse_chunk()
+        chunk = arena.to_node(root)
+        self.write(path, pickle.dumps((arena, root), protocol=pickle.HIGHEST_PROTOCOL))
+        return chunk
+
+
+@functools.cache
+def shared_cache(directory: str) -> TokenCache:
+    """ the `TokenCache` of `directory` for this process, made on first use.
+
+    Every file a worker scans goes through the same instance, so the size
+    of the directory is added up once per process instead of once per file.
+    """
+    return TokenCache(directory)
@@ -0,0 +1,36 @@
+import random
+import pytest
+
+SAMPLES = [
+    "",
+    "local x = 42\nlocal y = 13.37\nlocal str = \"Hello, World!\"\nx = x + y\n",
+    "-- a comment\n--[[\n    a long\n    comment\n]]--\nfunction foo(a, b)\n    return a + b\nend\n",
+    "local t = {1, 2, [3] = 'three', four = [==[\nfour ]] ]=] ]==]}\n"
+    "for i, v in ipairs(t) do\n    if v ~= nil then\n        print(i .. ':' .. tostring(v))\n"
+    "    elseif i >= 2 then\n        goto continue\n    end\n    ::continue::\nend\n",
+    "local s = 'esc\\'aped \\z\n      \"quotes\"' .. \"tab\\t\"\nlocal n = 0x1F + 1e-3 + .5 + 3 // 2 ~ 5 << 1\n",
+    "local obj = {}\nfunction obj:method(...)\n\treturn select('#', ...), self\nend\n"
+    "while true do\n    repeat\n        local a <const> = #obj\n    until a > 0\n    break\nend\n",
+    "x = 'unfinished\ny = \"also\nz = [[never closed\n",
+    "local é = 'ü' -- non-ascii\nlocal 名前 = 1\n",
+    "#!/usr/bin/env lua\nprint(...)\n",
+]
+
+PIECES = ["x", "y1", "_z", "then", "end", "and", "local ", "function f()\n", "end\n", "1", "0x1F", "1.5", ".5",
+          "1e3", "..", ".", "...", "-", "--", "=", "==", "<", "<=", "~=", "~", "/", "//", ":", "::", "[", "]",
+          "[[s]]", "[==[a\n]]b]==]", "--[[x\ny]]", "{", "}", "(", ")", "'s'", '"t"', "'abc", '"q', "é", "xé",
+          "é1", "ü_", "中", "#", "+", "*", ",", ";", "\t", "\r", " ", "    ", "\n", "\n    ", "\n        ",
+          "--c\n", "[=[", "]=]"]
+
+
+def fuzzed(count: int, seed: int = 0) -> list[str]:
+    """ `count` random runs of token pieces, touching or apart """
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(PIECES) + rnd.choice(("", "", " ", "\n")) for _ in range(rnd.randint(1, 25)))
+            for _ in range(count)]
+
+
+@pytest.fixture(scope="session")
+def sources() -> list[str]:
+    """ the hand written `SAMPLES` and a seeded fuzzed corpus """
+    return SAMPLES + fuzzed(300)
@@ -0,0 +1,157 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from functools import partial
+from typing import IO, Iterable, Iterator
+from Lua import lua
+from tokenarray import kind_codes
+from tokenizer import tokenize_lua_array, mapped_file
+from nodes import LuaParser
+from cache import shared_cache
+from tokenstats import TokenizerStats
+
+
+def collect(paths: Iterable[str], file_extension: str = ".lua") -> list[str]:
+    """ expand files, directories and glob patterns into a sorted list of
+    files. Directories are walked for files ending with `file_extension`.
+    """
+    retv = set()
+    for path in paths:
+        matches = glob.glob(path, recursive=True) if glob.has_magic(path) else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    for file in files:
+                        if file.endswith(file_extension):
+                            retv.add(os.path.join(root, file))
+            elif os.path.isfile(match):
+                retv.add(match)
+    return sorted(retv)
+
+
+def scan_file(path: str, parse: bool = False, max_unknown: int = 20, cache_dir: str = None, stats: bool = False) -> dict:
+    """ tokenize, and optionally parse, one file, through a `TokenCache` in
+    `cache_dir` if one is given. The file is scanned through a memory map,
+    so offsets are byte offsets.
+
+    Returns:
+        dict: a json serializable result with the token count, the UNKNOWN
+        tokens (count and the first `max_unknown` as [offset, value]),
+        timings in seconds and the error, if any; with `stats`, also the
+        `TokenizerStats` of the file
+    """
+    result = {"path": path, "bytes": 0, "tokens": 0, "unknown": 0, "unknown_tokens": [],
+              "tokenize_seconds": 0.0, "parse_seconds": None, "error": None}
+    try:
+        with mapped_file(path) as content:
+            result["bytes"] = len(content)
+            cache = shared_cache(cache_dir) if cache_dir else None
+            tokenizer_stats = TokenizerStats() if stats else None
+            start = time.perf_counter()
+            tokens = cache.tokenize(content, tokenizer_stats) if cache else tokenize_lua_array(content, tokenizer_stats)
+            result["tokenize_seconds"] = time.perf_counter() - start
+            if stats:
+                result["stats"] = tokenizer_stats.to_json()
+            result["tokens"] = len(tokens)
+            unknown = kind_codes[lua.token.UNKNOWN]
+            result["unknown"] = tokens.kinds.count(unknown)
+            if result["unknown"]:
+                for index, kind in enumerate(tokens.kinds):
+                    if kind == unknown:
+                        result["unknown_tokens"].append([tokens.starts[index], tokens.value(index).decode("utf-8", "backslashreplace")])
+                        if len(result["unknown_tokens"]) >= max_unknown:
+                            break
+            if parse:
+                start = time.perf_counter()
+                try:
+                    if cache:
+                        cache.parse(content, tokens)
+                    else:
+                        LuaParser(tokens).parse_chunk()
+                finally:
+                    result["parse_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def scan_corpus(paths: Iterable[str], workers: int = None, chunksize: int = None, parse: bool = False,
+                cache_dir: str = None, stats: bool = False) -> Iterator[dict]:
+    """ scan every file in `paths` across a process pool, yielding the
+    `scan_file` results in completion order.
+
+    Args:
+        paths (Iterable[str]): files, directories or glob patterns
+        workers (int, optional): pool size. Defaults to the cpu count; 1 scans in this process.
+        chunksize (int, optional): files handed to a worker at a time. Defaults to
+            about eight chunks per worker, capped at 64 files.
+        parse (bool, optional): also run the files through `LuaParser`. Defaults to False.
+        cache_dir (str, optional): a `TokenCache` directory shared by the workers. Defaults to None.
+        stats (bool, optional): record `TokenizerStats` for every file. Defaults to False.
+    """
+    files = collect(paths)
+    workers = workers or os.cpu_count() or 1
+    job = partial(scan_file, parse=parse, cache_dir=cache_dir, stats=stats)
+    if workers == 1 or len(files) < 2:
+        for file in files:
+            yield job(file)
+        return
+    if chunksize is None:
+        chunksize = max(1, min(64, len(files) // (workers * 8)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(job, files, chunksize)
+
+
+def write_ndjson(results: Iterable[dict], out: IO, stats: TokenizerStats = None) -> dict:
+    """ write each result as one json line, flushing as they complete. The
+    stats of the results are merged into `stats`.
+
+    Returns:
+        dict: totals over all results
+    """
+    totals = {"files": 0, "tokens": 0, "unknown": 0, "errors": 0, "passes": 0}
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        totals["files"] += 1
+        totals["tokens"] += result["tokens"]
+        totals["unknown"] += result["unknown"]
+        totals["errors"] += result["error"] is not None
+        totals["passes"] += result["unknown"] == 0 and result["error"] is None
+        if stats is not None and "stats" in result:
+            stats.merge(result["stats"])
+    return totals
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="tokenize (and parse) a corpus of lua files, writing NDJSON results")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--chunksize", type=int, default=None, help="files per worker task")
+    parser.add_argument("--parse", action="store_true", help="also parse every file")
+    parser.add_argument("--cache", default=None, help="token/AST cache directory")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--stats", default=None, help="write the tokenizer stats of the whole run to this JSON file")
+    args = parser.parse_args(argv)
+
+    stats = TokenizerStats() if args.stats else None
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        results = scan_corpus(args.paths, args.workers, args.chunksize, args.parse, args.cache, stats is not None)
+        totals = write_ndjson(results, out, stats)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if stats is not None:
+        with open(args.stats, "w", encoding="utf-8") as f:
+            f.write(stats.dumps(indent=2))
+    print(f"{totals['passes']}/{totals['files']} tokenized successfully", file=sys.stderr)
+    return 0 if totals["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
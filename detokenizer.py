@@ -0,0 +1,503 @@
+import io
+import re
+import sys
+import string
+import argparse
+from bisect import bisect_left
+from itertools import chain, product
+from typing import IO, Iterable, Iterator
+from objects import Token
+from Lua import lua
+from tokenarray import TokenArray, token_kinds, kind_codes
+from tokenizer import master_scanner, tokenize_lua_array, iter_scan_tokens, read_chunks
+
+
+# zero width tokens made from indentation, written as nothing
+LAYOUT_TYPES = frozenset((lua.token.INDENT, lua.token.DEDENT))
+# token types the minifier leaves out
+DROPPED_TYPES = frozenset((lua.token.WHITESPACE, lua.token.NEWLINE, lua.token.INDENT, lua.token.DEDENT, lua.token.COMMENT))
+
+OPENERS = frozenset((lua.token.LPAREN, lua.token.LBRACE, lua.token.LBRACKET))
+CLOSERS = frozenset((lua.token.RPAREN, lua.token.RBRACE, lua.token.RBRACKET))
+# tokens that end an operand
+OPERANDS = frozenset((lua.token.NAME, lua.token.NUMBER, lua.token.STRING, lua.token.NIL, lua.token.TRUE,
+                      lua.token.FALSE, lua.token.DOTDOTDOT))
+# tokens that carry an expression on past an operand: binary operators,
+# field access, calls and the comma of an expression list
+CONTINUATIONS = frozenset((
+    lua.token.PLUS, lua.token.MINUS, lua.token.STAR, lua.token.FORWARDSLASH, lua.token.PERCENT, lua.token.CARET,
+    lua.token.AMPERSAND, lua.token.TILDE, lua.token.PIPE, lua.token.LSHIFT, lua.token.RSHIFT,
+    lua.token.DOUBLEFORWARDSLASH, lua.token.DOUBLEEQUALS, lua.token.TILDEEQUALS, lua.token.LESSTHANEQUALS,
+    lua.token.MORETHANEQUALS, lua.token.GREATERTHAN, lua.token.LESSTHAN, lua.token.DOTDOT, lua.token.AND,
+    lua.token.OR, lua.token.DOT, lua.token.COLON, lua.token.LPAREN, lua.token.LBRACE, lua.token.LBRACKET,
+    lua.token.STRING, lua.token.COMMA))
+KEYWORD_TYPES = frozenset(keyword.upper() for keyword in lua.keyword.all())
+# keywords that may appear inside an expression; every other one starts or ends a statement
+EXPRESSION_KEYWORDS = frozenset((lua.token.AND, lua.token.OR, lua.token.NOT, lua.token.NIL, lua.token.TRUE,
+                                 lua.token.FALSE, lua.token.FUNCTION))
+
+# lua reads a numeral on through any letters, digits and dots that follow it
+numeral_start = re.compile(r"\.?[0-9]")
+numeral_touching = re.compile(r"[\w.]", re.ASCII)
+byte_numeral_start = re.compile(rb"\.?[0-9]")
+byte_numeral_touching = re.compile(rb"[\w.]")
+# characters that can end a token and go on to start a longer one: those of
+# names and numerals, and the ones of `..`, `--`, `==`, `<=`, `//`, `::`,
+# `[[` and the like. Anything past ASCII joins as well, since the word
+# boundaries of the text patterns count it as a letter.
+joining_characters = frozenset(string.ascii_letters + string.digits + "_" + ".-=<>~/:[")
+joining_bytes = frozenset("".join(joining_characters).encode())
+
+
+class Writer:
+    """ collects output, writing it to a file object in blocks of about
+    `buffer_size` characters (or bytes) instead of a call per token """
+
+    def __init__(self, out: IO, buffer_size: int = 1 << 16):
+        self.out = out
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, value: str | bytes) -> None:
+        self.parts.append(value)
+        self.size += len(value)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.parts:
+            self.out.write(self.parts[0][:0].join(self.parts))
+            self.parts = []
+            self.size = 0
+
+
+def detokenize(tokens: Iterable[Token], out: IO, source: str | bytes = None, buffer_size: int = 1 << 16) -> None:
+    """ write the source of `tokens` back out, byte for byte.
+
+    The tokens of `scan_tokens` and `iter_scan_tokens` cover their source,
+    so their values are enough. The layout tokens of `tokenize_lua` leave
+    out newlines and indentation; those are taken from `source`, which is
+    written out from its first offset to its last. A `TokenArray`, or a
+    slice of one, is copied out of its source from the start of its first
+    token to the end of its last, and an empty one writes nothing; give
+    `source` as well for the text before and after them.
+
+    Raises:
+        ValueError: the tokens leave out text and there is no source to take it from
+    """
+    if isinstance(tokens, TokenArray) and source is None:
+        # the tokens and the text between them cover their span of the source
+        if not len(tokens):
+            return
+        end = tokens.ends[-1]
+        for start in range(tokens.starts[0], end, buffer_size):
+            out.write(tokens.source[start:min(start+buffer_size, end)])
+        return
+    writer = Writer(out, buffer_size)
+    position = 0
+    for tok in tokens:
+        if tok.type in LAYOUT_TYPES:
+            continue
+        if tok.start > position:
+            if source is None:
+                raise ValueError(f"the tokens leave out offsets {position} to {tok.start}, and no source was given")
+            writer.write(source[position:tok.start])
+        writer.write(tok.value)
+        position = tok.end
+    if source is not None and position < len(source):
+        writer.write(source[position:])
+    writer.flush()
+
+
+def short_names() -> Iterator[str]:
+    """ a, b, ..., Z, aa, ab, ... """
+    first = string.ascii_letters
+    rest = string.ascii_letters + string.digits + "_"
+    yield from first
+    length = 1
+    while True:
+        for head in first:
+            for tail in product(rest, repeat=length):
+                yield head + "".join(tail)
+        length += 1
+
+
+def rename_locals(tokens: list[Token]) -> list[str | bytes]:
+    """ the values of significant `tokens`, with every local variable
+    renamed to a short name.
+
+    Scopes are followed on the tokens alone, so this works on any chunk the
+    tokenizer reads: blocks by their keywords, and the end of the expression
+    list of a `local` statement (the point its names come into scope) by
+    whether the next token can carry an expression on. The local on the
+    n-th place of the scope stack is given the n-th short name that is not
+    a keyword or any identifier of the chunk, so a renamed local can neither
+    take the place of a global nor of a local of an enclosing scope. Fields,
+    table keys, labels and globals keep their names, as does `self`.
+
+    Raises:
+        ValueError: the blocks of the chunk do not match up
+    """
+    retv = []
+    binary = bool(tokens) and not isinstance(tokens[0].value, str)
+    encode = (lambda name: name.encode("ascii")) if binary else (lambda name: name)
+    reserved = {tok.value for tok in tokens if tok.type == lua.token.NAME}
+    reserved.update(encode(name) for name in (*lua.keyword.all(), "self", "_ENV"))
+    self_name = encode("self")
+    candidates = short_names()
+    names = []
+    scopes = {}
+    stack = []
+    blocks = []
+    brackets = []
+    # [block depth, bracket nesting, after an operand, the names it declares
+    # or None when it is the condition of a repeat]
+    expressions = []
+    loops = []
+    declaring = None
+    attribute = False
+    loop = None
+    header = None
+    local_function = False
+    method = False
+    previous = None
+
+    def name(position: int) -> str | bytes:
+        while len(names) <= position:
+            candidate = encode(next(candidates))
+            if candidate not in reserved:
+                names.append(candidate)
+        return names[position]
+
+    def declare(original, new) -> None:
+        stack.append(original)
+        scopes.setdefault(original, []).append(new)
+
+    def resolve(original):
+        shadows = scopes.get(original)
+        return shadows[-1] if shadows else original
+
+    def close(tok: Token, *kinds: str) -> str:
+        if not blocks or blocks[-1][0] not in kinds:
+            raise ValueError(f"unexpected {tok.value!r} at offset {tok.start}")
+        kind, size = blocks.pop()
+        while len(stack) > size:
+            scopes[stack.pop()].pop()
+        return kind
+
+    def active() -> bool:
+        return bool(expressions) and expressions[-1][0] == len(blocks)
+
+    def finish(tok: Token) -> None:
+        depth, nesting, after, declared = expressions.pop()
+        if declared is None:
+            close(tok, "repeat")
+        else:
+            for original, new in declared:
+                declare(original, new)
+
+    for index, tok in enumerate(tokens):
+        kind, value = tok.type, tok.value
+        following = tokens[index + 1].type if index + 1 < len(tokens) else None
+        retv.append(value)
+
+        if header is not None:
+            if header == "name":
+                if kind == lua.token.LPAREN:
+                    blocks.append(("function", len(stack)))
+                    if method:
+                        declare(self_name, self_name)
+                    header = "params"
+                elif kind == lua.token.COLON:
+                    method = True
+                elif kind == lua.token.NAME:
+                    if local_function:
+                        retv[-1] = name(len(stack))
+                        declare(value, retv[-1])
+                    elif previous not in (lua.token.DOT, lua.token.COLON):
+                        retv[-1] = resolve(value)
+            elif kind == lua.token.NAME:
+                retv[-1] = name(len(stack))
+                declare(value, retv[-1])
+            elif kind == lua.token.RPAREN:
+                header = None
+            previous = kind
+            continue
+
+        while active():
+            depth, nesting, after, declared = expressions[-1]
+            if nesting == 0 and (kind == lua.token.SEMICOLON or kind in CLOSERS
+                                 or (kind in KEYWORD_TYPES and kind not in EXPRESSION_KEYWORDS)
+                                 or (after and kind not in CONTINUATIONS)):
+                finish(tok)
+            else:
+                break
+        if active():
+            expression = expressions[-1]
+            if kind in OPENERS:
+                expression[1] += 1
+            elif kind in CLOSERS:
+                expression[1] -= 1
+            expression[2] = kind in OPERANDS or kind in CLOSERS
+
+        if declaring is not None:
+            if attribute:
+                # local x <const>
+                attribute = kind != lua.token.GREATERTHAN
+            elif kind == lua.token.NAME and previous in (lua.token.LOCAL, lua.token.COMMA):
+                retv[-1] = name(len(stack) + len(declaring))
+                declaring.append((value, retv[-1]))
+            elif kind == lua.token.LESSTHAN and previous == lua.token.NAME:
+                attribute = True
+            elif kind == lua.token.EQUALS:
+                expressions.append([len(blocks), 0, False, declaring])
+                declaring = None
+            elif kind != lua.token.COMMA:
+                for original, new in declaring:
+                    declare(original, new)
+                declaring = None
+            if declaring is not None or kind == lua.token.EQUALS:
+                previous = kind
+                continue
+        if loop is not None:
+            if kind == lua.token.NAME:
+                retv[-1] = name(len(stack) + len(loop))
+                loop.append((value, retv[-1]))
+            elif kind in (lua.token.EQUALS, lua.token.IN):
+                loops.append((len(blocks), loop))
+                loop = None
+            previous = kind
+            continue
+
+        if kind == lua.token.NAME:
+            if previous in (lua.token.DOT, lua.token.COLON, lua.token.GOTO):
+                pass
+            elif previous == lua.token.NUMBER and tokens[index - 1].end == tok.start:
+                # the rest of a numeral this tokenizer does not read whole, like 0x1p4
+                pass
+            elif previous == lua.token.DOUBLECOLON and following == lua.token.DOUBLECOLON:
+                pass
+            elif (following == lua.token.EQUALS and previous in (lua.token.LBRACKET, lua.token.COMMA, lua.token.SEMICOLON)
+                  and brackets and brackets[-1] == (lua.token.LBRACKET, len(blocks))):
+                pass
+            else:
+                retv[-1] = resolve(value)
+        elif kind == lua.token.LOCAL:
+            declaring = []
+        elif kind == lua.token.FUNCTION:
+            header = "name"
+            local_function = previous == lua.token.LOCAL
+            method = False
+        elif kind == lua.token.FOR:
+            loop = []
+        elif kind in OPENERS:
+            brackets.append((kind, len(blocks)))
+        elif kind in CLOSERS:
+            if brackets:
+                brackets.pop()
+        elif kind == lua.token.DO:
+            blocks.append(("do", len(stack)))
+            if loops and loops[-1][0] == len(blocks) - 1:
+                for original, new in loops.pop()[1]:
+                    declare(original, new)
+        elif kind == lua.token.THEN:
+            blocks.append(("then", len(stack)))
+        elif kind == lua.token.ELSEIF:
+            close(tok, "then")
+        elif kind == lua.token.ELSE:
+            close(tok, "then")
+            blocks.append(("then", len(stack)))
+        elif kind == lua.token.END:
+            if close(tok, "do", "then", "function") == "function" and active():
+                expressions[-1][2] = True
+        elif kind == lua.token.REPEAT:
+            blocks.append(("repeat", len(stack)))
+        elif kind == lua.token.UNTIL:
+            if not blocks or blocks[-1][0] != "repeat":
+                raise ValueError(f"unexpected {value!r} at offset {tok.start}")
+            expressions.append([len(blocks), 0, False, None])
+        previous = kind
+
+    end = Token(lua.token.EOF, "", tokens[-1].end if tokens else 0, tokens[-1].end if tokens else 0)
+    while active():
+        finish(end)
+    if blocks or expressions or header is not None or loop is not None:
+        raise ValueError("unfinished block at the end of the chunk")
+    return retv
+
+
+def array_source(tokens: TokenArray) -> str | bytes:
+    """ the source of `tokens`, as something its slices can be joined from """
+    return bytes(tokens.source) if isinstance(tokens.source, memoryview) else tokens.source
+
+
+def shebang(tokens: Iterable[Token]) -> tuple[str | bytes | None, Iterable[Token]]:
+    """ split off a first line starting with `#`, which lua skips, giving
+    its text (None without one) and the tokens after it """
+    if isinstance(tokens, TokenArray):
+        source = array_source(tokens)
+        if source[:1] not in ("#", b"#"):
+            return None, tokens
+        end = source.find("\n" if isinstance(source, str) else b"\n")
+        end = len(source) if end < 0 else end
+        return source[:end], tokens[bisect_left(tokens.starts, end):]
+    tokens = iter(tokens)
+    first = next(tokens, None)
+    if first is None:
+        return None, ()
+    if first.start != 0 or first.value[:1] not in ("#", b"#"):
+        return None, chain((first,), tokens)
+    parts = [first.value]
+    end = first.end
+    for tok in tokens:
+        # the line ends at a NEWLINE, or at the gap layout tokens leave for one
+        if tok.type == lua.token.NEWLINE or tok.start != end or tok.type in LAYOUT_TYPES:
+            return first.value[:0].join(parts), chain((tok,), tokens)
+        parts.append(tok.value)
+        end = tok.end
+    return first.value[:0].join(parts), ()
+
+
+def significant_tokens(tokens: Iterable[Token]) -> Iterator[Token]:
+    """ the tokens `minify` keeps, as `Token`s; made straight from the
+    columns of a `TokenArray` """
+    if isinstance(tokens, TokenArray):
+        source = array_source(tokens)
+        for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+            ts = token_kinds[kind]
+            if ts not in DROPPED_TYPES and not (ts == lua.token.UNKNOWN and source[start:end].isspace()):
+                yield Token(ts, source[start:end], start, end)
+        return
+    for tok in tokens:
+        if tok.type not in DROPPED_TYPES and not (tok.type == lua.token.UNKNOWN and tok.value.isspace()):
+            yield tok
+
+
+def significant_values(tokens: Iterable[Token]) -> Iterator[tuple[bool, bool, str | bytes]]:
+    """ (touches the token before it in the source, is UNKNOWN, value) of the
+    tokens `minify` keeps; read straight from the columns of a `TokenArray` """
+    unknown = lua.token.UNKNOWN
+    previous = -1
+    if isinstance(tokens, TokenArray):
+        source = array_source(tokens)
+        dropped = frozenset(kind_codes[ts] for ts in DROPPED_TYPES)
+        unknown = kind_codes[unknown]
+        for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+            if kind not in dropped:
+                value = source[start:end]
+                if kind != unknown:
+                    yield start == previous, False, value
+                elif not value.isspace():
+                    yield start == previous, True, value
+                else:
+                    continue
+                previous = end
+        return
+    for tok in tokens:
+        if tok.type not in DROPPED_TYPES:
+            if tok.type != unknown:
+                yield tok.start == previous, False, tok.value
+            elif not tok.value.isspace():
+                yield tok.start == previous, True, tok.value
+            else:
+                continue
+            previous = tok.end
+
+
+def minify(tokens: Iterable[Token], out: IO, rename: bool = False, buffer_size: int = 1 << 16) -> None:
+    """ write `tokens` back out as small as they go.
+
+    Comments and layout are dropped (tabs and carriage returns, which are
+    UNKNOWN tokens, with them). Tokens that touched in the source still do;
+    between the others a space is written only where the master pattern,
+    run over the text without it, would not end the first token in the same
+    place, or after a numeral that would touch a letter, digit or dot (which
+    lua reads as one malformed numeral). The pattern is only run where the
+    characters either side could be part of one token; next to a character
+    past ASCII a space is always written. An UNKNOWN token that would run on
+    over a space, such as a string missing its closing quote, is followed
+    by a newline instead. A first line starting with `#` is kept as is.
+
+    Tokens are read and written as they come, except with `rename`, which
+    renames local variables with `rename_locals` and so reads all of them
+    first.
+    """
+    line, tokens = shebang(tokens)
+    if line is not None:
+        out.write(line + ("\n" if isinstance(line, str) else b"\n"))
+    if rename:
+        kept = list(significant_tokens(tokens))
+        values = zip((index > 0 and tok.start == kept[index - 1].end for index, tok in enumerate(kept)),
+                     (tok.type == lua.token.UNKNOWN for tok in kept), rename_locals(kept))
+    else:
+        values = significant_values(tokens)
+    first = next(values, None)
+    if first is None:
+        return
+    touching, previous_unknown, previous = first
+    binary = not isinstance(previous, str)
+    match = master_scanner(binary)[0].match
+    space, newline, joiner = (b" ", b"\n", b"") if binary else (" ", "\n", "")
+    numeral, word = (byte_numeral_start, byte_numeral_touching) if binary else (numeral_start, numeral_touching)
+    joining = joining_bytes if binary else joining_characters
+    # the first character past ASCII (bytes index to ints)
+    wide = 0x80 if binary else "\x80"
+    parts = [previous]
+    size = len(previous)
+    following = next(values, None)
+    while following is not None:
+        touching, unknown, value = following
+        following = next(values, None)
+        last, first = previous[-1], value[0]
+        if not touching and (previous_unknown or ((last in joining or last >= wide) and (first in joining or first >= wide))):
+            text = previous + value if following is None else previous + value + following[2]
+            if previous_unknown and match(previous + space + value).end() != len(previous):
+                parts.append(newline)
+            elif (last >= wide or first >= wide or match(text).end() != len(previous)
+                  or (numeral.match(previous) and word.match(value))):
+                parts.append(space)
+        parts.append(value)
+        size += len(value)
+        if size >= buffer_size:
+            out.write(joiner.join(parts))
+            parts.clear()
+            size = 0
+        previous_unknown, previous = unknown, value
+    out.write(joiner.join(parts))
+
+
+def minify_source(code: str | bytes, rename: bool = False) -> str | bytes:
+    """ `minify` of `code`, as a string (bytes for a bytes source) """
+    out = io.StringIO() if isinstance(code, str) else io.BytesIO()
+    minify(tokenize_lua_array(code), out, rename)
+    return out.getvalue()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="write a lua file back out from its tokens, as is or minified")
+    parser.add_argument("path", help="lua file, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--minify", action="store_true", help="drop comments and whitespace")
+    parser.add_argument("--rename", action="store_true", help="with --minify, also shorten local variable names")
+    parser.add_argument("--encoding", default="utf-8", help="source encoding (default: utf-8)")
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding=args.encoding, newline="")
+    try:
+        tokens = iter_scan_tokens(read_chunks(stream, encoding=args.encoding))
+        if args.minify:
+            minify(tokens, out, args.rename)
+        else:
+            detokenize(tokens, out)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
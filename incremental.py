@@ -0,0 +1,155 @@
+import functools
+from array import array
+from typing import Iterator
+from objects import Token
+from tokenarray import token_kinds, kind_codes, lexeme_codes, TokenArray
+from tokenizer import master_scanner, classified_groups, layout_tokens
+
+
+@functools.cache
+def scan_tables() -> tuple[dict[str, int], frozenset[str]]:
+    """ kind codes of the master pattern groups, and the groups refined
+    through `lexeme_codes` """
+    master_pattern, master_groups = master_scanner()
+    group_codes = {group: kind_codes[ts] for group, ts in master_groups.items()}
+    return group_codes, classified_groups(master_groups)
+
+
+def scan_codes(code: str, pos: int = 0) -> Iterator[tuple[int, int, int]]:
+    """ scan `code` from `pos` as (kind code, start, end) tuples """
+    master_pattern = master_scanner()[0]
+    group_codes, classified = scan_tables()
+    for find in master_pattern.finditer(code, pos):
+        group = find.lastgroup
+        kind = group_codes[group]
+        if group in classified:
+            kind = lexeme_codes.get(find.group(), kind)
+        yield kind, find.start(), find.end()
+
+
+class IncrementalTokens:
+    """ the scanned tokens of a source that is edited in place.
+
+    Keeps the raw scan (NEWLINE and WHITESPACE included) in `array` buffers.
+    An edit re-lexes from the start of the line holding the first damaged
+    token until the new scan lands on the start of an old token past the
+    edit; the old tokens from there on are kept. Their offsets are shifted
+    lazily: tokens from `split` on are stored `delta` short of their actual
+    offsets, so an edit only rewrites the offsets between the previous edit
+    and this one.
+
+    Iterating gives the raw `Token`s; `layout()` gives what `tokenize_lua`
+    returns for the current source.
+    """
+
+    def __init__(self, code: str):
+        self.source = code
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        for kind, start, end in scan_codes(code):
+            self.kinds.append(kind)
+            self.starts.append(start)
+            self.ends.append(end)
+        self.split = len(self.kinds)
+        self.delta = 0
+
+    def start(self, index: int) -> int:
+        return self.starts[index] + (self.delta if index >= self.split else 0)
+
+    def end(self, index: int) -> int:
+        return self.ends[index] + (self.delta if index >= self.split else 0)
+
+    def find(self, offset: int) -> int:
+        """ index of the token holding `offset` """
+        low, high = 0, len(self.kinds)
+        while low < high:
+            mid = (low + high) // 2
+            if self.start(mid) <= offset:
+                low = mid + 1
+            else:
+                high = mid
+        return max(low - 1, 0)
+
+    def line_start(self, index: int) -> int:
+        """ walk back from `index` to the first token of its line """
+        while index > 0 and self.source[self.start(index) - 1] != "\n":
+            index -= 1
+        return index
+
+    def move_split(self, index: int) -> None:
+        starts, ends, delta = self.starts, self.ends, self.delta
+        for i in range(self.split, index):
+            starts[i] += delta
+            ends[i] += delta
+        for i in range(index, self.split):
+            starts[i] -= delta
+            ends[i] -= delta
+        self.split = index
+
+    def edit(self, offset: int, deleted: int, inserted: str) -> tuple[int, int, int]:
+        """ replace `deleted` characters at `offset` with `inserted` and
+        re-lex the damaged tokens.
+
+        Returns:
+            tuple[int, int, int]: the index of the first replaced token, how
+            many old tokens were replaced and how many new tokens took their place
+        """
+        old = self.source
+        code = old[:offset] + inserted + old[offset+deleted:]
+        shift = len(inserted) - deleted
+        stop = offset + len(inserted)
+        length = len(self.kinds)
+
+        # an unfinished long bracket runs to the end of the source, so an edit
+        # that could close it always lands in its token
+        index = self.line_start(self.find(offset - 1)) if offset and length else 0
+        restart = self.start(index) if index < length else 0
+
+        kinds, starts, ends = array("B"), array("q"), array("q")
+        reuse = index
+        for kind, start, end in scan_codes(code, restart):
+            # past the edit, with an unchanged character before it, a token
+            # starting where an old one did resynchronizes the two scans
+            if start > stop:
+                old_start = start - shift
+                while reuse < length and self.start(reuse) < old_start:
+                    reuse += 1
+                if reuse < length and self.start(reuse) == old_start:
+                    break
+            kinds.append(kind)
+            starts.append(start)
+            ends.append(end)
+        else:
+            reuse = length
+
+        self.move_split(reuse)
+        self.kinds[index:reuse] = kinds
+        self.starts[index:reuse] = starts
+        self.ends[index:reuse] = ends
+        self.split = index + len(kinds)
+        self.delta += shift
+        self.source = code
+        return index, reuse - index, len(kinds)
+
+    def layout(self) -> Iterator[Token]:
+        return layout_tokens(self)
+
+    def to_array(self) -> TokenArray:
+        """ the current tokens of `tokenize_lua` as a `TokenArray` """
+        return TokenArray.from_tokens(self.layout(), self.source)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        if index < 0:
+            index += len(self.kinds)
+        if not 0 <= index < len(self.kinds):
+            raise IndexError("token index out of range")
+        start, end = self.start(index), self.end(index)
+        return Token(token_kinds[self.kinds[index]], self.source[start:end], start, end)
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.kinds)):
+            yield self[index]
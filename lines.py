@@ -0,0 +1,69 @@
+import re
+import functools
+from array import array
+from bisect import bisect_right
+
+
+newline = re.compile("\n")
+byte_newline = re.compile(b"\n")
+
+
+class LineIndex:
+    """ the start offset of every line of a source, found in one pass.
+
+    Maps an offset to its line and column with a binary search instead of
+    a rescan of the source. Lines are numbered from 1 and columns from 0,
+    both counted in the units of the source: characters for text, bytes for
+    bytes like sources (bytes, memoryview, mmap), matching token offsets.
+    The pass is made the first time a line is looked up, so an index can be
+    handed out with every scan at no cost.
+    """
+
+    def __init__(self, source: str | bytes):
+        self.source = source
+
+    @functools.cached_property
+    def starts(self) -> array:
+        pattern = newline if isinstance(self.source, str) else byte_newline
+        retv = array("q", [0])
+        retv.extend(find.end() for find in pattern.finditer(self.source))
+        return retv
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def line(self, offset: int) -> int:
+        """ the line holding `offset` """
+        return bisect_right(self.starts, offset)
+
+    def position(self, offset: int) -> tuple[int, int]:
+        """ the (line, column) of `offset` """
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1]
+
+    def offset(self, line: int, column: int = 0) -> int:
+        """ the offset of `column` on `line` """
+        return self.start(line) + column
+
+    def start(self, line: int) -> int:
+        if not 1 <= line <= len(self.starts):
+            raise IndexError("line number out of range")
+        return self.starts[line - 1]
+
+    def end(self, line: int) -> int:
+        """ the offset just past `line`, its newline included """
+        if line < len(self.starts):
+            return self.start(line + 1)
+        self.start(line)
+        return len(self.source)
+
+    def segment(self, first: int, last: int = None) -> str | bytes:
+        """ the text of lines `first` to `last` (inclusive, defaults to
+        `first`), with their newlines """
+        segment = self.source[self.start(first):self.end(first if last is None else last)]
+        return segment if isinstance(segment, str) else bytes(segment)
+
+    def __getitem__(self, line: int) -> str | bytes:
+        """ the text of `line`, without its newline """
+        segment = self.segment(line)
+        return segment[:-1] if segment[-1:] in ("\n", b"\n") else segment
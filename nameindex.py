@@ -0,0 +1,432 @@
+import os
+import sys
+import mmap
+import struct
+import argparse
+import tempfile
+import multiprocessing
+from contextlib import ExitStack
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator
+from Lua import lua, KEYWORD_KINDS
+from tokenarray import kind_codes
+from tokenizer import tokenize_lua_array, mapped_file
+from cache import specification_hash
+from corpus import collect
+from lines import LineIndex
+
+
+# An identifier index file, all integers little endian:
+#
+#   header      magic b"PUAN", format version (u16), flags (u16), file count
+#               (u32), term count (u32), path table size in bytes (u64), term
+#               table size in bytes (u64), posting count (u64) and the
+#               tokenizer specification hash (16 bytes); 56 bytes
+#   files       per file: mtime in nanoseconds (i64), then size (i64), then
+#               the end of its path in the path table (u64), as three columns
+#   paths       the file paths, utf-8, one after another
+#   terms       per term: the end of its text in the term table (u64), then
+#               the end of its postings (u64), as two columns, sorted by text
+#   term table  the identifiers, as they appear in the source, one after
+#               another
+#   postings    per occurrence, grouped by term and sorted by file and offset:
+#               the file (u32), then the byte offset into it (u32), as two
+#               columns
+#
+# The path table, the term table and each postings column are padded with
+# zeros to a multiple of 8 bytes, so every column can be used in place.
+MAGIC = b"PUAN"
+FORMAT_VERSION = 1
+header = struct.Struct("<4sHHIIQQQ16s")
+
+# token kinds whose text is indexed: names, and keywords, which are names
+# the tokenizer classified
+INDEXED_KINDS = frozenset(kind_codes[kind] for kind in (lua.token.NAME, *KEYWORD_KINDS.values()) if kind in kind_codes)
+# offsets are stored as u32
+MAX_FILE_SIZE = 1 << 32
+
+
+def padded(size: int) -> int:
+    return size + -size % 8
+
+
+def column(view: memoryview, offset: int, count: int, code: str) -> tuple[memoryview | array, int]:
+    """ `count` items of type `code` at `offset`, and the offset after them """
+    size = array(code).itemsize * count
+    data = view[offset:offset+size]
+    if sys.byteorder == "big":
+        data = array(code, data.tobytes())
+        data.byteswap()
+    else:
+        data = data.cast(code)
+    return data, offset + padded(size)
+
+
+def little_endian(data: array) -> bytes:
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes() + b"\0" * (padded(len(data) * data.itemsize) - len(data) * data.itemsize)
+
+
+def index_file(path: str) -> tuple[str, int, int, dict[bytes, array]]:
+    """ the identifiers of one file, as (path, mtime_ns, size, {identifier:
+    byte offsets}). A file that cannot be read or is too large has no
+    identifiers. """
+    names = {}
+    try:
+        stat = os.stat(path)
+        mtime, size = stat.st_mtime_ns, stat.st_size
+        if size < MAX_FILE_SIZE:
+            with mapped_file(path) as content:
+                tokens = tokenize_lua_array(content)
+                indexed = INDEXED_KINDS
+                for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+                    if kind in indexed:
+                        name = content[start:end]
+                        offsets = names.get(name)
+                        if offsets is None:
+                            offsets = names[name] = array("I")
+                        offsets.append(start)
+    except OSError:
+        mtime, size = 0, -1
+    return path, mtime, size, names
+
+
+def pack_index(files: list[tuple[str, int, int]], postings: dict[bytes, tuple[array, array]]) -> bytes:
+    """ serialize an index of `files`, (path, mtime_ns, size) each, and
+    `postings`, {identifier: (file numbers, offsets)} each sorted by file and
+    offset """
+    mtimes, sizes, path_ends = array("q"), array("q"), array("Q")
+    paths = bytearray()
+    for path, mtime, size in files:
+        paths += path.encode("utf-8", "surrogateescape")
+        mtimes.append(mtime)
+        sizes.append(size)
+        path_ends.append(len(paths))
+    term_ends, posting_ends = array("Q"), array("Q")
+    terms = bytearray()
+    file_column, offset_column = array("I"), array("I")
+    for term in sorted(postings):
+        numbers, offsets = postings[term]
+        terms += term
+        file_column += numbers
+        offset_column += offsets
+        term_ends.append(len(terms))
+        posting_ends.append(len(file_column))
+    return b"".join((
+        header.pack(MAGIC, FORMAT_VERSION, 0, len(files), len(postings), len(paths), len(terms),
+                    len(file_column), bytes.fromhex(specification_hash())),
+        little_endian(mtimes), little_endian(sizes), little_endian(path_ends),
+        paths, b"\0" * (padded(len(paths)) - len(paths)),
+        little_endian(term_ends), little_endian(posting_ends),
+        terms, b"\0" * (padded(len(terms)) - len(terms)),
+        little_endian(file_column), little_endian(offset_column)))
+
+
+def write_index(path: str, files: list[tuple[str, int, int]], postings: dict[bytes, tuple[array, array]]) -> None:
+    """ write `pack_index(files, postings)` to `path` through a temporary
+    file renamed into place, so readers see the old index or the new one """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pack_index(files, postings))
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class Terms:
+    """ the sorted identifiers of a `NameIndex`, as a sequence of bytes to bisect """
+
+    def __init__(self, table: memoryview, ends):
+        self.table = table
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.table[self.ends[index - 1] if index else 0:self.ends[index]].tobytes()
+
+
+class NameIndex:
+    """ an inverted index from identifier to the files and byte offsets where
+    it occurs, read in place through a memory map.
+
+    The identifiers are stored sorted, so finding one, or every identifier
+    with a prefix, is a binary search over the mapping: nothing is read up
+    front and a lookup touches a few pages whatever the size of the corpus.
+
+    An index is made and kept current with `update_index`, which only
+    tokenizes the files that are new or changed since the last update.
+    Paths are absolute and offsets are byte offsets; `locate` turns them into
+    lines and columns.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, flags, file_count, term_count, paths_size, terms_size,
+             posting_count, self.specification) = header.unpack_from(self.mapping, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.mapping.close()
+            raise ValueError(f"{path} is not an identifier index")
+        size = (header.size + 3*8*file_count + padded(paths_size) + 2*8*term_count + padded(terms_size)
+                + 2*padded(4*posting_count))
+        if len(self.mapping) < size:
+            self.mapping.close()
+            raise ValueError(f"{path} is truncated")
+        view = self.view = memoryview(self.mapping)
+        self.mtimes, offset = column(view, header.size, file_count, "q")
+        self.sizes, offset = column(view, offset, file_count, "q")
+        self.path_ends, offset = column(view, offset, file_count, "Q")
+        self.paths = view[offset:offset+paths_size]
+        self.term_ends, offset = column(view, offset + padded(paths_size), term_count, "Q")
+        self.posting_ends, offset = column(view, offset, term_count, "Q")
+        self.terms = Terms(view[offset:offset+terms_size], self.term_ends)
+        self.files, offset = column(view, offset + padded(terms_size), posting_count, "I")
+        self.offsets, offset = column(view, offset, posting_count, "I")
+
+    def close(self) -> None:
+        for data in (self.mtimes, self.sizes, self.path_ends, self.paths, self.term_ends, self.posting_ends,
+                     self.terms.table, self.files, self.offsets, self.view):
+            if isinstance(data, memoryview):
+                data.release()
+        self.mapping.close()
+
+    def __enter__(self) -> "NameIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, name: str) -> bool:
+        return self.search(name) is not None
+
+    @property
+    def current(self) -> bool:
+        """ the index was made with the tokenizer specification in use """
+        return self.specification.hex() == specification_hash()
+
+    def path(self, number: int) -> str:
+        return self.paths[self.path_ends[number - 1] if number else 0:self.path_ends[number]].tobytes().decode("utf-8", "surrogateescape")
+
+    def file_states(self) -> dict[str, tuple[int, int]]:
+        """ {path: (mtime_ns, size)} of every indexed file """
+        return {self.path(number): (self.mtimes[number], self.sizes[number]) for number in range(len(self.path_ends))}
+
+    def search(self, name: str | bytes) -> int | None:
+        """ the number of the term `name`, or None """
+        if isinstance(name, str):
+            name = name.encode("utf-8")
+        index = bisect_left(self.terms, name)
+        if index < len(self.terms) and self.terms[index] == name:
+            return index
+        return None
+
+    def postings(self, index: int) -> tuple:
+        """ the file numbers and offsets of term `index` """
+        start, end = self.posting_ends[index - 1] if index else 0, self.posting_ends[index]
+        return self.files[start:end], self.offsets[start:end]
+
+    def hits(self, index: int) -> list[tuple[str, int]]:
+        numbers, offsets = self.postings(index)
+        paths = {}
+        retv = []
+        for number, offset in zip(numbers, offsets):
+            path = paths.get(number)
+            if path is None:
+                path = paths[number] = self.path(number)
+            retv.append((path, offset))
+        # files indexed by later updates are numbered after the rest
+        retv.sort()
+        return retv
+
+    def find(self, name: str | bytes) -> list[tuple[str, int]]:
+        """ every (path, byte offset) where `name` occurs, by path and offset """
+        index = self.search(name)
+        return [] if index is None else self.hits(index)
+
+    def prefix_range(self, prefix: str | bytes) -> range:
+        """ the numbers of the terms starting with `prefix` """
+        if isinstance(prefix, str):
+            prefix = prefix.encode("utf-8")
+        start = stop = bisect_left(self.terms, prefix)
+        # the first term past every term with the prefix; searching for it
+        # keeps a short prefix as fast as a long one
+        for end in range(len(prefix) - 1, -1, -1):
+            if prefix[end] < 255:
+                stop = bisect_left(self.terms, prefix[:end] + bytes((prefix[end] + 1,)), start)
+                break
+        else:
+            stop = len(self.terms)
+        return range(start, stop)
+
+    def names(self, prefix: str | bytes = "") -> Iterator[str]:
+        """ the identifiers starting with `prefix`, sorted """
+        for index in self.prefix_range(prefix):
+            yield self.terms[index].decode("utf-8", "surrogateescape")
+
+    def find_prefix(self, prefix: str | bytes) -> dict[str, list[tuple[str, int]]]:
+        """ `find` of every identifier starting with `prefix` """
+        return {self.terms[index].decode("utf-8", "surrogateescape"): self.hits(index) for index in self.prefix_range(prefix)}
+
+
+def locate(hits: Iterable[tuple[str, int]]) -> list[tuple[str, int, int]]:
+    """ (path, line, column) of (path, byte offset) hits, reading each file
+    once; the files must not have changed since they were indexed """
+    lines = {}
+    retv = []
+    with ExitStack() as mappings:
+        for path, offset in hits:
+            index = lines.get(path)
+            if index is None:
+                index = lines[path] = LineIndex(mappings.enter_context(mapped_file(path)))
+            retv.append((path, *index.position(offset)))
+    return retv
+
+
+def index_files(files: list[str], workers: int = None, chunksize: int = None) -> Iterator[tuple]:
+    """ `index_file` of every file, in order, across a process pool """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(files) < 2:
+        yield from map(index_file, files)
+        return
+    if chunksize is None:
+        chunksize = max(1, min(64, len(files) // (workers * 8)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(index_file, files, chunksize)
+
+
+def update_index(path: str, paths: Iterable[str], workers: int = None, rebuild: bool = False) -> dict:
+    """ bring the index at `path` up to date with the files in `paths` (files,
+    directories or glob patterns, as `corpus.collect` takes them), making it
+    if it does not exist.
+
+    Files whose mtime and size match the index keep their postings; only new
+    and changed files are tokenized, and files no longer in `paths` are
+    dropped. The whole index is made again when `rebuild` is set, or when it
+    was made with a different tokenizer specification.
+
+    Returns:
+        dict: the number of files kept, indexed and removed, and of terms
+    """
+    current = {}
+    for file in collect(paths):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        current[os.path.abspath(file)] = (stat.st_mtime_ns, stat.st_size)
+
+    files = []
+    postings = {}
+    removed = 0
+    old = None
+    if not rebuild:
+        try:
+            old = NameIndex(path)
+        except (FileNotFoundError, ValueError):
+            pass
+        else:
+            if not old.current:
+                old.close()
+                old = None
+    if old is not None:
+        with old:
+            renumber = array("q")
+            for number, (file, state) in enumerate(old.file_states().items()):
+                if current.get(file) == state:
+                    renumber.append(len(files))
+                    files.append((file, *state))
+                else:
+                    renumber.append(-1)
+            stale = len(renumber) - len(files)
+            removed = sum(1 for file in old.file_states() if file not in current)
+            for index in range(len(old)):
+                # copied, so no view of the mapping outlives it
+                numbers, offsets = (array("I", data.tobytes()) for data in old.postings(index))
+                if not stale:
+                    entry = (numbers, offsets)
+                else:
+                    entry = (array("I"), array("I"))
+                    for number, offset in zip(numbers, offsets):
+                        number = renumber[number]
+                        if number >= 0:
+                            entry[0].append(number)
+                            entry[1].append(offset)
+                    if not entry[0]:
+                        continue
+                postings[old.terms[index]] = entry
+
+    kept = len(files)
+    indexed = set(file for file, mtime, size in files)
+    changed = [file for file in current if file not in indexed]
+    for file, mtime, size, names in index_files(changed, workers):
+        number = len(files)
+        files.append((file, mtime, size))
+        for name, offsets in names.items():
+            entry = postings.get(name)
+            if entry is None:
+                entry = postings[name] = (array("I"), array("I"))
+            entry[0].extend(array("I", (number,)) * len(offsets))
+            entry[1].extend(offsets)
+    write_index(path, files, postings)
+    return {"files": len(files), "kept": kept, "indexed": len(changed), "removed": removed, "terms": len(postings)}
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="an inverted index of the identifiers of a corpus of lua files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="make or update an index")
+    update.add_argument("index", help="index file")
+    update.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+    update.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    update.add_argument("--rebuild", action="store_true", help="index every file again")
+    find = commands.add_parser("find", help="print where identifiers occur, as path:line:column")
+    find.add_argument("index", help="index file")
+    find.add_argument("names", nargs="+", help="identifiers to look up")
+    find.add_argument("--prefix", action="store_true", help="look up every identifier starting with the names")
+    find.add_argument("--offsets", action="store_true", help="print byte offsets instead of lines and columns")
+    names = commands.add_parser("names", help="list the indexed identifiers")
+    names.add_argument("index", help="index file")
+    names.add_argument("prefix", nargs="?", default="", help="only identifiers starting with this")
+    args = parser.parse_args(argv)
+
+    if args.command == "update":
+        totals = update_index(args.index, args.paths, args.workers, args.rebuild)
+        print(f"{totals['files']} files ({totals['indexed']} indexed, {totals['removed']} removed), "
+              f"{totals['terms']} identifiers", file=sys.stderr)
+        return 0
+    with NameIndex(args.index) as index:
+        if args.command == "names":
+            for name in index.names(args.prefix):
+                print(name)
+            return 0
+        found = False
+        for name in args.names:
+            hits = [hit for hits in index.find_prefix(name).values() for hit in hits] if args.prefix else index.find(name)
+            found = found or bool(hits)
+            if args.offsets:
+                for path, offset in hits:
+                    print(f"{path}:{offset}")
+            else:
+                for path, line, column in locate(hits):
+                    print(f"{path}:{line}:{column}")
+        return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,57 @@
-from Lua import lua
+import functools
+from array import array
+from Lua import lua, LEXEME_KINDS, LEXEME_BYTE_KINDS, CLASSIFIED_TYPES, TRIVIA_TYPES
+from tokenizer import iter_significant_tokens, iter_scan_tokens, read_chunks, block_scanner
+from lines import LineIndex
 
 
 # Base classes for different node types
-class Node:...
+class Node:
+    """ base of the AST nodes.
+
+    `start` and `end` are the source offsets a node was parsed from, None
+    for nodes made by hand.
+    """
+    __slots__ = ("start", "end")
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    def segment(self, source):
+        """ the text of `source` this node was parsed from """
+        return source[self.start:self.end] if self.start is not None else None
+
+class Singleton(Node):
+    """ a node without fields, such as an operator: every class has one
+    shared instance, so making one allocates nothing """
+    __slots__ = ()
+
+    def __new__(cls):
+        instance = cls.__dict__.get("instance")
+        if instance is None:
+            instance = super().__new__(cls)
+            cls.instance = instance
+        return instance
+
+    def __init__(self):
+        pass
+
 # Contexts for variable references
-class ExprContext(Node):...
+class ExprContext(Singleton):...
 class Load(ExprContext):...
 class Store(ExprContext):...
 # Boolean operations
-class BoolOp(Node):...
+class BoolOp(Singleton):...
 class And(BoolOp):...
 class Or(BoolOp):...
 # Binary operators
-class Operator(Node):...
+class Operator(Singleton):...
 class Add(Operator):...
 class BitAnd(Operator):...
 class BitOr(Operator):...
 class BitXor(Operator):...
+class Concat(Operator):...
 class Div(Operator):...
 class FloorDiv(Operator):...
 class LShift(Operator):...
@@ -27,13 +62,14 @@ class Pow(Operator):...
 class RShift(Operator):...
 class Sub(Operator):...
 # Unary operators
-class UnaryOp(Node):...
+class UnaryOp(Singleton):...
 class Invert(UnaryOp):...
+class Len(UnaryOp):...
 class Not(UnaryOp):...
 class UAdd(UnaryOp):...
 class USub(UnaryOp):...
 # Comparison operators
-class CmpOp(Node):...
+class CmpOp(Singleton):...
 class Eq(CmpOp):...
 class Gt(CmpOp):...
 class GtE(CmpOp):...
@@ -42,284 +78,922 @@ class Is(CmpOp):...
 class IsNot(CmpOp):...
 class Lt(CmpOp):...
 class LtE(CmpOp):...
+class NotEq(CmpOp):...
 
 class Chunk(Node):
-    def __init__(self, body):
+    __slots__ = ("body",)
+
+    def __init__(self, body, start=None, end=None):
         self.body = body
+        self.start = start
+        self.end = end
 
 class Function(Node):
-    def __init__(self, name, params, body, is_local=False):
+    __slots__ = ("name", "params", "_body", "is_local")
+
+    def __init__(self, name, params, body, is_local=False, start=None, end=None):
         self.name = name
         self.params = params
-        self.body = body
+        self._body = body
         self.is_local = is_local
+        self.start = start
+        self.end = end
+
+    @property
+    def body(self):
+        """ the statements of the function; a `LazyBody` is parsed, and
+        replaced, the first time it is read """
+        body = self._body
+        if type(body) is LazyBody:
+            body = self._body = body.parse()
+        return body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+class LazyBody:
+    """ the body of a `Function` parsed lazily: the offsets of the source
+    text between its parameters and its `end`, parsed on first use """
+    __slots__ = ("source", "start", "end", "names")
+
+    def __init__(self, source, start, end, names):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.names = names
+
+    def parse(self):
+        parser = LuaParser((), source=self.source, lazy=True)
+        parser.names = self.names
+        parser.restart(self.start, self.end)
+        body = parser.parse_block()
+        if parser.current_token() is not None:
+            raise parser.error(f"Unexpected token: {parser.current_token()}")
+        return body
+
 
 class Local(Node):
-    def __init__(self, names, values=None):
+    __slots__ = ("names", "values")
+
+    def __init__(self, names, values=None, start=None, end=None):
         self.names = names
         self.values = values
+        self.start = start
+        self.end = end
 
 class Assignment(Node):
-    def __init__(self, targets, value):
+    __slots__ = ("targets", "value")
+
+    def __init__(self, targets, value, start=None, end=None):
         self.targets = targets
         self.value = value
+        self.start = start
+        self.end = end
 
 class If(Node):
-    def __init__(self, test, body, orelse=None):
+    __slots__ = ("test", "body", "orelse")
+
+    def __init__(self, test, body, orelse=None, start=None, end=None):
         self.test = test
         self.body = body
         self.orelse = orelse
+        self.start = start
+        self.end = end
 
 class While(Node):
-    def __init__(self, test, body):
+    __slots__ = ("test", "body")
+
+    def __init__(self, test, body, start=None, end=None):
         self.test = test
         self.body = body
+        self.start = start
+        self.end = end
 
 class For(Node):
-    def __init__(self, var, start, end, step, body):
+    __slots__ = ("var", "initial", "limit", "step", "body")
+
+    def __init__(self, var, initial, limit, step, body, start=None, end=None):
         self.var = var
-        self.start = start
-        self.end = end
+        self.initial = initial
+        self.limit = limit
         self.step = step
         self.body = body
+        self.start = start
+        self.end = end
 
 class ForIn(Node):
-    def __init__(self, vars, iter, body):
+    __slots__ = ("vars", "iter", "body")
+
+    def __init__(self, vars, iter, body, start=None, end=None):
         self.vars = vars
         self.iter = iter
         self.body = body
+        self.start = start
+        self.end = end
 
 class Return(Node):
-    def __init__(self, values):
+    __slots__ = ("values",)
+
+    def __init__(self, values, start=None, end=None):
         self.values = values
+        self.start = start
+        self.end = end
+
+class Break(Node):
+    __slots__ = ()
 
-class Break(Node):...
 class Expr(Node):
-    def __init__(self, value):
+    __slots__ = ("value",)
+
+    def __init__(self, value, start=None, end=None):
         self.value = value
+        self.start = start
+        self.end = end
 
 class BinOp(Node):
-    def __init__(self, left, op, right):
+    __slots__ = ("left", "op", "right")
+
+    def __init__(self, left, op, right, start=None, end=None):
         self.left = left
         self.op = op
         self.right = right
+        self.start = start
+        self.end = end
 
 class UnaryOp(Node):
-    def __init__(self, op, operand):
+    __slots__ = ("op", "operand")
+
+    def __init__(self, op, operand, start=None, end=None):
         self.op = op
         self.operand = operand
+        self.start = start
+        self.end = end
 
 class Call(Node):
-    def __init__(self, func, args):
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, args, start=None, end=None):
         self.func = func
         self.args = args
+        self.start = start
+        self.end = end
+
+# a method call, `value:method(args)`: `value` is evaluated once and passed
+# as the first argument, ahead of `args`
+class Invoke(Node):
+    __slots__ = ("value", "method", "args")
+
+    def __init__(self, value, method, args, start=None, end=None):
+        self.value = value
+        self.method = method
+        self.args = args
+        self.start = start
+        self.end = end
 
 class Name(Node):
-    def __init__(self, id):
+    __slots__ = ("id",)
+
+    def __init__(self, id, start=None, end=None):
         self.id = id
+        self.start = start
+        self.end = end
 
 class Constant(Node):
-    def __init__(self, value):
+    __slots__ = ("value",)
+
+    def __init__(self, value, start=None, end=None):
         self.value = value
+        self.start = start
+        self.end = end
 
 class Index(Node):
-    def __init__(self, value, index):
+    __slots__ = ("value", "index")
+
+    def __init__(self, value, index, start=None, end=None):
         self.value = value
         self.index = index
+        self.start = start
+        self.end = end
 
 class TableConstructor(Node):
-    def __init__(self, fields):
+    __slots__ = ("fields",)
+
+    def __init__(self, fields, start=None, end=None):
         self.fields = fields
+        self.start = start
+        self.end = end
 
 class TableField(Node):
-    def __init__(self, key, value):
+    __slots__ = ("key", "value")
+
+    def __init__(self, key, value, start=None, end=None):
         self.key = key
         self.value = value
+        self.start = start
+        self.end = end
 
 class Require(Node):
-    def __init__(self, module):
+    __slots__ = ("module",)
+
+    def __init__(self, module, start=None, end=None):
         self.module = module
+        self.start = start
+        self.end = end
+
 
 
+# binary operators by token kind, as (left binding power, right binding power,
+# operator). Left associative operators bind tighter to their right operand,
+# `..` and `^` are right associative and bind tighter to their left one.
+binary_operators = {
+    lua.token.OR:                 (2, 3, Or()),
+    lua.token.AND:                (4, 5, And()),
+    lua.token.LESSTHAN:           (6, 7, Lt()),
+    lua.token.GREATERTHAN:        (6, 7, Gt()),
+    lua.token.LESSTHANEQUALS:     (6, 7, LtE()),
+    lua.token.MORETHANEQUALS:     (6, 7, GtE()),
+    lua.token.TILDEEQUALS:        (6, 7, NotEq()),
+    lua.token.DOUBLEEQUALS:       (6, 7, Eq()),
+    lua.token.PIPE:               (8, 9, BitOr()),
+    lua.token.TILDE:              (10, 11, BitXor()),
+    lua.token.AMPERSAND:          (12, 13, BitAnd()),
+    lua.token.LSHIFT:             (14, 15, LShift()),
+    lua.token.RSHIFT:             (14, 15, RShift()),
+    lua.token.DOTDOT:             (17, 16, Concat()),
+    lua.token.PLUS:               (18, 19, Add()),
+    lua.token.MINUS:              (18, 19, Sub()),
+    lua.token.STAR:               (20, 21, Mult()),
+    lua.token.FORWARDSLASH:       (20, 21, Div()),
+    lua.token.DOUBLEFORWARDSLASH: (20, 21, FloorDiv()),
+    lua.token.PERCENT:            (20, 21, Mod()),
+    lua.token.CARET:              (25, 24, Pow()),
+}
+unary_operators = {
+    lua.token.NOT:     Not(),
+    lua.token.HASHTAG: Len(),
+    lua.token.MINUS:   USub(),
+    lua.token.TILDE:   Invert(),
+}
+# unary operators bind tighter than every binary operator but `^`
+unary_power = 22
+constants = {lua.token.NIL: None, lua.token.TRUE: True, lua.token.FALSE: False}
+# tokens that end a block
+block_ends = frozenset((lua.token.END, lua.token.ELSE, lua.token.ELSEIF, lua.token.UNTIL))
+# tokens opening a block closed by `end` or `until`, and the tokens closing one
+block_openers = frozenset((lua.token.FUNCTION, lua.token.DO, lua.token.IF, lua.token.REPEAT))
+block_closers = frozenset((lua.token.END, lua.token.UNTIL))
+# brackets `parse_expr` keeps open on its stack
+PAREN, CALL, ARGUMENT, INDEX, TABLE, KEY = range(6)
+# fields holding plain values (names, constants, flags) rather than nodes
+value_fields = {Function: {"name", "params", "is_local"}, Local: {"names"}, Name: {"id"}, Constant: {"value"}}
+
+
+@functools.cache
+def field_names(cls: type) -> tuple[str, ...]:
+    """ the fields `cls` itself adds, in `__slots__` order; a slot kept
+    behind a property, such as `Function._body`, goes by the property's name """
+    return tuple(name.lstrip("_") for name in cls.__dict__.get("__slots__", ()))
+
+
+def number(numeral):
+    """ the int or float a lua numeral stands for """
+    if isinstance(numeral, bytes):
+        numeral = numeral.decode()
+    if numeral[:2] in ("0x", "0X"):
+        try:
+            return int(numeral, 16)
+        except ValueError:
+            return float.fromhex(numeral)
+    try:
+        return int(numeral)
+    except ValueError:
+        return float(numeral)
+
+
+def string_value(text):
+    """ the contents of a STRING token: the text between its quotes, or
+    between the brackets of a long string, less the newline that may follow
+    the opener """
+    newline, bracket = ("\n", "[") if isinstance(text, str) else (b"\n", b"[")
+    if not text.startswith(bracket):
+        return text[1:-1]
+    size = text.index(bracket, 1) + 1
+    body = text[size:-size]
+    return body[1:] if body.startswith(newline) else body
+
+
+class Arena:
+    """ a flat store of AST nodes in parallel arrays.
+
+    Node `i` is of class `node_classes[kinds[i]]` and spans
+    `starts[i]:ends[i]` (-1 for no span). Its `field_names`, in order,
+    are the `slots` from `first[i]` on. A slot is `payload << 2 | tag`: a
+    node index (NODE), an index into `values` (VALUE: names, constants,
+    operators), the offset in `slots` of a list stored as its length and
+    then its items (LIST), or None (NONE).
+
+    Children are always added before their parents, so `to_node` rebuilds
+    the object tree in one pass over the indexes without recursion.
+    """
+    NODE, VALUE, LIST, NONE = range(4)
+    node_classes = [Chunk, Function, Local, Assignment, If, While, For, ForIn, Return, Break, Expr,
+                    BinOp, UnaryOp, Call, Name, Constant, Index, TableConstructor, TableField, Require, Invoke]
+    class_codes = {cls: code for code, cls in enumerate(node_classes)}
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.first = array("q")
+        self.slots = array("q")
+        self.values = []
+        self.value_index = {}
+
+    def value(self, value) -> int:
+        # equal values share an entry; they are indexed per type so 1, 1.0 and True stay apart
+        index_of = self.value_index.get(type(value))
+        if index_of is None:
+            index_of = self.value_index[type(value)] = {}
+        try:
+            index = index_of.get(value)
+        except TypeError:
+            index_of = index = None
+        if index is None:
+            index = len(self.values)
+            self.values.append(value)
+            if index_of is not None:
+                index_of[value] = index
+        return index << 2 | self.VALUE
+
+    def slot(self, value) -> int:
+        if value is None:
+            return self.NONE
+        if type(value) is int:
+            return value << 2 | self.NODE
+        if type(value) is list:
+            offset = len(self.slots)
+            self.slots.append(len(value))
+            self.slots.extend([item << 2 | self.NODE for item in value])
+            return offset << 2 | self.LIST
+        return self.value(value)
+
+    def add(self, cls, start, end, *fields) -> int:
+        """ store a `cls` node and return its index """
+        plain = value_fields.get(cls, ())
+        names = field_names(cls)
+        slots = []
+        for i, value in enumerate(fields):
+            if names[i] in plain:
+                slots.append(self.value(value))
+            else:
+                slots.append(self.slot(value))
+        slots.extend([self.NONE] * (len(names) - len(fields)))
+        self.kinds.append(self.class_codes[cls])
+        self.starts.append(-1 if start is None else start)
+        self.ends.append(-1 if end is None else end)
+        self.first.append(len(self.slots))
+        self.slots.extend(slots)
+        return len(self.kinds) - 1
+
+    def decode(self, slot: int, built: list):
+        payload, tag = slot >> 2, slot & 3
+        if tag == self.NODE:
+            return built[payload] if built is not None else payload
+        if tag == self.VALUE:
+            return self.values[payload]
+        if tag == self.LIST:
+            count = self.slots[payload]
+            return [self.decode(item, built) for item in self.slots[payload+1:payload+1+count]]
+        return None
+
+    def type(self, index: int) -> type:
+        return self.node_classes[self.kinds[index]]
+
+    def field(self, index: int, name: str):
+        """ a field of node `index`; child nodes are given as indexes """
+        position = field_names(self.type(index)).index(name)
+        return self.decode(self.slots[self.first[index] + position], None)
+
+    def segment(self, index: int, source):
+        start = self.starts[index]
+        return source[start:self.ends[index]] if start >= 0 else None
+
+    def to_node(self, index: int = None) -> Node:
+        """ the object tree of node `index`, by default the last node added """
+        if index is None:
+            index = len(self.kinds) - 1
+        built = []
+        for i in range(index + 1):
+            cls = self.node_classes[self.kinds[i]]
+            first = self.first[i]
+            names = field_names(cls)
+            fields = [self.decode(slot, built) for slot in self.slots[first:first+len(names)]]
+            start, end = self.starts[i], self.ends[i]
+            node = cls.__new__(cls)
+            for name, value in zip(names, fields):
+                setattr(node, name, value)
+            node.start, node.end = (start, end) if start >= 0 else (None, None)
+            built.append(node)
+        return built[index]
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
 
 class LuaParser:
-    def __init__(self, tokens):
-        tokens.append(None)
-        self.tokens = tokens
-        self.pos = 0
+    """ parses a stream of tokens into a `Chunk`.
+
+    `tokens` can be any iterable of tokens: a list, a `TokenArray`, or a
+    generator straight from the tokenizer. Whitespace, comments and layout
+    tokens are skipped as they are read. Only the next `lookahead` tokens are
+    held, in a ring buffer, so a consumed token is dropped and the whole
+    token list never has to exist.
+
+    Every node carries the offsets of the tokens it was parsed from. With an
+    `arena`, nodes are stored in it instead of being allocated as objects,
+    and the parse methods return node indexes. When the `source` is known
+    (a `TokenArray` brings its own), errors give the line and column.
+
+    With `lazy` set, function bodies are not parsed: the source is searched
+    for the matching `end` with `block_scanner`, counting the blocks opened
+    and closed on the way, without making tokens for the body, and reading
+    goes on from that `end` in the source rather than in `tokens`. The
+    `Function` keeps the offsets of its body, which is tokenized and parsed
+    (lazily again) when `body` is first read, so errors in a body surface
+    when it is read. Lazy parsing needs the source and object nodes; a lazy
+    body holds on to the source until it is parsed.
+    """
+    lookahead = 2
+
+    def __init__(self, tokens, arena=None, source=None, lazy=False):
+        self.source = getattr(tokens, "source", source)
+        if lazy and (self.source is None or arena is not None):
+            raise ValueError("lazy parsing needs the source, and cannot store nodes in an arena")
+        self.lazy = lazy
+        self.stop = None
+        self.lines = None
+        self.tokens = (token for token in tokens if token.type not in TRIVIA_TYPES)
+        self.buffer = [next(self.tokens, None) for i in range(self.lookahead)]
+        self.head = 0
+        self.last = None
+        self.arena = arena
+        self.names = {}
+
+    def restart(self, start, stop=None):
+        """ read the tokens of the source from offset `start` on, up to `stop` """
+        self.tokens = iter_significant_tokens(self.source, start, stop)
+        self.buffer = [next(self.tokens, None) for i in range(self.lookahead)]
+        self.head = 0
+        self.stop = stop
 
     def current_token(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        return self.buffer[self.head]
+
+    def peek(self):
+        return self.buffer[(self.head + 1) % self.lookahead]
 
-    def consume(self):
+    def check(self, type):
+        token = self.current_token()
+        return token is not None and token.type == type
+
+    def consume(self, type=None):
         token = self.current_token()
         if token is None:
-            raise Exception("Unexpected end of input")
-        self.pos += 1
+            raise self.error("Unexpected end of input")
+        if type is not None and token.type != type:
+            raise self.error(f"Expected {type}, got {token}", token)
+        self.buffer[self.head] = next(self.tokens, None)
+        self.head = (self.head + 1) % self.lookahead
+        self.last = token
         return token
 
+    def error(self, message, token=None):
+        """ an Exception for `message` at `token`, the current token by default """
+        if self.source is None:
+            return Exception(message)
+        token = token or self.current_token()
+        if self.lines is None:
+            self.lines = LineIndex(self.source)
+        line, column = self.lines.position(token.start if token is not None else len(self.source))
+        return Exception(f"{message} at line {line}, column {column}")
+
+    def name(self, token):
+        """ the value of a NAME token, shared with every earlier use of the same name """
+        return self.names.setdefault(token.value, token.value)
+
+    def new(self, cls, start, end, *fields):
+        if self.arena is not None:
+            return self.arena.add(cls, start, end, *fields)
+        return cls(*fields, start=start, end=end)
+
+    def start_of(self, node):
+        return self.arena.starts[node] if self.arena is not None else node.start
+
+    def end_of(self, node):
+        return self.arena.ends[node] if self.arena is not None else node.end
+
     def parse_chunk(self):
+        token = self.current_token()
+        body = self.parse_block()
+        if self.current_token() is not None:
+            raise self.error(f"Unexpected token: {self.current_token()}")
+        if token is None:
+            return self.new(Chunk, 0, 0, body)
+        return self.new(Chunk, token.start, self.last.end, body)
+
+    def parse_block(self):
         statements = []
-        while self.current_token():
+        while True:
+            token = self.current_token()
+            if token is None or token.type in block_ends:
+                return statements
+            if token.type == lua.token.SEMICOLON:
+                self.consume()
+                continue
             statements.append(self.parse_statement())
-        return Chunk(statements)
 
     def parse_statement(self):
-        token: Token = self.current_token()
-        if token.type == lua.token.NAME and token.value == lua.keyword.LOCAL:
+        token = self.current_token()
+        if token.type == lua.token.LOCAL:
             return self.parse_local()
-        elif token.type == lua.token.NAME and token.value == lua.keyword.FUNCTION:
+        elif token.type == lua.token.FUNCTION:
             return self.parse_function()
         elif token.type == lua.token.IF:
             return self.parse_if()
         elif token.type == lua.token.WHILE:
             return self.parse_while()
-        elif token.type == lua.token.WHILE:
+        elif token.type == lua.token.FOR:
             return self.parse_for()
         elif token.type == lua.token.RETURN:
             return self.parse_return()
         elif token.type == lua.token.BREAK:
             self.consume(lua.token.BREAK)
-            return Break()
+            return self.new(Break, token.start, token.end)
         else:
             return self.parse_assignment_or_expr()
 
     def parse_local(self):
-        self.consume(lua.token.LOCAL)  # local
-        names = [self.consume(lua.token.NAME).value]
-        if self.current_token().type == lua.token.OPERATOR and self.current_token().value == lua.object.ASSIGN:
-            self.consume(lua.token.OPERATOR)
-            values = [self.parse_expr()]
-            return Local(names, values)
-        return Local(names)
+        start = self.consume(lua.token.LOCAL).start
+        if self.check(lua.token.FUNCTION):
+            self.consume(lua.token.FUNCTION)
+            name = self.name(self.consume(lua.token.NAME))
+            return self.parse_function_body(name, True, start)
+        names = []
+        while True:
+            names.append(self.name(self.consume(lua.token.NAME)))
+            if self.check(lua.token.LESSTHAN):  # <const> or <close>
+                self.consume(lua.token.LESSTHAN)
+                self.consume(lua.token.NAME)
+                self.consume(lua.token.GREATERTHAN)
+            if not self.check(lua.token.COMMA):
+                break
+            self.consume(lua.token.COMMA)
+        if self.check(lua.token.EQUALS):
+            self.consume(lua.token.EQUALS)
+            values = self.parse_exprlist()
+            return self.new(Local, start, self.last.end, names, values)
+        return self.new(Local, start, self.last.end, names)
 
     def parse_function(self):
-        self.consume(lua.token.NAME)  # function
-        name = self.consume(lua.token.NAME).value
-        self.consume("LPAREN")
+        start = self.consume(lua.token.FUNCTION).start
+        name = self.name(self.consume(lua.token.NAME))
+        while self.check(lua.token.DOT):
+            name += self.consume().value + self.consume(lua.token.NAME).value
+        if self.check(lua.token.COLON):
+            name += self.consume().value + self.consume(lua.token.NAME).value
+        return self.parse_function_body(name, False, start)
+
+    def parse_function_body(self, name, is_local, start):
+        self.consume(lua.token.LPAREN)
         params = []
-        while self.current_token()["type"] != "RPAREN":
-            params.append(self.consume(lua.token.NAME).value)
-            if self.current_token()["type"] == "COMMA":
-                self.consume("COMMA")
-        self.consume("RPAREN")
-        body = self.parse_chunk()
-        self.consume("END")
-        return Function(name, params, body.body, is_local=False)
-
-    def parse_if(self):
-        self.consume("IF")
+        while not self.check(lua.token.RPAREN):
+            if self.check(lua.token.DOTDOTDOT):
+                params.append(self.consume().value)
+            else:
+                params.append(self.name(self.consume(lua.token.NAME)))
+            if not self.check(lua.token.COMMA):
+                break
+            self.consume(lua.token.COMMA)
+        body_start = self.consume(lua.token.RPAREN).end
+        if self.lazy:
+            body_end = self.skip_block()
+            end = self.consume(lua.token.END).end
+            body = LazyBody(self.source, body_start, body_end, self.names)
+        else:
+            body = self.parse_block()
+            end = self.consume(lua.token.END).end
+        return self.new(Function, start, end, name, params, body, is_local)
+
+    def skip_block(self):
+        """ skip to the `end` closing the current block and read on from it;
+        gives the offset of that `end` """
+        token = self.current_token()
+        if token is None:
+            raise self.error("Unexpected end of input")
+        binary = not isinstance(self.source, str)
+        pattern, groups = block_scanner(binary)
+        words = frozenset(group for group, ts in groups.items() if ts in CLASSIFIED_TYPES)
+        kinds = LEXEME_BYTE_KINDS if binary else LEXEME_KINDS
+        stop = len(self.source) if self.stop is None else self.stop
+        depth = 0
+        for find in pattern.finditer(self.source, token.start, stop):
+            if find.lastgroup not in words:
+                continue
+            kind = kinds.get(find.group())
+            if kind in block_openers:
+                depth += 1
+            elif kind in block_closers:
+                if depth:
+                    depth -= 1
+                    continue
+                self.restart(find.start(), self.stop)
+                if kind != lua.token.END:
+                    raise self.error(f"Unexpected token: {self.current_token()}")
+                return find.start()
+        self.restart(stop, self.stop)
+        raise self.error("Unexpected end of input")
+
+    def parse_if(self, keyword=lua.token.IF):
+        start = self.consume(keyword).start
         test = self.parse_expr()
-        self.consume("THEN")
-        body = self.parse_chunk()
+        self.consume(lua.token.THEN)
+        body = self.parse_block()
+        if self.check(lua.token.ELSEIF):
+            orelse = [self.parse_if(lua.token.ELSEIF)]
+            return self.new(If, start, self.last.end, test, body, orelse)
         orelse = []
-        if self.current_token()["type"] == "ELSE":
-            self.consume("ELSE")
-            orelse = self.parse_chunk().body
-        self.consume("END")
-        return If(test, body.body, orelse)
+        if self.check(lua.token.ELSE):
+            self.consume(lua.token.ELSE)
+            orelse = self.parse_block()
+        end = self.consume(lua.token.END).end
+        return self.new(If, start, end, test, body, orelse)
 
     def parse_while(self):
-        self.consume(lua.token.WHILE)
+        start = self.consume(lua.token.WHILE).start
         test = self.parse_expr()
         self.consume(lua.token.DO)
-        body = self.parse_chunk()
-        self.consume(lua.token.END)
-        return While(test, body.body)
+        body = self.parse_block()
+        end = self.consume(lua.token.END).end
+        return self.new(While, start, end, test, body)
 
     def parse_for(self):
-        self.consume(lua.token.FOR)
-        var = self.consume(lua.token.NAME).value
-        self.consume(lua.token.OPERATOR)  # =
-        start = self.parse_expr()
-        self.consume("COMMA")
-        end = self.parse_expr()
-        step = Constant(1)
-        if self.current_token()["type"] == "COMMA":
-            self.consume("COMMA")
-            step = self.parse_expr()
-        self.consume("DO")
-        body = self.parse_chunk()
-        self.consume("END")
-        return For(Name(var), start, end, step, body.body)
+        start = self.consume(lua.token.FOR).start
+        token = self.consume(lua.token.NAME)
+        var = self.new(Name, token.start, token.end, self.name(token))
+        if self.check(lua.token.EQUALS):
+            self.consume(lua.token.EQUALS)
+            initial = self.parse_expr()
+            self.consume(lua.token.COMMA)
+            limit = self.parse_expr()
+            if self.check(lua.token.COMMA):
+                self.consume(lua.token.COMMA)
+                step = self.parse_expr()
+            else:
+                step = self.new(Constant, None, None, 1)
+            self.consume(lua.token.DO)
+            body = self.parse_block()
+            end = self.consume(lua.token.END).end
+            return self.new(For, start, end, var, initial, limit, step, body)
+        vars = [var]
+        while self.check(lua.token.COMMA):
+            self.consume(lua.token.COMMA)
+            token = self.consume(lua.token.NAME)
+            vars.append(self.new(Name, token.start, token.end, self.name(token)))
+        self.consume(lua.token.IN)
+        iter = self.parse_exprlist()
+        self.consume(lua.token.DO)
+        body = self.parse_block()
+        end = self.consume(lua.token.END).end
+        return self.new(ForIn, start, end, vars, iter, body)
 
     def parse_return(self):
-        self.consume("RETURN")
-        values = [self.parse_expr()]
-        return Return(values)
+        start = self.consume(lua.token.RETURN).start
+        token = self.current_token()
+        values = []
+        if token is not None and token.type not in block_ends and token.type != lua.token.SEMICOLON:
+            values = self.parse_exprlist()
+        if self.check(lua.token.SEMICOLON):
+            self.consume(lua.token.SEMICOLON)
+        return self.new(Return, start, self.last.end, values)
 
     def parse_assignment_or_expr(self):
-        left = self.parse_expr()
-        if self.current_token() and self.current_token()["type"] == lua.token.OPERATOR and self.current_token().value == "=":
-            self.consume(lua.token.OPERATOR)
-            right = self.parse_expr()
-            return Assignment([left], right)
-        return Expr(left)
+        start = self.current_token().start
+        targets = self.parse_exprlist()
+        if self.check(lua.token.EQUALS):
+            self.consume(lua.token.EQUALS)
+            values = self.parse_exprlist()
+            return self.new(Assignment, start, self.last.end, targets, values)
+        if len(targets) > 1:
+            raise self.error(f"Unexpected token: {self.current_token()}")
+        return self.new(Expr, start, self.last.end, targets[0])
+
+    def parse_exprlist(self):
+        exprs = [self.parse_expr()]
+        while self.check(lua.token.COMMA):
+            self.consume(lua.token.COMMA)
+            exprs.append(self.parse_expr())
+        return exprs
 
     def parse_expr(self):
-        left = self.parse_term()
-        while self.current_token() and self.current_token()["type"] == "BIN_OP":
-            op = self.consume("BIN_OP").value
-            right = self.parse_term()
-            left = BinOp(left, self.transform_operator(op), right)
-        return left
-
-    def parse_term(self):
-        token = self.current_token()
-        if token.type == "NUMBER":
-            return Constant(float(self.consume("NUMBER").value))
-        elif token.type == "STRING":
-            return Constant(self.consume("STRING").value[1:-1])
-        elif token.type == lua.token.NAME:
-            name = self.consume(lua.token.NAME).value
-            if self.current_token() and self.current_token()["type"] == "LPAREN":
-                self.consume("LPAREN")
-                args = []
-                while self.current_token()["type"] != "RPAREN":
-                    args.append(self.parse_expr())
-                    if self.current_token()["type"] == "COMMA":
-                        self.consume("COMMA")
-                self.consume("RPAREN")
-                return Call(Name(name), args)
-            return Name(name)
-        elif token.type == "LPAREN":
-            self.consume("LPAREN")
-            expr = self.parse_expr()
-            self.consume("RPAREN")
-            return expr
-        elif token.type == "LBRACE":
-            return self.parse_table_constructor()
+        """ parse one expression.
+
+        Precedence climbing over explicit stacks instead of recursion:
+        `values` holds the finished operands and `stack` the pending
+        operators, as (binding power, operator, arity, start) tuples, and the
+        open brackets (parentheses, call arguments, indexes and table
+        constructors), as lists tagged PAREN, CALL, ARGUMENT, INDEX, TABLE
+        or KEY. Every token is looked at once and nesting costs no Python
+        stack, so the depth of an expression is only bounded by memory.
+        """
+        new, start_of, end_of = self.new, self.start_of, self.end_of
+        values = []
+        stack = []
+
+        def reduce(power):
+            # apply the operators binding tighter than `power`, down to the innermost open bracket
+            while stack and type(stack[-1]) is tuple and stack[-1][0] > power:
+                _, op, arity, start = stack.pop()
+                if arity == 1:
+                    operand = values.pop()
+                    values.append(new(UnaryOp, start, end_of(operand), op, operand))
+                else:
+                    right = values.pop()
+                    left = values.pop()
+                    values.append(new(BinOp, start_of(left), end_of(right), left, op, right))
+
+        def top():
+            return stack[-1][0] if stack else None
+
+        def call(func, args, start, end):
+            # a method call has its receiver and method name as `func`
+            if type(func) is tuple:
+                return new(Invoke, start, end, func[0], func[1], args)
+            return new(Call, start, end, func, args)
+
+        def close_table(frame, end):
+            # frame is [TABLE, fields, key, start, field start]
+            values.append(new(TableConstructor, frame[3], end, frame[1]))
+            if top() == ARGUMENT:
+                _, func, args, start = stack.pop()
+                values.append(call(func, args + [values.pop()], start, end))
+
+        def add_field(frame):
+            value = values.pop()
+            start = frame[4] if frame[4] is not None else start_of(value)
+            frame[1].append(new(TableField, start, end_of(value), frame[2], value))
+
+        def field():
+            # at the start of a table field: close the table, or read the key
+            # of the field. Returns whether the value of a field follows.
+            frame = stack[-1]
+            token = self.current_token()
+            if token is not None and token.type == lua.token.RBRACKET:
+                self.consume()
+                stack.pop()
+                close_table(frame, token.end)
+                return False
+            frame[2] = frame[4] = None
+            if token is not None and token.type == lua.token.NAME and self.peek() is not None \
+                    and self.peek().type == lua.token.EQUALS:
+                self.consume()
+                self.consume()
+                frame[2] = new(Name, token.start, token.end, self.name(token))
+                frame[4] = token.start
+            elif token is not None and token.type == lua.token.LBRACE:
+                self.consume()
+                frame[4] = token.start
+                stack.append([KEY])
+            return True
+
+        def arguments(func, args, start):
+            # at the arguments of a call of `func`. Returns whether an argument expression follows.
+            token = self.consume()
+            if token.type == lua.token.STRING:
+                string = new(Constant, token.start, token.end, string_value(token.value))
+                values.append(call(func, args + [string], start, token.end))
+                return False
+            if token.type == lua.token.LBRACKET:
+                stack.append([ARGUMENT, func, args, start])
+                stack.append([TABLE, [], None, token.start, None])
+                return field()
+            if token.type != lua.token.LPAREN:
+                raise self.error(f"Unexpected token: {token}", token)
+            if self.check(lua.token.RPAREN):
+                end = self.consume().end
+                values.append(call(func, args, start, end))
+                return False
+            stack.append([CALL, func, args, start])
+            return True
+
+        operand = True
+        while True:
+            token = self.current_token()
+            kind = token.type if token is not None else None
+            if operand:
+                if kind in unary_operators:
+                    self.consume()
+                    stack.append((unary_power, unary_operators[kind], 1, token.start))
+                elif kind == lua.token.LPAREN:
+                    self.consume()
+                    stack.append([PAREN])
+                elif kind == lua.token.LBRACKET:
+                    self.consume()
+                    stack.append([TABLE, [], None, token.start, None])
+                    operand = field()
+                else:
+                    values.append(self.parse_atom())
+                    operand = False
+            elif kind in binary_operators:
+                left, right, op = binary_operators[kind]
+                reduce(left)
+                self.consume()
+                stack.append((right, op, 2, None))
+                operand = True
+            elif kind in (lua.token.LPAREN, lua.token.STRING, lua.token.LBRACKET):
+                func = values.pop()
+                operand = arguments(func, [], start_of(func))
+            elif kind == lua.token.COLON:
+                self.consume()
+                name = self.consume(lua.token.NAME)
+                obj = values.pop()
+                method = new(Constant, name.start, name.end, self.name(name))
+                operand = arguments((obj, method), [], start_of(obj))
+            elif kind == lua.token.DOT:
+                self.consume()
+                name = self.consume(lua.token.NAME)
+                obj = values.pop()
+                values.append(new(Index, start_of(obj), name.end, obj, new(Constant, name.start, name.end, self.name(name))))
+            elif kind == lua.token.LBRACE:
+                self.consume()
+                stack.append([INDEX, values.pop()])
+                operand = True
+            else:
+                reduce(-1)
+                frame = stack[-1] if stack else None
+                if frame is None:
+                    return values.pop()
+                if kind == lua.token.COMMA and frame[0] == CALL:
+                    self.consume()
+                    frame[2].append(values.pop())
+                    operand = True
+                elif kind in (lua.token.COMMA, lua.token.SEMICOLON) and frame[0] == TABLE:
+                    self.consume()
+                    add_field(frame)
+                    operand = field()
+                elif kind == lua.token.RPAREN and frame[0] == PAREN:
+                    self.consume()
+                    stack.pop()
+                elif kind == lua.token.RPAREN and frame[0] == CALL:
+                    self.consume()
+                    stack.pop()
+                    frame[2].append(values.pop())
+                    values.append(call(frame[1], frame[2], frame[3], token.end))
+                elif kind == lua.token.RBRACE and frame[0] == INDEX:
+                    self.consume()
+                    stack.pop()
+                    values.append(new(Index, start_of(frame[1]), token.end, frame[1], values.pop()))
+                elif kind == lua.token.RBRACE and frame[0] == KEY:
+                    self.consume()
+                    stack.pop()
+                    self.consume(lua.token.EQUALS)
+                    stack[-1][2] = values.pop()
+                    operand = True
+                elif kind == lua.token.RBRACKET and frame[0] == TABLE:
+                    self.consume()
+                    stack.pop()
+                    add_field(frame)
+                    close_table(frame, token.end)
+                elif token is None:
+                    raise self.error("Unexpected end of input")
+                else:
+                    raise self.error(f"Unexpected token: {token}", token)
+
+    def parse_atom(self):
+        token = self.consume()
+        if token.type == lua.token.NAME or token.type == lua.token.DOTDOTDOT:
+            return self.new(Name, token.start, token.end, self.name(token))
+        elif token.type == lua.token.NUMBER:
+            return self.new(Constant, token.start, token.end, number(token.value))
+        elif token.type == lua.token.STRING:
+            return self.new(Constant, token.start, token.end, string_value(token.value))
+        elif token.type in constants:
+            return self.new(Constant, token.start, token.end, constants[token.type])
+        elif token.type == lua.token.FUNCTION:
+            return self.parse_function_body(None, False, token.start)
         else:
-            raise Exception(f"Unexpected token: {token}")
-
-    def parse_table_constructor(self):
-        self.consume("LBRACE")
-        fields = []
-        while self.current_token()["type"] != "RBRACE":
-            key = self.consume(lua.token.NAME).value
-            self.consume(lua.token.OPERATOR)  # =
-            value = self.parse_expr()
-            fields.append(TableField(Name(key), value))
-            if self.current_token()["type"] == "COMMA":
-                self.consume("COMMA")
-        self.consume("RBRACE")
-        return TableConstructor(fields)
+            raise self.error(f"Unexpected token: {token}", token)
 
     def transform_operator(self, op):
-        operators = {
-            "+": Add(),
-            "-": Sub(),
-            "*": Mult(),
-            "/": Div(),
-            "%": Mod(),
-            "==": Eq(),
-            "~=": NotEq(),
-            "<=": LtE(),
-            ">=": GtE(),
-            "<": Lt(),
-            ">": Gt(),
-            "and": And(),
-            "or": Or()
-        }
-        return operators[op]
+        return binary_operators[LEXEME_KINDS[op]][2]
+
+
+def parse_lua(code, arena=None, lazy=False):
+    """ tokenize and parse `code` (str or bytes like) as one streaming pipeline;
+    `lazy` leaves function bodies to be parsed when they are read """
+    return LuaParser(iter_significant_tokens(code), arena, code, lazy).parse_chunk()
+
 
+def parse_lua_stream(stream, chunk_size=1 << 16, encoding="utf-8", errors="strict", arena=None):
+    """ parse a text or binary stream while it is read, chunk by chunk """
+    return LuaParser(iter_scan_tokens(read_chunks(stream, chunk_size, encoding, errors)), arena).parse_chunk()
@@ -1,5 +1,9 @@
-from dataclasses import dataclass
-from typing_extensions import TypeAlias as Alias
+from dataclasses import dataclass, field
+try:
+    from typing import TypeAlias as Alias
+except ImportError:
+    from typing_extensions import TypeAlias as Alias
+from lines import LineIndex
 
 
 LuaToken: Alias = str
@@ -12,6 +16,21 @@ class Token:
     value: str
     start: int
     end: int
+    # the `LineIndex` of the source the token was scanned from, if known
+    lines: LineIndex = field(default=None, repr=False, compare=False)
+
+    @property
+    def line(self) -> int:
+        if self.lines is None:
+            raise ValueError("the token has no line index, it was not scanned from a whole source")
+        return self.lines.line(self.start)
+
+    @property
+    def column(self) -> int:
+        if self.lines is None:
+            raise ValueError("the token has no line index, it was not scanned from a whole source")
+        return self.lines.position(self.start)[1]
+
     def __repr__(self):
         return f'''Token(
             type  = {self.type}, 
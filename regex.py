@@ -1,4 +1,5 @@
 import re
+import functools
 
 # MACROS
 def oneOrNone(pattern):return rf"{pattern}?"
@@ -52,13 +53,40 @@ Ignore = Whitespace + any(r'\\\r?\n' + Whitespace)
 Imagnumber = group(r'[0-9](?:_?[0-9])*[jJ]', Floatnumber + r'[jJ]')
 ConString = group(r"'[^\n'\\]*(?:\\.[^\n'\\]*)*" + group("'", r'\\\r?\n'), 
                    r'"[^\n"\\]*(?:\\.[^\n"\\]*)*' +group('"', r'\\\r?\n'))
-String1 = r"\'.*\'"
-String2 = r'\".*\"'
+# Lua strings and long brackets. Each of these matches in time linear in what
+# it reads: the short string loops are unrolled so every character has a
+# single way to match (a `\z` escape takes all the whitespace after it), and a
+# long bracket body ends at the first closer of its level. An opener without
+# a closer fails once, after which the Unfinished patterns take the rest of
+# the line (short strings) or of the source (long brackets), so no opener is
+# scanned for twice.
+Escape = r'\\(?:z\s*(?!\s)|[^z])'
+String1 = rf"'[^'\\\n]*(?:{Escape}[^'\\\n]*)*'"
+String2 = rf'"[^"\\\n]*(?:{Escape}[^"\\\n]*)*"'
+UnfinishedString1 = rf"'[^'\\\n]*(?:{Escape}[^'\\\n]*)*"
+UnfinishedString2 = rf'"[^"\\\n]*(?:{Escape}[^"\\\n]*)*'
+def longBracket(level):
+    """ a long bracket, `[[ ... ]]` or `[==[ ... ]==]`, keeping the `=`s of its
+    opener in the group named `level` to find the closer of the same level """
+    return rf"\[(?P<{level}>=*)\[(?s:.*?)\](?P={level})\]"
+LongString = longBracket("string_level")
+LongComment = "--" + longBracket("comment_level")
+UnfinishedLongBracket = group(r"--\[=*\[(?s:.*)", r"\[=*\[(?s:.*)")
+LongBracketOpener = r"(?:--)?\[(=*)\["
 InsideParentheses = r'\((.*?)\)'
 
 
-Num = group(Imagnumber, Floatnumber, Intnumber)
+# matches what group(Imagnumber, Floatnumber, Intnumber) does, reading the
+# digits of a number once instead of once per alternative: the prefixed
+# integers first, then digits with a fraction, exponent or imaginary suffix,
+# and only then a plain decimal integer
+Digits = r'[0-9](?:_?[0-9])*'
+Num = group(Hexnumber, Binnumber, Octnumber,
+            Digits + group(r'\.(?:' + Digits + ')?(?:' + Exponent + r')?[jJ]?', Exponent + '[jJ]?', '[jJ]'),
+            r'\.' + Digits + '(?:' + Exponent + r')?[jJ]?',
+            Decnumber)
 Str = group(String1, String2)
+UnfinishedStr = group(UnfinishedString1, UnfinishedString2)
 KeywordPatterns = group("and", "break", "do", "else", "elseif", "end", "false", "for",
     "function", "goto", "if", "in", "local", "nil", "not", "or",
     "repeat", "return", "then", "true", "until", "while")
@@ -91,4 +119,19 @@ Operators = group(
     once(r"."),
     twice(r"."), 
     thrice(r".") 
-)
\ No newline at end of file
+)
+
+
+# every named pattern of this module, by name; `compiled` compiles each once
+registry: dict[str, str] = {name: value for name, value in list(globals().items())
+                            if name[:1].isupper() and isinstance(value, str)}
+def register(**patterns):registry.update(patterns)
+
+@functools.cache
+def compile_pattern(pattern: str | bytes, flags: int = 0) -> re.Pattern:
+    """ `re.compile`, once per pattern and flags """
+    return re.compile(pattern, flags)
+
+def compiled(name: str, flags: int = 0) -> re.Pattern:
+    """ the registered pattern `name`, compiled """
+    return compile_pattern(registry[name], flags)
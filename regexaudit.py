@@ -0,0 +1,197 @@
+import re
+from re import _parser, _constants as sre
+from regex import registry
+
+
+# STATIC BACKTRACKING AUDIT
+# Works on the parsed form of a pattern, with character sets approximated
+# over latin-1 plus one code (256) standing for every other character.
+OTHER = 256
+UNIVERSE = frozenset(range(OTHER + 1))
+CATEGORIES = {
+    sre.CATEGORY_DIGIT: frozenset(range(48, 58)),
+    sre.CATEGORY_SPACE: frozenset(map(ord, " \t\n\r\f\v")),
+    sre.CATEGORY_WORD: frozenset(map(ord, "0123456789_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")) | {OTHER},
+    sre.CATEGORY_LINEBREAK: frozenset((10,)),
+}
+CATEGORIES.update({
+    sre.CATEGORY_NOT_DIGIT: UNIVERSE - CATEGORIES[sre.CATEGORY_DIGIT],
+    sre.CATEGORY_NOT_SPACE: UNIVERSE - CATEGORIES[sre.CATEGORY_SPACE],
+    sre.CATEGORY_NOT_WORD: UNIVERSE - CATEGORIES[sre.CATEGORY_WORD] | {OTHER},
+    sre.CATEGORY_NOT_LINEBREAK: UNIVERSE - CATEGORIES[sre.CATEGORY_LINEBREAK],
+})
+REPEATS = (sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT)
+
+def charcode(code):return code if code < OTHER else OTHER
+
+def charset(items):
+    """ the characters an IN class matches """
+    retv = set()
+    negate = False
+    for op, av in items:
+        if op is sre.NEGATE:
+            negate = True
+        elif op is sre.LITERAL:
+            retv.add(charcode(av))
+        elif op is sre.RANGE:
+            retv.update(range(charcode(av[0]), charcode(av[1]) + 1))
+        elif op is sre.CATEGORY:
+            retv |= CATEGORIES.get(av, UNIVERSE)
+        else:
+            retv |= UNIVERSE
+    return UNIVERSE - retv | {OTHER} if negate else frozenset(retv)
+
+def first(items, dotall=False):
+    """ the characters a sequence can start with, and whether it can match empty """
+    retv = set()
+    for op, av in items:
+        chars, nullable = first_of(op, av, dotall)
+        retv |= chars
+        if not nullable:
+            return retv, False
+    return retv, True
+
+def first_of(op, av, dotall=False):
+    if op is sre.LITERAL:
+        return {charcode(av)}, False
+    if op is sre.NOT_LITERAL:
+        return UNIVERSE - {charcode(av)} | {OTHER}, False
+    if op is sre.ANY:
+        return (UNIVERSE if dotall else UNIVERSE - {10}), False
+    if op is sre.IN:
+        return charset(av), False
+    if op is sre.SUBPATTERN:
+        return first(av[3], subpattern_dotall(av, dotall))
+    if op is sre.ATOMIC_GROUP:
+        return first(av, dotall)
+    if op is sre.BRANCH:
+        retv, nullable = set(), False
+        for branch in av[1]:
+            chars, empty = first(branch, dotall)
+            retv |= chars
+            nullable = nullable or empty
+        return retv, nullable
+    if op in REPEATS:
+        chars, nullable = first(av[2], dotall)
+        return chars, nullable or av[0] == 0
+    if op is sre.GROUPREF_EXISTS:
+        yes, yes_empty = first(av[1], dotall)
+        no, no_empty = first(av[2], dotall) if av[2] else (set(), True)
+        return yes | no, yes_empty or no_empty
+    if op is sre.GROUPREF:
+        return set(UNIVERSE), True
+    return set(), True
+
+def subpattern_dotall(av, dotall):
+    if av[1] & re.DOTALL:
+        return True
+    if av[2] & re.DOTALL:
+        return False
+    return dotall
+
+def loops(items, dotall=False):
+    """ the unbounded, backtracking repeats in a sequence, nested ones
+    included, as (characters they take, dotall) """
+    for op, av in items:
+        if op in REPEATS:
+            if av[1] == sre.MAXREPEAT and op is not sre.POSSESSIVE_REPEAT:
+                yield chars(av[2], dotall)
+            yield from loops(av[2], dotall)
+        elif op is sre.SUBPATTERN:
+            yield from loops(av[3], subpattern_dotall(av, dotall))
+        elif op is sre.BRANCH:
+            for branch in av[1]:
+                yield from loops(branch, dotall)
+        elif op is sre.GROUPREF_EXISTS:
+            for branch in av[1:]:
+                if branch:
+                    yield from loops(branch, dotall)
+
+def chars(items, dotall=False):
+    """ every character a sequence can take, anywhere """
+    retv = set()
+    for op, av in items:
+        if op in REPEATS:
+            retv |= chars(av[2], dotall)
+        elif op is sre.SUBPATTERN:
+            retv |= chars(av[3], subpattern_dotall(av, dotall))
+        elif op is sre.ATOMIC_GROUP:
+            retv |= chars(av, dotall)
+        elif op is sre.BRANCH:
+            for branch in av[1]:
+                retv |= chars(branch, dotall)
+        elif op is sre.GROUPREF_EXISTS:
+            for branch in av[1:]:
+                if branch:
+                    retv |= chars(branch, dotall)
+        else:
+            retv |= first_of(op, av, dotall)[0]
+    return retv
+
+def shown(chars):
+    sample = sorted(chars)[:4]
+    return ", ".join(repr(chr(c)) if c < OTHER else "non latin-1" for c in sample) + (", ..." if len(chars) > 4 else "")
+
+def audit(pattern: str) -> list[tuple[str, str]]:
+    """ statically flag the parts of `pattern` that can backtrack badly.
+
+    Returns (severity, description) pairs, where severity is
+    "exponential" for a loop whose iterations can be split in more than one
+    way: a loop nested in another one that takes the characters the outer
+    iteration starts with, overlapping alternatives inside a loop, or a
+    loop body that can match nothing. "polynomial" is for a greedy loop
+    followed by something that starts like another iteration would, such
+    as `'.*'`, which is then tried at every character the loop gives back.
+    Possessive repeats and atomic groups never backtrack and are skipped.
+    """
+    if isinstance(pattern, re.Pattern):
+        pattern = pattern.pattern
+    retv = []
+
+    def sequence(items, dotall):
+        items = list(items)
+        for index, (op, av) in enumerate(items):
+            if op in REPEATS:
+                body = av[2]
+                if av[1] == sre.MAXREPEAT and op is not sre.POSSESSIVE_REPEAT:
+                    starts, empty = first(body, dotall)
+                    if empty:
+                        retv.append(("exponential", "a loop whose body can match nothing"))
+                    for inner in loops(body, dotall):
+                        if starts & inner:
+                            retv.append(("exponential", f"a loop nested in a loop that can start with what it takes ({shown(starts & inner)})"))
+                    for op2, av2 in body if len(body) == 1 else ():
+                        branches = av2[1] if op2 is sre.BRANCH else av2[3][0][1] if op2 is sre.SUBPATTERN and len(av2[3]) == 1 and av2[3][0][0] is sre.BRANCH else ()
+                        seen = set()
+                        for branch in branches:
+                            branch_first = first(branch, dotall)[0]
+                            if seen & branch_first:
+                                retv.append(("exponential", f"overlapping alternatives in a loop ({shown(seen & branch_first)})"))
+                            seen |= branch_first
+                    if op is sre.MAX_REPEAT:
+                        rest, rest_empty = first(items[index+1:], dotall)
+                        overlap = starts & rest
+                        if overlap and not rest_empty:
+                            retv.append(("polynomial", f"a greedy loop followed by what another iteration could start with ({shown(overlap)})"))
+                sequence(body, dotall)
+            elif op is sre.SUBPATTERN:
+                sequence(av[3], subpattern_dotall(av, dotall))
+            elif op is sre.ATOMIC_GROUP:
+                sequence(av, dotall)
+            elif op is sre.BRANCH:
+                for branch in av[1]:
+                    sequence(branch, dotall)
+            elif op in (sre.ASSERT, sre.ASSERT_NOT):
+                sequence(av[1], dotall)
+            elif op is sre.GROUPREF_EXISTS:
+                for branch in av[1:]:
+                    if branch:
+                        sequence(branch, dotall)
+
+    parsed = _parser.parse(pattern, 0)
+    sequence(parsed, bool(parsed.state.flags & re.DOTALL))
+    return list(dict.fromkeys(retv))
+
+def audit_registry() -> dict[str, list[tuple[str, str]]]:
+    """ `audit` of every registered pattern that is flagged """
+    return {name: found for name, pattern in registry.items() if (found := audit(pattern))}
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import math
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from tokenarray import token_kinds
+from tokenizer import master_scanner, tokenize_lua_array, iter_significant_tokens
+from nodes import Node, Singleton, parse_lua, field_names
+
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+LUA_ERROR = -32000
+
+METHODS = ("tokenize", "parse")
+
+
+class MethodNotFound(Exception):
+    """ a request names a method the server does not have """
+
+
+class InvalidParams(Exception):
+    """ the params of a request are not what its method takes """
+
+
+def warm() -> None:
+    """ compile the master patterns, so the first request does not pay for it """
+    master_scanner()
+    master_scanner(binary=True)
+
+
+@functools.cache
+def node_fields(cls: type) -> tuple[str, ...]:
+    return tuple(name for klass in reversed(cls.__mro__) if klass is not Node
+                 for name in field_names(klass))
+
+
+def json_value(value):
+    """ `value` as JSON can carry it: infinities and NaN, which JSON has no
+    numbers for, become `{"float": "inf"}`, `"-inf"` or `"nan"` """
+    if type(value) is float and not math.isfinite(value):
+        return {"float": repr(value)}
+    return value
+
+
+def node_json(root: Node) -> dict:
+    """ an AST as nested dicts, `{"type": class name, "start", "end", fields...}`.
+    Operators, which have no fields, are just their class name, and plain
+    values go through `json_value`. """
+    retv = [None]
+    stack = [(root, retv, 0)]
+    while stack:
+        node, parent, key = stack.pop()
+        if isinstance(node, Singleton):
+            parent[key] = type(node).__name__
+            continue
+        item = parent[key] = {"type": type(node).__name__, "start": node.start, "end": node.end}
+        for name in node_fields(type(node)):
+            value = getattr(node, name)
+            if isinstance(value, Node):
+                stack.append((value, item, name))
+            elif type(value) is list:
+                values = item[name] = list(value)
+                for index, element in enumerate(value):
+                    if isinstance(element, Node):
+                        stack.append((element, values, index))
+            else:
+                item[name] = json_value(value)
+    return retv[0]
+
+
+def request_path(params: dict, root: str = None) -> str:
+    """ the file a path request names, relative to `root`; path requests are
+    refused unless a root is given, and so are files outside of it """
+    if root is None:
+        raise InvalidParams("path requests are not enabled")
+    if not isinstance(params["path"], str):
+        raise InvalidParams("path must be a string")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, params["path"]))
+    if os.path.commonpath((root, path)) != root:
+        raise InvalidParams("path is outside the served root")
+    return path
+
+
+def request_source(params: dict, root: str = None) -> str:
+    if "source" in params:
+        if not isinstance(params["source"], str):
+            raise InvalidParams("source must be a string")
+        return params["source"]
+    if "path" in params:
+        with open(request_path(params, root), encoding="utf-8") as f:
+            return f.read()
+    raise InvalidParams("expected a source or a path")
+
+
+def request_size(params: dict, root: str = None) -> int:
+    """ the length of the source of a request, read from the file system for
+    a path; 0 when there is none """
+    if not isinstance(params, dict):
+        return 0
+    if "source" in params:
+        return len(params["source"]) if isinstance(params["source"], str) else 0
+    if "path" in params:
+        try:
+            return os.path.getsize(request_path(params, root))
+        except (InvalidParams, OSError, ValueError):
+            return 0
+    return 0
+
+
+def handle(method: str, params: dict, root: str = None):
+    """ run one request.
+
+    tokenize: `{"source" or "path", "significant": bool}` gives
+        `{"tokens": [[type, value, start, end], ...]}`, the tokens of
+        `tokenize_lua`, or only the ones a parser reads
+    parse: `{"source" or "path", "ast": bool}` gives `{"ast": ...}`, the
+        chunk as `node_json`, or null when `ast` is false
+
+    A path is read relative to `root`, and only when there is one.
+
+    Raises:
+        MethodNotFound: `method` is not one of `METHODS`
+        InvalidParams: `params` is not an object, or has no usable source or path
+    """
+    if method not in METHODS:
+        raise MethodNotFound(f"unknown method {method!r}")
+    if not isinstance(params, dict):
+        raise InvalidParams("params must be an object")
+    if method == "tokenize":
+        source = request_source(params, root)
+        if params.get("significant"):
+            tokens = [[tok.type, tok.value, tok.start, tok.end] for tok in iter_significant_tokens(source)]
+        else:
+            array = tokenize_lua_array(source)
+            tokens = [[token_kinds[kind], array.value(index), start, end]
+                      for index, (kind, start, end) in enumerate(zip(array.kinds, array.starts, array.ends))]
+        return {"tokens": tokens}
+    if method == "parse":
+        chunk = parse_lua(request_source(params, root))
+        return {"ast": node_json(chunk) if params.get("ast", True) else None}
+
+
+def run_batch(batch: list[tuple[str, dict]], root: str = None) -> list[tuple[bool, object]]:
+    """ run a batch of requests, giving (True, result) or (False, error) for each """
+    retv = []
+    for method, params in batch:
+        try:
+            retv.append((True, handle(method, params, root)))
+        except MethodNotFound as e:
+            retv.append((False, {"code": METHOD_NOT_FOUND, "message": str(e)}))
+        except InvalidParams as e:
+            retv.append((False, {"code": INVALID_PARAMS, "message": str(e)}))
+        except Exception as e:
+            retv.append((False, {"code": LUA_ERROR, "message": str(e)}))
+    return retv
+
+
+class Server:
+    """ a tokenizer and parser service speaking JSON-RPC 2.0, one message
+    per line, over stdin/stdout or a unix socket.
+
+    Requests from every connection go through one bounded queue. Once a
+    worker is free, everything waiting in the queue (up to `batch_size`
+    requests or `batch_bytes` of source) is sent to it as one batch, so
+    small requests share a round trip to the pool; a batch under
+    `inline_bytes` is run in the server process instead, without one. When
+    the queue is full, connections stop being read until it drains.
+
+    Responses are sent as requests finish, not necessarily in order.
+    Requests naming a `path` instead of a source are only served with a
+    `root`, and only for the files under it.
+    """
+
+    def __init__(self, workers: int = None, batch_size: int = 64, batch_bytes: int = 1 << 16,
+                 inline_bytes: int = 1 << 12, queue_size: int = 1024, max_request: int = 1 << 28,
+                 root: str = None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.inline_bytes = inline_bytes
+        self.queue_size = queue_size
+        self.max_request = max_request
+        self.root = root
+        self.executor = None
+        self.running = set()
+
+    async def start(self) -> None:
+        warm()
+        if self.workers:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=warm)
+        self.queue = asyncio.Queue(self.queue_size)
+        self.slots = asyncio.Semaphore(max(1, self.workers))
+        self.batcher = asyncio.create_task(self.batch_requests())
+
+    async def stop(self) -> None:
+        self.batcher.cancel()
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown, cancel_futures=True)
+
+    async def submit(self, method: str, params: dict) -> asyncio.Future:
+        """ queue a request, waiting for room in the queue; gives the future of its result """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((method, params, request_size(params, self.root), future))
+        return future
+
+    async def batch_requests(self) -> None:
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            size = batch[0][2]
+            while len(batch) < self.batch_size and size < self.batch_bytes and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                size += batch[-1][2]
+            task = asyncio.create_task(self.run(batch, size))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run(self, batch: list, size: int) -> None:
+        try:
+            requests = [(method, params) for method, params, size, future in batch]
+            if self.executor is None or size < self.inline_bytes:
+                results = run_batch(requests, self.root)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, run_batch, requests, self.root)
+        except Exception as e:
+            results = [(False, {"code": LUA_ERROR, "message": f"{type(e).__name__}: {e}"})] * len(batch)
+        finally:
+            self.slots.release()
+        for (method, params, size, future), result in zip(batch, results):
+            if not future.cancelled():
+                future.set_result(result)
+
+    async def respond(self, id, future: asyncio.Future, writer: asyncio.StreamWriter) -> None:
+        ok, value = await future
+        if id is None:
+            return
+        message = {"jsonrpc": "2.0", "id": id, "result": value} if ok else {"jsonrpc": "2.0", "id": id, "error": value}
+        try:
+            line = json.dumps(message, allow_nan=False)
+        except ValueError as e:
+            error = {"code": LUA_ERROR, "message": f"result is not valid JSON: {e}"}
+            line = json.dumps({"jsonrpc": "2.0", "id": id, "error": error})
+        writer.write(line.encode() + b"\n")
+        await writer.drain()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ answer the requests of one connection until it closes """
+        pending = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    error = {"code": PARSE_ERROR, "message": "invalid json"}
+                    writer.write(json.dumps({"jsonrpc": "2.0", "id": None, "error": error}).encode() + b"\n")
+                    continue
+                if (not isinstance(request, dict) or not isinstance(request.get("method"), str)
+                        or not isinstance(request.get("params", {}), dict)):
+                    error = {"code": INVALID_REQUEST, "message": "invalid request"}
+                    writer.write(json.dumps({"jsonrpc": "2.0", "id": None, "error": error}).encode() + b"\n")
+                    continue
+                future = await self.submit(request["method"], request.get("params", {}))
+                task = asyncio.create_task(self.respond(request.get("id"), future, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_unix(self, path: str) -> None:
+        await self.start()
+        try:
+            server = await asyncio.start_unix_server(self.serve, path, limit=self.max_request)
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def serve_stdio(self) -> None:
+        await self.start()
+        try:
+            loop = asyncio.get_running_loop()
+            reader = asyncio.StreamReader(limit=self.max_request)
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+            transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+            await self.serve(reader, writer)
+        finally:
+            await self.stop()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="serve tokenize and parse requests as JSON-RPC, one message per line")
+    parser.add_argument("--socket", default=None, help="listen on this unix socket instead of stdin/stdout")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, 0 to run everything in the server (default: cpu count)")
+    parser.add_argument("--batch-size", type=int, default=64, help="most requests sent to a worker at once")
+    parser.add_argument("--inline-bytes", type=int, default=1 << 12, help="batches with less source than this run in the server")
+    parser.add_argument("--queue", type=int, default=1024, help="requests queued before connections stop being read")
+    parser.add_argument("--root", default=None, help="serve path requests for files under this directory (default: refuse them)")
+    args = parser.parse_args(argv)
+
+    server = Server(args.workers, batch_size=args.batch_size, inline_bytes=args.inline_bytes, queue_size=args.queue,
+                    root=args.root)
+    try:
+        asyncio.run(server.serve_unix(args.socket) if args.socket else server.serve_stdio())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+import pytest
+from cache import TokenCache
+from nodes import parse_lua
+from visitor import walk
+
+
+def shape(node):
+    return [type(child).__name__ for child in walk(node)]
+
+
+@pytest.mark.parametrize("code", [
+    "x = 1" + " + 1" * 10000,
+    "x = a" + " .. a" * 10000,
+], ids=["sum", "concat"])
+def test_parse_deep_chain(tmp_path, code):
+    expected = shape(parse_lua(code))
+    assert shape(TokenCache(str(tmp_path)).parse(code)) == expected
+    # a second cache on the same directory reads the entry back
+    assert shape(TokenCache(str(tmp_path)).parse(code)) == expected
+
+
+def test_tokenize_hit(tmp_path):
+    code = "local t = {1, 2}\nfor i, v in ipairs(t) do\n    print(i, v)\nend\n"
+    first = TokenCache(str(tmp_path)).tokenize(code)
+    second = TokenCache(str(tmp_path)).tokenize(code)
+    assert second.to_tokens() == first.to_tokens()
@@ -0,0 +1,64 @@
+import io
+import random
+import pytest
+from Lua import lua
+from tokenizer import (tokenize_lua, tokenize_lua_array, scan_tokens, iter_scan_tokens, iter_significant_tokens,
+                       read_chunks)
+from detokenizer import detokenize, minify_source
+
+PIECES = ["x", "y1", "_z", "then", "end", "and", "1", "0x1F", "1.5", ".5", "1e3", "..", ".", "...", "-", "--", "=",
+          "==", "<", "<=", "~=", "~", "/", "//", ":", "::", "[", "]", "[[s]]", "{", "}", "(", ")", "'s'", '"t"',
+          "'abc", '"q', "é", "xé", "é1", "ü_", "中", "#", "+", "*", ",", ";", "\t", "\r", " ", "\n", "--c\n",
+          "[=[", "]=]"]
+
+
+def fuzzed(count: int, seed: int = 0) -> list[str]:
+    """ `count` random snippets of tokens, touching or apart; none starts
+    with `#`, which `minify` keeps as a line lua skips """
+    rnd = random.Random(seed)
+    retv = []
+    while len(retv) < count:
+        code = "".join(rnd.choice(PIECES) + rnd.choice(("", "", " ", "\n")) for _ in range(rnd.randint(1, 12)))
+        if not code.startswith("#"):
+            retv.append(code)
+    return retv
+
+
+def significant(code):
+    return [(tok.type, tok.value) for tok in iter_significant_tokens(code)
+            if not (tok.type == lua.token.UNKNOWN and tok.value.isspace())]
+
+
+@pytest.mark.parametrize("code", [
+    "x = 'abc\ny = 2\n",
+    "x = \"abc \n:: y\n",
+    "y1\né1\n",
+    "x é\n",
+    "é x\n",
+    "a = b\n.. c",
+    "x = 1\n.5",
+])
+def test_minify_keeps_tokens(code):
+    assert significant(minify_source(code)) == significant(code)
+    assert significant(minify_source(code.encode())) == significant(code.encode())
+
+
+def test_minify_fuzzed():
+    for code in fuzzed(2000):
+        assert significant(minify_source(code)) == significant(code), code
+        assert significant(minify_source(code.encode())) == significant(code.encode()), code
+
+
+def detokenized(tokens, source=None, buffer_size=1 << 16):
+    out = io.StringIO() if source is None or isinstance(source, str) else io.BytesIO()
+    detokenize(tokens, out, source, buffer_size)
+    return out.getvalue()
+
+
+def test_detokenize_round_trips(sources):
+    for code in sources:
+        assert detokenized(scan_tokens(code), code) == code, code
+        assert detokenized(tokenize_lua(code), code) == code, code
+        assert detokenized(iter_scan_tokens(read_chunks(io.StringIO(code), chunk_size=7))) == code, code
+        assert detokenized(tokenize_lua_array(code), code, buffer_size=5) == code, code
+        assert detokenized(tokenize_lua_array(code.encode()), code.encode()) == code.encode(), code
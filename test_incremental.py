@@ -0,0 +1,43 @@
+import random
+import pytest
+from incremental import IncrementalTokens
+from tokenizer import scan_tokens, tokenize_lua, tokenize_lua_array
+
+INSERTS = ["x", "'", "\"", "[[", "]]", "[=[", "]=]", "--", "--[[", "\n", " ", "    ", "end", "1", ".", "é"]
+
+
+def rows(tokens):
+    return [(tok.type, tok.value, tok.start, tok.end) for tok in tokens]
+
+
+def check(tokens: IncrementalTokens, code: str) -> None:
+    assert rows(tokens) == rows(scan_tokens(code))
+    assert rows(tokens.layout()) == rows(tokenize_lua(code))
+
+
+@pytest.mark.parametrize("code, offset, deleted, inserted", [
+    ("local s = 'abc'\nx = 1\n", 10, 1, ""),                   # a string loses its opening quote
+    ("x = 1\ny = [[a\nb]]\nz = 2\n", 15, 2, ""),               # a long string loses its closer
+    ("x = 1\ny = 2\n", 0, 0, "--[["),                          # a long comment opens over everything
+    ("--[[ x\ny = 2\n", 0, 4, ""),                             # and closes again
+    ("a = 1\n    b = 2\nc = 3\n", 6, 4, ""),                   # indentation goes
+    ("", 0, 0, "local x = 1\n"),
+])
+def test_edit(code, offset, deleted, inserted):
+    tokens = IncrementalTokens(code)
+    tokens.edit(offset, deleted, inserted)
+    check(tokens, code[:offset] + inserted + code[offset+deleted:])
+
+
+def test_fuzzed_edits(sources):
+    rnd = random.Random(0)
+    for code in sources[:150]:
+        tokens = IncrementalTokens(code)
+        for _ in range(6):
+            offset = rnd.randint(0, len(code))
+            deleted = rnd.randint(0, min(5, len(code) - offset))
+            inserted = "".join(rnd.choice(INSERTS) for _ in range(rnd.randint(0, 3)))
+            tokens.edit(offset, deleted, inserted)
+            code = code[:offset] + inserted + code[offset+deleted:]
+            check(tokens, code)
+        assert tokens.to_array().to_tokens() == tokenize_lua_array(code).to_tokens()
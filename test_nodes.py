@@ -0,0 +1,95 @@
+import pytest
+from nodes import parse_lua, Arena, Chunk, If, Name, Constant, BinOp
+from visitor import walk, NodeVisitor, NodeTransformer
+from server import node_json
+
+DEPTH = 10000
+
+# expressions nested far past the 200 levels lua itself allows
+DEEP_EXPRESSIONS = {
+    "parentheses": "x = " + "(" * DEPTH + "1" + ")" * DEPTH,
+    "tables": "x = " + "{" * DEPTH + "}" * DEPTH,
+    "unary": "x = " + "not - " * DEPTH + "y",
+    "power": "x = 2" + " ^ 2" * DEPTH,
+    "concat": "x = a" + " .. a" * DEPTH,
+    "sum": "x = 1" + " + 1" * DEPTH,
+    "index": "x = a" + "[1]" * DEPTH,
+    "calls": "x = f" + "()" * DEPTH,
+    "methods": "x = a" + ":m()" * DEPTH,
+}
+
+# blocks nested as deep as lua 5.4 parses them
+DEEP_BLOCKS = {
+    "if": "if x then " * 195 + "end " * 195,
+    "while": "while x do " * 195 + "end " * 195,
+    "for": "for i = 1, 2 do " * 195 + "end " * 195,
+    "function": "x = " + "function() return " * 95 + "1" + " end" * 95,
+}
+
+
+def shape(node) -> list[tuple]:
+    """ the class and span of every node (operators have none), in walk
+    order; deep trees cannot be compared as nested dicts without recursing """
+    return [(type(child).__name__, getattr(child, "start", None), getattr(child, "end", None)) for child in walk(node)]
+
+
+class Counter(NodeVisitor):
+    def __init__(self):
+        self.names = 0
+        self.left = 0
+
+    def visit_Name(self, node):
+        self.names += 1
+
+    def leave_BinOp(self, node):
+        self.left += 1
+
+
+class Renamer(NodeTransformer):
+    def visit_Name(self, node):
+        return Name(node.id.upper(), node.start, node.end)
+
+
+@pytest.mark.parametrize("code", DEEP_EXPRESSIONS.values(), ids=DEEP_EXPRESSIONS.keys())
+def test_deep_expressions(code):
+    chunk = parse_lua(code)
+    nodes = list(walk(chunk))
+    counter = Counter()
+    counter.visit(chunk)
+    assert counter.names == sum(type(node) is Name for node in nodes)
+    assert counter.left == sum(type(node) is BinOp for node in nodes)
+    renamed = Renamer().visit(chunk)
+    assert all(node.id.isupper() for node in walk(renamed) if type(node) is Name)
+    arena = Arena()
+    assert shape(arena.to_node(parse_lua(code, arena))) == shape(parse_lua(code))
+    node_json(chunk)
+
+
+@pytest.mark.parametrize("code", DEEP_BLOCKS.values(), ids=DEEP_BLOCKS.keys())
+def test_deep_blocks(code):
+    assert node_json(parse_lua(code, lazy=True)) == node_json(parse_lua(code))
+
+
+def test_visitor_deep_statements():
+    # statements nested deeper than the parser goes, built by hand
+    node = Constant(1)
+    for _ in range(DEPTH):
+        node = If(Name("x"), [node], [])
+    chunk = Chunk([node])
+    assert sum(type(node) is If for node in walk(chunk)) == DEPTH
+    counter = Counter()
+    counter.visit(chunk)
+    assert counter.names == DEPTH
+    Renamer().visit(chunk)
+    assert all(node.id == "X" for node in walk(chunk) if type(node) is Name)
+
+
+def test_sources_parse_the_same_every_way(sources):
+    for code in sources:
+        try:
+            expected = node_json(parse_lua(code))
+        except Exception:
+            continue
+        arena = Arena()
+        assert node_json(arena.to_node(parse_lua(code, arena))) == expected
+        assert node_json(parse_lua(code, lazy=True)) == expected
@@ -0,0 +1,26 @@
+import json
+from server import run_batch, INVALID_PARAMS, METHOD_NOT_FOUND
+
+
+def test_non_finite_constants():
+    [(ok, result)] = run_batch([("parse", {"source": "x = 1e999 y = -1e999"})])
+    assert ok
+    values = [statement["value"][0] for statement in result["ast"]["body"]]
+    assert [value.get("value") for value in values if value["type"] == "Constant"] == [{"float": "inf"}]
+    # the whole result is strict JSON
+    json.dumps(result, allow_nan=False)
+
+
+def test_path_needs_root(tmp_path):
+    (tmp_path / "a.lua").write_text("local a = 1\n")
+    [(ok, error)] = run_batch([("parse", {"path": "a.lua"})])
+    assert not ok and error["code"] == INVALID_PARAMS
+    [(ok, result)] = run_batch([("parse", {"path": "a.lua"})], str(tmp_path))
+    assert ok and result["ast"]["type"] == "Chunk"
+    [(ok, error)] = run_batch([("parse", {"path": "../a.lua"})], str(tmp_path / "sub"))
+    assert not ok and error["code"] == INVALID_PARAMS
+
+
+def test_protocol_errors():
+    results = run_batch([("nope", {}), ("parse", {}), ("parse", {"source": 1})])
+    assert [error["code"] for ok, error in results] == [METHOD_NOT_FOUND, INVALID_PARAMS, INVALID_PARAMS]
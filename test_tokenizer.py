@@ -0,0 +1,117 @@
+import io
+import marshal
+import pytest
+from Lua import lua, token_specification, TRIVIA_TYPES
+from tokenizer import (tokenize_lua, tokenize_lua_array, tokenize_lua_parallel, tokenize_lua_file, scan_tokens,
+                       iter_tokenize_lua, iter_significant_tokens, compile_specification, save_snapshot,
+                       load_snapshot)
+
+
+def rows(tokens):
+    return [(tok.type, tok.value, tok.start, tok.end) for tok in tokens]
+
+
+def columns(tokens):
+    return list(tokens.kinds), list(tokens.starts), list(tokens.ends)
+
+
+def byte_columns(code: str):
+    """ the columns of `tokenize_lua_array(code)`, with byte offsets """
+    tokens = tokenize_lua_array(code)
+    offsets = [0]
+    for char in code:
+        offsets.append(offsets[-1] + len(char.encode()))
+    return list(tokens.kinds), [offsets[start] for start in tokens.starts], [offsets[end] for end in tokens.ends]
+
+
+@pytest.mark.parametrize("code", ["thenxé", "xé = 1", "é1 + ü_", "local 名前 = 'é'", "a b", "x = 1١"])
+def test_text_and_bytes_agree(code):
+    tokens = tokenize_lua_array(code.encode())
+    assert byte_columns(code) == (list(tokens.kinds), list(tokens.starts), list(tokens.ends))
+
+
+def test_names_are_ascii():
+    assert [(tok.type, tok.value) for tok in iter_significant_tokens("thenxé")] == [("NAME", "thenx"), ("UNKNOWN", "é")]
+
+
+def test_bytes(sources):
+    for code in sources:
+        assert byte_columns(code) == columns(tokenize_lua_array(code.encode())), code
+
+
+def test_array(sources):
+    for code in sources:
+        assert rows(tokenize_lua_array(code)) == rows(tokenize_lua(code)), code
+
+
+def test_streaming(sources):
+    # chunks far smaller than the tokens, so strings, comments and numbers cross them
+    for code in sources:
+        expected = rows(tokenize_lua(code))
+        assert rows(iter_tokenize_lua(io.StringIO(code), chunk_size=7)) == expected, code
+        assert rows(iter_tokenize_lua(io.BytesIO(code.encode()), chunk_size=5)) == expected, code
+
+
+def test_significant(sources):
+    layout = TRIVIA_TYPES | {lua.token.INDENT, lua.token.DEDENT}
+    for code in sources:
+        expected = [row for row in rows(tokenize_lua(code)) if row[0] not in layout]
+        assert rows(iter_significant_tokens(code)) == expected, code
+
+
+def test_parallel(sources, tmp_path):
+    code = "\n".join(sources)
+    expected = columns(tokenize_lua_array(code))
+    assert columns(tokenize_lua_parallel(code, workers=2, segment_size=512)) == expected
+    expected = columns(tokenize_lua_array(code.encode()))
+    assert columns(tokenize_lua_parallel(code.encode(), workers=2, segment_size=512)) == expected
+    path = tmp_path / "corpus.lua"
+    path.write_bytes(code.encode())
+    assert columns(tokenize_lua_file(str(path))) == expected
+
+
+def test_lossless_scan(sources):
+    for code in sources:
+        assert "".join(tok.value for tok in scan_tokens(code)) == code
+
+
+def test_snapshot(sources, tmp_path):
+    path = str(tmp_path / "snapshot.marshal")
+    save_snapshot(path)
+    pattern, groups = load_snapshot(path)
+    expected, expected_groups = compile_specification(token_specification)
+    assert groups == expected_groups
+    code = "\n".join(sources)
+    assert ([(m.lastgroup, m.span()) for m in pattern.finditer(code)]
+            == [(m.lastgroup, m.span()) for m in expected.finditer(code)])
+
+
+def replace_key(snapshot, index, value):
+    key = list(snapshot["key"])
+    key[index] = value
+    snapshot["key"] = tuple(key)
+
+
+@pytest.mark.parametrize("change", [
+    lambda snapshot: replace_key(snapshot, 1, (2, 7, 18, "final", 0)),
+    lambda snapshot: replace_key(snapshot, 2, 0),
+    lambda snapshot: snapshot.update(code=[1, 2, 3]),
+], ids=["version", "magic", "code"])
+def test_stale_snapshot(tmp_path, change):
+    path = str(tmp_path / "snapshot.marshal")
+    save_snapshot(path)
+    with open(path, "rb") as f:
+        snapshot = marshal.load(f)
+    change(snapshot)
+    with open(path, "wb") as f:
+        marshal.dump(snapshot, f)
+    assert load_snapshot(path) is None
+
+
+@pytest.mark.parametrize("data", [b"", b"not a snapshot", marshal.dumps([1, 2]), marshal.dumps({})],
+                         ids=["empty", "garbage", "list", "empty-dict"])
+def test_broken_snapshot(tmp_path, data):
+    path = tmp_path / "snapshot.marshal"
+    path.write_bytes(data)
+    assert load_snapshot(str(path)) is None
+    assert load_snapshot(str(tmp_path / "missing.marshal")) is None
@@ -0,0 +1,34 @@
+import pytest
+from tokenizer import tokenize_lua_array
+from tokenstream import pack_tokens, unpack_tokens, write_tokens, TokenFile
+
+
+def rows(tokens):
+    return [(tok.type, tok.value, tok.start, tok.end) for tok in tokens]
+
+
+@pytest.mark.parametrize("binary", [False, True], ids=["text", "bytes"])
+@pytest.mark.parametrize("pool", [True, False], ids=["pool", "no-pool"])
+def test_pack_round_trips(sources, binary, pool):
+    for code in sources:
+        source = code.encode() if binary else code
+        tokens = tokenize_lua_array(source)
+        expected = rows(tokens)
+        buffer = pack_tokens(tokens, pool=pool)
+        assert rows(unpack_tokens(buffer, None if pool else source)) == expected, code
+        assert rows(unpack_tokens(buffer, None if pool else source, copy=True)) == expected, code
+        assert pack_tokens(tokens.to_tokens(), source, pool=pool) == buffer, code
+
+
+@pytest.mark.parametrize("binary", [False, True], ids=["text", "bytes"])
+def test_token_file(sources, tmp_path, binary):
+    code = "\n".join(sources)
+    source = code.encode() if binary else code
+    tokens = tokenize_lua_array(source)
+    path = str(tmp_path / "tokens.puat")
+    write_tokens(path, tokens)
+    with TokenFile(path) as f:
+        assert len(f) == len(tokens)
+        assert rows(f) == rows(tokens)
+        assert rows(f[10:50]) == rows(tokens[10:50])
+        assert f.tokens.source == source
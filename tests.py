@@ -1,36 +1,23 @@
-from tokenizer import tokenize_lua
+from corpus import scan_corpus
 import os
 
 desktop = f"C:\\Users\\{os.getlogin()}\\Desktop"
 
-def collect(file_extension):
-    retv = []
-    for root, dirs, files in os.walk(desktop):
-        for file in files:
-            if file.endswith(file_extension):
-                retv.append(os.path.join(root, file))
-    return retv
-
 
 def tokenizer_test():
-    files = collect(".lua")
     passes = 0
-    for file in files:
-        print("\033[31m FILE  \033[0m", file)
-        with open(file, "r", errors="ignore", encoding="utf-8") as f:
-            content = f.read()
-        tokens = tokenize_lua(content)
-        buffer = []
-        for token in tokens:
-            if token.type == "UNKNOWN":
-                buffer.append(token.value)
-        if len(buffer) == 0:
+    files = 0
+    for result in scan_corpus([desktop]):
+        files += 1
+        print("\033[31m FILE  \033[0m", result["path"])
+        if result["unknown"] == 0 and result["error"] is None:
             print("\033[42m  PASS  \033[0m")
             passes+=1
         else:
             print("\033[41m  FAIL  \033[0m")
-        print("".join(buffer))
+        print(result["error"] or "".join(value for offset, value in result["unknown_tokens"]))
 
-    print(f"{passes}/{len(files)} tokenized successfully")
+    print(f"{passes}/{files} tokenized successfully")
 
-tokenizer_test()
\ No newline at end of file
+if __name__ == "__main__":
+    tokenizer_test()
@@ -0,0 +1,155 @@
+import functools
+from array import array
+from typing import Iterable, Iterator
+from objects import Token
+from Lua import lua, LEXEME_KINDS, TRIVIA_TYPES
+from lines import LineIndex
+
+
+# every lua.token name gets a small integer code, in definition order
+token_kinds: list[str] = [value for name, value in vars(lua.token).items() if name.isupper() and isinstance(value, str)]
+kind_codes: dict[str, int] = {kind: code for code, kind in enumerate(token_kinds)}
+
+# kind code of every keyword and operator lexeme
+lexeme_codes: dict[str, int] = {lexeme: kind_codes[kind] for lexeme, kind in LEXEME_KINDS.items()}
+lexeme_byte_codes: dict[bytes, int] = {lexeme.encode(): code for lexeme, code in lexeme_codes.items()}
+
+# kinds the parser skips over
+trivia_kinds = frozenset(kind_codes[kind] for kind in TRIVIA_TYPES)
+
+# layout tokens are zero width, their value does not come from the source
+layout_values: dict[int, str] = {
+    kind_codes[lua.token.INDENT]: "\t",
+    kind_codes[lua.token.DEDENT]: "",
+}
+layout_byte_values: dict[int, bytes] = {code: value.encode() for code, value in layout_values.items()}
+
+
+class TokenView:
+    """ a `Token` like view of one entry of a `TokenArray`.
+
+    The value is sliced from the source when it is asked for.
+    """
+    __slots__ = ("tokens", "index")
+
+    def __init__(self, tokens: "TokenArray", index: int):
+        self.tokens = tokens
+        self.index = index
+
+    @property
+    def type(self) -> str:
+        return token_kinds[self.tokens.kinds[self.index]]
+
+    @property
+    def kind(self) -> int:
+        return self.tokens.kinds[self.index]
+
+    @property
+    def value(self) -> str:
+        return self.tokens.value(self.index)
+
+    @property
+    def start(self) -> int:
+        return self.tokens.starts[self.index]
+
+    @property
+    def end(self) -> int:
+        return self.tokens.ends[self.index]
+
+    @property
+    def line(self) -> int:
+        return self.tokens.lines.line(self.start)
+
+    @property
+    def column(self) -> int:
+        return self.tokens.position(self.index)[1]
+
+    def to_token(self) -> Token:
+        return Token(self.type, self.value, self.start, self.end, self.tokens.lines)
+
+    def __eq__(self, other):
+        if isinstance(other, (TokenView, Token)):
+            return (self.type, self.value, self.start, self.end) == (other.type, other.value, other.start, other.end)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_token())
+
+
+class TokenArray:
+    """ a columnar token list.
+
+    Token kinds are stored as codes from `kind_codes` and offsets in `array`
+    buffers; nothing is copied out of the source until a value is requested.
+    Indexing and iterating give `TokenView`s, so code written against a list
+    of `Token`s keeps working. Lines and columns come from a `LineIndex`
+    made the first time one is asked for.
+
+    The source may be bytes like (bytes, memoryview, mmap), in which case the
+    offsets are byte offsets and values are bytes.
+    """
+
+    def __init__(self, source: str | bytes, kinds: array = None, starts: array = None, ends: array = None):
+        self.source = source
+        self.kinds = kinds if kinds is not None else array("B")
+        self.starts = starts if starts is not None else array("q")
+        self.ends = ends if ends is not None else array("q")
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[Token], source: str) -> "TokenArray":
+        retv = cls(source)
+        for tok in tokens:
+            retv.append(tok.type, tok.start, tok.end)
+        return retv
+
+    def append(self, type: str, start: int, end: int) -> None:
+        self.kinds.append(kind_codes[type])
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def type(self, index: int) -> str:
+        return token_kinds[self.kinds[index]]
+
+    def value(self, index: int) -> str | bytes:
+        kind = self.kinds[index]
+        if isinstance(self.source, str):
+            if kind in layout_values:
+                return layout_values[kind]
+            return self.source[self.starts[index]:self.ends[index]]
+        if kind in layout_byte_values:
+            return layout_byte_values[kind]
+        return bytes(self.source[self.starts[index]:self.ends[index]])
+
+    @functools.cached_property
+    def lines(self) -> LineIndex:
+        """ the `LineIndex` of the source, built on first use """
+        return LineIndex(self.source)
+
+    def position(self, index: int) -> tuple[int, int]:
+        """ the (line, column) where token `index` starts """
+        return self.lines.position(self.starts[index])
+
+    def to_tokens(self) -> list[Token]:
+        return [view.to_token() for view in self]
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            retv = TokenArray(self.source, self.kinds[index], self.starts[index], self.ends[index])
+            if "lines" in self.__dict__:
+                retv.lines = self.lines
+            return retv
+        if index < 0:
+            index += len(self.kinds)
+        if not 0 <= index < len(self.kinds):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self) -> Iterator[TokenView]:
+        for index in range(len(self.kinds)):
+            yield TokenView(self, index)
+
+    def __repr__(self):
+        return f"TokenArray({len(self)} tokens)"
@@ -1,36 +1,650 @@
+import os
 import re
+import sys
+import _sre
+import mmap
+import codecs
+import functools
+import time
+from contextlib import contextmanager
+from typing import IO, Iterable, Iterator
 from objects import Token, IndentToken, TokenSpecification
-from Lua import lua, token_specification
+from regex import compiled, compile_pattern
+from lines import LineIndex
+from tokenstats import TokenizerStats, untimed
+from Lua import lua, token_specification, LEXEME_KINDS, LEXEME_BYTE_KINDS, CLASSIFIED_TYPES, TRIVIA_TYPES
+from tokenarray import TokenArray, kind_codes, lexeme_codes, lexeme_byte_codes
+
+
+# flags of every pattern compiled for text: `\b`, `\w`, `\s` and `\d` then mean
+# what they mean in the bytes patterns, so a source scans to the same tokens
+# either way, and no character past ASCII is ever part of a name
+TEXT_FLAGS = re.ASCII
+
+
+def specification_source(specification: list[TokenSpecification], binary: bool = False,
+                         catch_all: bool = True) -> tuple[str, dict[str, str]]:
+    """ join a token specification into a single alternation of named
+    groups, so the whole source can be scanned in one left to right pass.
+
+    The alternatives are tried last entry first: `get_tokenmap` lets a later
+    specification overwrite an earlier one that starts at the same offset,
+    and the master pattern keeps that priority. Spaces and any character no
+    specification matches get their own trailing alternatives, exactly as
+    `list_tokens` produces them.
+
+    Args:
+        specification (list[TokenSpecification]): the token specification
+        binary (bool, optional): the pattern is for bytes; an unknown utf-8
+            sequence is then one UNKNOWN token, as it is when scanning text.
+            Defaults to False.
+        catch_all (bool, optional): add the spaces and unknown character
+            alternatives. Defaults to True.
+
+    Returns:
+        tuple[str, dict[str, str]]: the master pattern source and a mapping of
+        its group names to token types
+    """
+    alternatives = []
+    groups = {}
+    for index in reversed(range(len(specification))):
+        spec = specification[index]
+        pattern = spec.pattern
+        if isinstance(pattern, re.Pattern):
+            pattern = f"(?s:{pattern.pattern})" if pattern.flags & re.DOTALL else pattern.pattern
+        name = f"T{index}"
+        alternatives.append(f"(?P<{name}>{pattern})")
+        groups[name] = spec.type
+    if not catch_all:
+        return "|".join(alternatives), groups
+    alternatives.append("(?P<WS> )")
+    groups["WS"] = lua.token.WHITESPACE
+    alternatives.append(r"(?P<UNKNOWN>[\xc2-\xf4][\x80-\xbf]*|(?s:.))" if binary else "(?P<UNKNOWN>(?s:.))")
+    groups["UNKNOWN"] = lua.token.UNKNOWN
+    return "|".join(alternatives), groups
+
+
+def compile_specification(specification: list[TokenSpecification], binary: bool = False,
+                          catch_all: bool = True) -> tuple[re.Pattern, dict[str, str]]:
+    """ compile `specification_source(specification)`, as a bytes pattern if
+    `binary` is set. The specification patterns are ascii and text patterns
+    are compiled with `TEXT_FLAGS`, so the bytes pattern matches the same
+    tokens over the raw bytes of a source; a character past ASCII is an
+    UNKNOWN token in both. """
+    source, groups = specification_source(specification, binary, catch_all)
+    if binary:
+        return re.compile(source.encode("latin-1")), groups
+    return re.compile(source, TEXT_FLAGS), groups
+
+
+# where `save_snapshot` writes the compiled master pattern, next to the bytecode
+snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__",
+                             f"lua_specification.{sys.implementation.cache_tag}.marshal")
+
+
+def snapshot_key(source: str) -> tuple:
+    """ the python, `_sre` engine and pattern a snapshot of the master pattern
+    `source` is made for; a snapshot with any other key is not used """
+    return sys.implementation.name, tuple(sys.version_info), _sre.MAGIC, source, int(TEXT_FLAGS)
+
+
+def save_snapshot(path: str = snapshot_path) -> None:
+    """ save the master pattern in its compiled form.
+
+    `master_scanner` picks the snapshot up instead of running the regex
+    parser and compiler, as long as it was made from the same pattern by the
+    same python release with the same `_sre` engine. The compiled form is
+    internal to `re`, so any other python ignores the snapshot and compiles
+    as usual. The snapshot is plain data written with `marshal`, so loading
+    it never runs code.
+    """
+    import marshal
+    from re import _parser, _compiler
+    source, groups = specification_source(token_specification)
+    parsed = _parser.parse(source, TEXT_FLAGS)
+    indexgroup = [None] * parsed.state.groups
+    for name, index in parsed.state.groupdict.items():
+        indexgroup[index] = name
+    snapshot = {
+        "key": snapshot_key(source),
+        "flags": int(parsed.state.flags),
+        "code": [int(op) for op in _compiler._code(parsed, TEXT_FLAGS)],
+        "groups": parsed.state.groups - 1,
+        "groupindex": dict(parsed.state.groupdict),
+        "indexgroup": tuple(indexgroup),
+        "token_groups": groups,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        marshal.dump(snapshot, f)
+
+
+def load_snapshot(path: str = snapshot_path) -> tuple[re.Pattern, dict[str, str]] | None:
+    """ the master pattern from a `save_snapshot` snapshot, or None when there
+    is no usable snapshot at `path` """
+    try:
+        with open(path, "rb") as f:
+            import marshal
+            snapshot = marshal.load(f)
+        source, groups = specification_source(token_specification)
+        if snapshot["key"] != snapshot_key(source):
+            return None
+        pattern = _sre.compile(source, snapshot["flags"], snapshot["code"], snapshot["groups"],
+                               snapshot["groupindex"], snapshot["indexgroup"])
+        return pattern, snapshot["token_groups"]
+    except (OSError, EOFError, ValueError, TypeError, KeyError, RuntimeError):
+        # missing, truncated, not a snapshot, or code `_sre` rejects
+        return None
+
+
+@functools.cache
+def master_scanner(binary: bool = False) -> tuple[re.Pattern, dict[str, str]]:
+    """ the master pattern of `token_specification` and its group to token
+    type mapping, compiled (or loaded from a snapshot) on first use. With
+    `binary` set the pattern scans bytes like objects. """
+    if binary:
+        return compile_specification(token_specification, binary=True)
+    return load_snapshot() or compile_specification(token_specification)
+
+
+# the token types that can hold a keyword, or text that looks like one
+BLOCK_SCAN_TYPES = frozenset((lua.token.NAME, lua.token.KEYWORD, lua.token.NUMBER, lua.token.STRING,
+                              lua.token.COMMENT, lua.token.UNKNOWN))
+
+
+@functools.cache
+def block_scanner(binary: bool = False) -> tuple[re.Pattern, dict[str, str]]:
+    """ the master pattern less the alternatives of operators, brackets and
+    spaces, and its group to token type mapping.
+
+    Those tokens never hold a name, a keyword, a string or a comment, or
+    the start of one, so searching a source with this pattern finds the
+    same names, keywords, strings and comments as scanning it with the
+    master pattern, while stepping over everything else without a match.
+    """
+    return compile_specification([spec for spec in token_specification if spec.type in BLOCK_SCAN_TYPES],
+                                 binary, catch_all=False)
+
+
+def classified_groups(groups: dict[str, str]) -> frozenset[str]:
+    """ the master pattern groups whose matches are refined to a keyword or
+    operator kind through `LEXEME_KINDS` """
+    return frozenset(group for group, ts in groups.items() if ts in CLASSIFIED_TYPES)
+
+
+def scan_tokens(code: str, stats: TokenizerStats = None) -> list[Token]:
+    """ scan `code` in a single pass of the master pattern.
+
+    Produces the same list as `list_tokens(get_tokenmap(code), len(code))`
+    in linear time, without the per specification `finditer` passes or the
+    per character tokenmap lookups. `stats` counts the matches of every
+    pattern group.
+    """
+    master_pattern, groups = master_scanner()
+    classified = classified_groups(groups)
+    kinds = LEXEME_KINDS
+    lines = LineIndex(code)
+    tokens = []
+    append = tokens.append
+    finds = master_pattern.finditer(code)
+    if stats is not None:
+        finds = stats.count_groups(finds)
+    for find in finds:
+        string = find.group()
+        group = find.lastgroup
+        ts = groups[group]
+        if group in classified:
+            ts = kinds.get(string, ts)
+        append(Token(ts, string, find.start(), find.end(), lines))
+    return tokens
+
+
+def iter_significant_tokens(code: str | bytes, start: int = 0, end: int = None) -> Iterator[Token]:
+    """ scan `code` lazily, yielding only the tokens a parser reads.
+
+    Whitespace, newlines and comments are dropped before a `Token` is built
+    for them, and no layout tokens are made. Bytes like sources give bytes
+    values and byte offsets, as in `tokenize_lua_array`. Only
+    `code[start:end]` is scanned, with offsets into the whole of `code`.
+    """
+    binary = not isinstance(code, str)
+    master_pattern, groups = master_scanner(binary)
+    classified = classified_groups(groups)
+    skipped = frozenset(group for group, ts in groups.items() if ts in TRIVIA_TYPES)
+    kinds = LEXEME_BYTE_KINDS if binary else LEXEME_KINDS
+    lines = LineIndex(code)
+    for find in master_pattern.finditer(code, start, len(code) if end is None else end):
+        group = find.lastgroup
+        if group in skipped:
+            continue
+        string = find.group()
+        ts = groups[group]
+        if group in classified:
+            ts = kinds.get(string, ts)
+        yield Token(ts, string, find.start(), find.end(), lines)
+
+
+# the spaces a line starts with
+leading_spaces = re.compile(" *")
+
+
+def indentation(spaces: int) -> int:
+    """ indentation level of a line starting with `spaces` spaces """
+    if spaces < 4:
+        return 0
+    return round(spaces/4)
+
+
+def layout_tokens(tokens: Iterable[Token]) -> Iterator[Token]:
+    """ merge indentation into a stream of scanned tokens.
+
+    NEWLINE tokens and the spaces that start the following line are dropped.
+    When the indentation level of that line differs from the previous one,
+    one INDENT per level gained or one DEDENT per level lost is emitted in
+    their place, as zero width tokens at the start of the line. Only the
+    current level is kept, so this works on a stream of any length.
+    """
+    current_indents = 0
+    tokens = iter(tokens)
+    for tok in tokens:
+        while tok is not None and tok.type == lua.token.NEWLINE:
+            line_start, lines = tok.end, tok.lines
+            spaces = 0
+            tok = None
+            for tok in tokens:
+                if tok.type != lua.token.WHITESPACE:
+                    break
+                spaces += 1
+                tok = None
+            indent = indentation(spaces)
+            diff = indent - current_indents
+            if diff > 0:
+                for i in range(diff):
+                    yield Token(lua.token.INDENT, "\t", line_start, line_start, lines)
+            elif diff < 0:
+                for i in range(-diff):
+                    yield Token(lua.token.DEDENT, "", line_start, line_start, lines)
+            current_indents = indent
+        if tok is None:
+            return
+        yield tok
+
+
+def read_chunks(stream: IO, chunk_size: int = 1 << 16, encoding: str = "utf-8", errors: str = "strict") -> Iterator[str]:
+    """ read a text or binary file object as a sequence of text chunks.
+
+    Binary streams are decoded incrementally, so a multi byte character split
+    across two reads is decoded once both halves are in.
+    """
+    decoder = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if not isinstance(chunk, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)(errors)
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        chunk = decoder.decode(b"", final=True)
+        if chunk:
+            yield chunk
+
+
+def iter_scan_tokens(chunks: Iterable[str]) -> Iterator[Token]:
+    """ scan a sequence of text chunks, yielding tokens once they are final.
+
+    Only strings and long brackets can run past the end of a line, so the
+    buffered text is scanned up to its last newline and only the unfinished
+    line is carried over to the next chunk. A string or long bracket that
+    reaches that limit unfinished is carried over whole; for a long bracket
+    the buffer is then held until its closer (or the end of the input)
+    arrives, the closer being looked for in the new chunks only.
+    Offsets are absolute, and the tokens are the ones `scan_tokens` would
+    produce for the concatenated input.
+    """
+    master_pattern, groups = master_scanner()
+    classified = classified_groups(groups)
+    kinds = LEXEME_KINDS
+    unknown = lua.token.UNKNOWN
+    opener = compiled("LongBracketOpener")
+    pending = []
+    base = 0
+    closer = None
+    tail = ""
+    chunks = iter(chunks)
+    eof = False
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            pending.append(chunk)
+            if closer is not None:
+                tail += chunk
+                if closer not in tail:
+                    tail = tail[1 - len(closer):]
+                    continue
+                closer = None
+            if "\n" not in chunk:
+                continue
+        buf = "".join(pending)
+        limit = len(buf) if eof else buf.rfind("\n") + 1
+        pos = 0
+        for find in master_pattern.finditer(buf, 0, limit):
+            string = find.group()
+            group = find.lastgroup
+            ts = groups[group]
+            if ts == unknown and not eof and find.end() == limit:
+                # an unfinished string or long bracket, which more input may finish
+                long = opener.match(string)
+                if long:
+                    closer = "]" + long.group(1) + "]"
+                    tail = buf[max(limit - len(closer) + 1, find.start() + long.end()):]
+                    if closer in tail:
+                        closer = None
+                break
+            if group in classified:
+                ts = kinds.get(string, ts)
+            pos = find.end()
+            yield Token(ts, string, base + find.start(), base + pos)
+        pending = [buf[pos:]] if pos < len(buf) else []
+        base += pos
+
+
+def iter_tokenize_lua(stream: IO, chunk_size: int = 1 << 16, encoding: str = "utf-8", errors: str = "strict") -> Iterator[Token]:
+    """ tokenize lua source read from a file object, yielding tokens as soon
+    as they are final.
+
+    Peak memory is bounded by the chunk size and the longest line or token,
+    not by the size of the file.
+
+    Args:
+        stream (IO): a text or binary file object
+        chunk_size (int, optional): characters (or bytes) per read. Defaults to 64KiB.
+        encoding (str, optional): encoding of binary streams. Defaults to "utf-8".
+        errors (str, optional): decoding error handler. Defaults to "strict".
+
+    Yields:
+        Token: the tokens `tokenize_lua` returns for the whole source
+    """
+    return layout_tokens(iter_scan_tokens(read_chunks(stream, chunk_size, encoding, errors)))
+
+
+def scan_layout(tokens: TokenArray, code: str | bytes | memoryview | mmap.mmap, base: int = 0,
+                line_start: int = -1, finish: bool = True, stats: TokenizerStats = None) -> int:
+    """ scan `code` into the columns of `tokens`, merging the indentation in
+    as `layout_tokens` does; the scan behind `tokenize_lua_array`.
+
+    Offsets are shifted by `base`, for a `code` cut out of a larger source
+    at that offset. `line_start` is the offset of the first line when
+    `code` starts right after a NEWLINE token, whose indentation is then
+    resolved against a previous line without any; -1 when `code` starts a
+    source. With `finish` unset a line still open at the end is left for
+    whatever follows `code`. Gives the indentation level of the last line
+    resolved.
+    """
+    binary = not isinstance(code, str)
+    master_pattern, master_groups = master_scanner(binary)
+    codes = {group: kind_codes[ts] for group, ts in master_groups.items()}
+    classified = classified_groups(master_groups)
+    lexemes = lexeme_byte_codes if binary else lexeme_codes
+    newline = kind_codes[lua.token.NEWLINE]
+    whitespace = kind_codes[lua.token.WHITESPACE]
+    indent_code = kind_codes[lua.token.INDENT]
+    dedent_code = kind_codes[lua.token.DEDENT]
+    kinds, starts, ends = tokens.kinds, tokens.starts, tokens.ends
+    current_indents = 0
+    spaces = 0
+
+    def resolve(line_start, spaces, current_indents) -> int:
+        indent = indentation(spaces)
+        diff = indent - current_indents
+        kind = indent_code if diff > 0 else dedent_code
+        for i in range(abs(diff)):
+            kinds.append(kind)
+            starts.append(line_start)
+            ends.append(line_start)
+        return indent
+
+    finds = master_pattern.finditer(code)
+    if stats is not None:
+        finds = stats.count_groups(finds)
+    for find in finds:
+        group = find.lastgroup
+        kind = codes[group]
+        if group in classified:
+            kind = lexemes.get(find.group(), kind)
+        if line_start >= 0:
+            if kind == whitespace:
+                spaces += 1
+                continue
+            current_indents = resolve(line_start, spaces, current_indents)
+            line_start = -1
+        if kind == newline:
+            line_start = find.end() + base
+            spaces = 0
+            continue
+        kinds.append(kind)
+        starts.append(find.start() + base)
+        ends.append(find.end() + base)
+    if line_start >= 0 and finish:
+        current_indents = resolve(line_start, spaces, current_indents)
+    return current_indents
+
+
+def tokenize_lua_array(code: str | bytes | memoryview | mmap.mmap, stats: TokenizerStats = None) -> TokenArray:
+    """ tokenize lua source code into a `TokenArray`.
+
+    Gives the tokens of `tokenize_lua` without creating a `Token` or a value
+    string per token; the indentation is merged on the integer kind codes
+    while scanning, the same way `layout_tokens` does.
+
+    `code` may also be a bytes like object, such as a memory mapped file.
+    It is scanned in place with the bytes version of the master pattern,
+    without decoding it; offsets are then byte offsets and values are bytes.
+
+    `stats` records the scan as the "tokenize_lua_array" phase.
+    """
+    if stats is not None:
+        began = time.perf_counter()
+    retv = TokenArray(code)
+    scan_layout(retv, code, stats=stats)
+    if stats is not None:
+        stats.add_phase("tokenize_lua_array", time.perf_counter() - began)
+        stats.add_token_array(retv)
+        if stats.time_patterns:
+            stats.time_specification(code)
+    return retv
+
+
+# the token types that can hold a newline
+MULTILINE_TYPES = frozenset((lua.token.STRING, lua.token.COMMENT, lua.token.UNKNOWN))
+
+
+@functools.cache
+def multiline_scanner(binary: bool = False) -> re.Pattern:
+    """ the master pattern less every alternative but strings, comments and
+    unfinished long brackets.
+
+    No other token holds a quote, a `--` or the opener of a long bracket,
+    so searching a source with this pattern finds the same strings and
+    comments as scanning it with the master pattern; every newline outside
+    them is a NEWLINE token. All of them start with one of `'"-[`, which
+    the search looks for before trying any alternative.
+    """
+    source, groups = specification_source([spec for spec in token_specification if spec.type in MULTILINE_TYPES],
+                                          binary, catch_all=False)
+    source = f"(?=['\"\\-\\[])(?:{source})"
+    return compile_pattern(source.encode("latin-1")) if binary else compile_pattern(source, TEXT_FLAGS)
+
+
+def segment_bounds(code: str | bytes | memoryview | mmap.mmap, count: int) -> list[int]:
+    """ offsets cutting `code` into at most `count` segments of about the
+    same size, each cut just after a NEWLINE token.
+
+    A single pass of `multiline_scanner` over the source up to the last
+    cut steps over the strings and comments, which are the only tokens a
+    newline can be part of. Gives the offsets the segments start at, and
+    the length of `code`.
+    """
+    binary = not isinstance(code, str)
+    finds = multiline_scanner(binary).finditer(code)
+    newline = compile_pattern(b"\n" if binary else "\n")
+    find = next(finds, None)
+    retv = [0]
+    position = 0
+    for index in range(1, count):
+        position = max(len(code) * index // count, position)
+        while True:
+            while find is not None and find.end() <= position:
+                find = next(finds, None)
+            line_end = newline.search(code, position)
+            if line_end is None:
+                return retv + [len(code)]
+            if find is None or line_end.start() < find.start():
+                break
+            position = find.end()
+        position = line_end.end()
+        if position == len(code):
+            break
+        retv.append(position)
+    return retv + [len(code)]
+
+
+def tokenize_segment(segment: tuple[str | bytes, int, bool]) -> tuple[bytes, bytes, bytes, int, int]:
+    """ scan one segment of a source for `tokenize_lua_parallel`.
+
+    Takes the text of the segment, its offset and whether it ends the
+    source. Gives its kind, start and end columns as bytes, how many INDENT
+    tokens its first line was resolved to, and the indentation level of its
+    last line.
+    """
+    code, base, last = segment
+    tokens = TokenArray(code)
+    indents = scan_layout(tokens, code, base, base if base else -1, last)
+    first = 0
+    if base:
+        indent_code = kind_codes[lua.token.INDENT]
+        while first < len(tokens) and tokens.kinds[first] == indent_code and tokens.starts[first] == base:
+            first += 1
+    return tokens.kinds.tobytes(), tokens.starts.tobytes(), tokens.ends.tobytes(), first, indents
+
+
+def tokenize_lua_parallel(code: str | bytes | memoryview | mmap.mmap, workers: int = None,
+                          segment_size: int = 1 << 22) -> TokenArray:
+    """ `tokenize_lua_array(code)`, with the scanning spread over a process pool.
+
+    The source is cut into segments of about `segment_size` (at least one
+    per worker) just after NEWLINE tokens, found by `segment_bounds`. Every
+    segment is scanned on its own, with its offsets shifted into the
+    source, as if the line before it had no indentation; the INDENT and
+    DEDENT tokens of its first line are fixed up against the last line of
+    the segment before it while the columns are joined. Sources too small
+    for two segments are scanned in this process.
+
+    Segments are copied to the workers, so this pays off on sources of
+    tens of megabytes and more.
+    """
+    workers = workers or os.cpu_count() or 1
+    count = max(workers, len(code) // segment_size) if workers > 1 else 1
+    bounds = segment_bounds(code, count) if count > 1 else [0, len(code)]
+    if len(bounds) < 3:
+        return tokenize_lua_array(code)
+    import multiprocessing
+
+    def segments():
+        for start, end in zip(bounds, bounds[1:]):
+            text = code[start:end]
+            yield (text.tobytes() if isinstance(text, memoryview) else text), start, end == len(code)
+
+    retv = TokenArray(code)
+    kinds, starts, ends = retv.kinds, retv.starts, retv.ends
+    indent_code = kind_codes[lua.token.INDENT]
+    dedent_code = kind_codes[lua.token.DEDENT]
+    size = starts.itemsize
+    indents = 0
+    with multiprocessing.Pool(min(workers, len(bounds) - 1)) as pool:
+        for base, (segment_kinds, segment_starts, segment_ends, first, last) in zip(bounds, pool.imap(tokenize_segment, segments())):
+            diff = first - indents
+            for i in range(abs(diff)):
+                kinds.append(indent_code if diff > 0 else dedent_code)
+                starts.append(base)
+                ends.append(base)
+            kinds.frombytes(segment_kinds[first:])
+            starts.frombytes(segment_starts[first*size:])
+            ends.frombytes(segment_ends[first*size:])
+            indents = last
+    return retv
+
+
+def map_file(path: str) -> mmap.mmap | bytes:
+    """ map a file read only; an empty file, which cannot be mapped, gives b"" """
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
+
 
+@contextmanager
+def mapped_file(path: str) -> Iterator[mmap.mmap | bytes]:
+    """ `map_file(path)`, unmapped when the block ends; nothing read from the
+    mapping may be used after that """
+    content = map_file(path)
+    try:
+        yield content
+    finally:
+        if isinstance(content, mmap.mmap):
+            content.close()
 
 
+def tokenize_lua_file(path: str, workers: int = 1) -> TokenArray:
+    """ tokenize a lua file in place through a memory map.
 
-def tokenize_lua(code: str) -> list[Token]:
+    Nothing is decoded or copied up front: the offsets are byte offsets into
+    the file and each value is read from the mapping when it is asked for.
+    With more than one worker (None for one per cpu) a large file is
+    scanned by `tokenize_lua_parallel`.
+    """
+    if workers == 1:
+        return tokenize_lua_array(map_file(path))
+    return tokenize_lua_parallel(map_file(path), workers)
+
+
+def tokenize_lua(code: str, single_pass: bool = True, stats: TokenizerStats = None) -> list[Token]:
+    """ tokenize lua source code.
+
+    Bytes like sources (bytes, memoryview, mmap) are scanned without decoding
+    by `tokenize_lua_array`, whose `TokenArray` is returned.
+
+    Args:
+        code (str): the lua source
+        single_pass (bool, optional): scan with the compiled master pattern.
+            Pass False to use the original per specification tokenmap and
+            indentation merge. Defaults to True.
+        stats (TokenizerStats, optional): records the time of every phase
+            and the matches of every pattern. Defaults to None.
+
+    Returns:
+        list[Token]: the tokens, with indentation merged in
+    """
     
     def get_indent_dedent(code: str) -> list[IndentToken]:
-        
-        def count_startswith(string: str, startswith:str) -> int:
-            c = 0
-            for char in string:
-                if char == startswith:c+=1
-                else:
-                    return c
-            return c
 
-        def indentation(line) -> int:
-            x = count_startswith(line, " ")
+        def indentation(start) -> int:
+            x = leading_spaces.match(code, start).end() - start
             if x < 4: 
                 return 0
             return round(x/4)
         
-        lines = [line+"\n" for line in code.split("\n")]
-        indents = [indentation(line) for line in lines]
-        charcount = 0
+        line_starts = LineIndex(code).starts
         current_indents = 0
         items = []
 
-        for index, line in enumerate(lines):
-            indent = indents[index]
+        for charcount in line_starts:
+            indent = indentation(charcount)
             if indent == 0:
                 items.append(None)
             diff = indent - current_indents
@@ -56,7 +670,6 @@ def tokenize_lua(code: str) -> list[Token]:
                                 charcount, 
                                 "\t"))
             current_indents = indent
-            charcount+=len(line)
         
         return items
 
@@ -65,9 +678,12 @@ def tokenize_lua(code: str) -> list[Token]:
         tokenmap = {}
         # get all the possible tokens
         tokspec: TokenSpecification
-        for tokspec in token_specification:
+        for index, tokspec in enumerate(token_specification):
+            if stats is not None:
+                began = time.perf_counter()
+            matches = 0
             find: re.Match
-            for find in re.finditer(tokspec.pattern, code):
+            for matches, find in enumerate(compile_pattern(tokspec.pattern, 0 if isinstance(tokspec.pattern, re.Pattern) else TEXT_FLAGS).finditer(code), 1):
                 start = find.start()
                 end = find.end()
                 string = code[start:end]
@@ -75,6 +691,8 @@ def tokenize_lua(code: str) -> list[Token]:
                 if ts == lua.token.NAME and string in lua.keyword.all():
                     ts = string.upper()
                 tokenmap[start] = Token(ts, string, start, end)
+            if stats is not None:
+                stats.add_matches(f"T{index}", matches, time.perf_counter() - began)
         
         return tokenmap
 
@@ -102,7 +720,7 @@ def tokenize_lua(code: str) -> list[Token]:
                     tokens.append(Token(lua.token.WHITESPACE, value=" ", start=count, end=count+1))
                     continue
                 else:
-                    t = Token("UNKNOWN", value=current_token, start=count, end=count+len(current_token))
+                    t = Token(lua.token.UNKNOWN, value=current_token, start=count, end=count+len(current_token))
                     tokens.append(t)
                     continue
         
@@ -192,10 +810,33 @@ def tokenize_lua(code: str) -> list[Token]:
     #codelen = len(code)
     #listed_tokens = list_tokens(get_tokenmap(code), len(code))
     
-    tokenmap = get_tokenmap(code)
-    tokens = list_tokens(tokenmap, len(code))
-    ides = get_indent_dedent(code)
-    retv = merge_tokens(tokens, ides)
+    if not isinstance(code, str):
+        return tokenize_lua_array(code, stats)
+    if stats is None and single_pass:
+        return list(layout_tokens(scan_tokens(code)))
+    
+    phase = stats.phase if stats is not None else untimed
+    if single_pass:
+        with phase("scan_tokens"):
+            tokens = scan_tokens(code, stats)
+        with phase("layout_tokens"):
+            retv = list(layout_tokens(tokens))
+    else:
+        with phase("get_tokenmap"):
+            tokenmap = get_tokenmap(code)
+        with phase("list_tokens"):
+            tokens = list_tokens(tokenmap, len(code))
+        with phase("get_indent_dedent"):
+            ides = get_indent_dedent(code)
+        with phase("merge_tokens"):
+            retv = merge_tokens(tokens, ides)
+        lines = LineIndex(code)
+        for tok in retv:
+            tok.lines = lines
+    if stats is not None:
+        stats.add_tokens(retv, len(code))
+        if stats.time_patterns and single_pass:
+            stats.time_specification(code)
     return retv 
 
     
@@ -225,22 +866,17 @@ function foo(a, b)
     return a + b
 end
 '''
-import time
-
-def time_tokenizer(code):
-
-    start = time.time()
-    tokens = tokenize_lua(lua_code)
-    end = time.time()
-    d = end - start 
-    print(f"total time: {d}")
 
 def test():
-    start = time.time()
+    start = time.perf_counter()
     tokens = tokenize_lua(lua_code)
-    d = time.time() - start
+    d = time.perf_counter() - start
     for tok in tokens:
         print(tok)
     print(f"total time: {d}")
 
-time_tokenizer(lua_code)
\ No newline at end of file
+if __name__ == "__main__":
+    if "--snapshot" in sys.argv:
+        save_snapshot()
+    else:
+        test()
@@ -0,0 +1,150 @@
+import re
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator
+from objects import Token
+from Lua import lua, token_specification
+from regex import compile_pattern
+from tokenarray import TokenArray, token_kinds, kind_codes
+
+
+def untimed(name: str):
+    """ stands in for `TokenizerStats.phase` when nothing is recorded """
+    return nullcontext()
+
+
+class TokenizerStats:
+    """ what a tokenizer run spent its time on, filled in by passing it as
+    `stats` to `tokenize_lua` or `tokenize_lua_array`.
+
+    Records the wall time of every phase, how many tokens each alternative
+    of the master pattern produced (keyed by group name, `T<index>` for
+    `token_specification[index]`), the tokens of every kind and the
+    characters that ended up in UNKNOWN tokens. With `time_patterns` set,
+    every specification pattern is also run alone over the source, for its
+    own match count and time; that is a pass over the source per pattern.
+
+    Stats of many runs can be merged, and go to and from JSON, so a corpus
+    run can be summed up across its workers. Without a stats object the
+    tokenizer only checks for one once per phase.
+    """
+
+    def __init__(self, time_patterns: bool = False):
+        self.time_patterns = time_patterns
+        self.files = 0
+        self.characters = 0
+        self.tokens = 0
+        self.unknown_characters = 0
+        self.phases: dict[str, float] = {}
+        self.kinds: dict[str, int] = {}
+        self.patterns: dict[str, dict] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def pattern(self, group: str) -> dict:
+        """ the entry of a master pattern group """
+        entry = self.patterns.get(group)
+        if entry is None:
+            if group.startswith("T"):
+                spec = token_specification[int(group[1:])]
+                type, pattern = spec.type, spec.pattern
+            else:
+                type, pattern = (lua.token.WHITESPACE, " ") if group == "WS" else (lua.token.UNKNOWN, "(?s:.)")
+            entry = self.patterns[group] = {"type": type, "pattern": str(pattern), "tokens": 0, "matches": 0, "seconds": 0.0}
+        return entry
+
+    def count_groups(self, finds: Iterable[re.Match]) -> Iterator[re.Match]:
+        """ pass the matches of a master pattern through, counting them by group """
+        counts = Counter()
+        try:
+            for find in finds:
+                counts[find.lastgroup] += 1
+                yield find
+        finally:
+            for group, count in counts.items():
+                self.pattern(group)["tokens"] += count
+
+    def add_matches(self, group: str, matches: int, seconds: float) -> None:
+        entry = self.pattern(group)
+        entry["matches"] += matches
+        entry["seconds"] += seconds
+
+    def time_specification(self, code: str | bytes) -> None:
+        """ run every specification pattern alone over `code` """
+        binary = not isinstance(code, str)
+        with self.phase("time_patterns"):
+            for index, spec in enumerate(token_specification):
+                pattern = spec.pattern.pattern if isinstance(spec.pattern, re.Pattern) else spec.pattern
+                pattern = compile_pattern(pattern.encode("latin-1")) if binary else compile_pattern(pattern, re.ASCII)
+                start = time.perf_counter()
+                matches = sum(1 for find in pattern.finditer(code))
+                self.add_matches(f"T{index}", matches, time.perf_counter() - start)
+
+    def add_kinds(self, kinds: Counter, unknown_characters: int, characters: int) -> None:
+        self.files += 1
+        self.characters += characters
+        self.tokens += sum(kinds.values())
+        self.unknown_characters += unknown_characters
+        for kind, count in kinds.items():
+            self.kinds[kind] = self.kinds.get(kind, 0) + count
+
+    def add_tokens(self, tokens: list[Token], characters: int) -> None:
+        unknown = sum(tok.end - tok.start for tok in tokens if tok.type == lua.token.UNKNOWN)
+        self.add_kinds(Counter(tok.type for tok in tokens), unknown, characters)
+
+    def add_token_array(self, tokens: TokenArray) -> None:
+        kinds = Counter(tokens.kinds)
+        unknown = kind_codes[lua.token.UNKNOWN]
+        characters = 0
+        if kinds[unknown]:
+            starts, ends = tokens.starts, tokens.ends
+            characters = sum(ends[index] - starts[index] for index, kind in enumerate(tokens.kinds) if kind == unknown)
+        self.add_kinds(Counter({token_kinds[kind]: count for kind, count in kinds.items()}), characters, len(tokens.source))
+
+    def merge(self, other: "TokenizerStats | dict") -> None:
+        """ add the numbers of `other`, a stats object or its `to_json()` """
+        if isinstance(other, TokenizerStats):
+            other = other.to_json()
+        self.files += other["files"]
+        self.characters += other["characters"]
+        self.tokens += other["tokens"]
+        self.unknown_characters += other["unknown_characters"]
+        for name, seconds in other["phases"].items():
+            self.add_phase(name, seconds)
+        for kind, count in other["kinds"].items():
+            self.kinds[kind] = self.kinds.get(kind, 0) + count
+        for group, entry in other["patterns"].items():
+            mine = self.pattern(group)
+            for key in ("tokens", "matches", "seconds"):
+                mine[key] += entry[key]
+
+    def to_json(self) -> dict:
+        return {
+            "files": self.files,
+            "characters": self.characters,
+            "tokens": self.tokens,
+            "unknown_characters": self.unknown_characters,
+            "phases": dict(self.phases),
+            "kinds": dict(sorted(self.kinds.items(), key=lambda item: -item[1])),
+            "patterns": {group: dict(entry) for group, entry in self.patterns.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "TokenizerStats":
+        retv = cls()
+        retv.merge(data)
+        return retv
+
+    def dumps(self, **kwargs) -> str:
+        return json.dumps(self.to_json(), **kwargs)
@@ -0,0 +1,204 @@
+import sys
+import mmap
+import struct
+from array import array
+from typing import Iterable
+from objects import Token
+from tokenarray import TokenArray, token_kinds
+
+
+# A token stream file, all integers little endian:
+#
+#   header      magic b"PUAT", format version (u16), flags (u16), kind count
+#               (u32), kind table size in bytes (u32), token count (u64) and
+#               pool size in bytes (u64); 32 bytes
+#   kind table  the token kind names, ascii, each ended by a NUL; a token's
+#               kind code is the index of its name in this table
+#   kinds       one kind code (u8) per token
+#   starts      one start offset (i64) per token
+#   ends        one end offset (i64) per token
+#   pool        optional: the source the offsets point into, utf-8 encoded
+#               text or, with the BINARY flag, the raw bytes
+#
+# The kind table and the kinds are each padded with zeros to a multiple of
+# 8 bytes, so the offset arrays are aligned and can be used in place.
+MAGIC = b"PUAT"
+FORMAT_VERSION = 1
+header = struct.Struct("<4sHHIIQQ")
+
+# flags
+POOL = 1    # the source follows the offsets
+BINARY = 2  # the offsets are byte offsets into a bytes source
+
+
+def padded(size: int) -> int:
+    return size + -size % 8
+
+
+def pack_tokens(tokens: TokenArray | Iterable[Token], source: str | bytes = None, pool: bool = True) -> bytes:
+    """ serialize tokens into the token stream format.
+
+    Args:
+        tokens (TokenArray | Iterable[Token]): the tokens; `Token`s are
+            collected into a `TokenArray` over `source` first
+        source (str | bytes, optional): the source of `Token`s. Defaults to
+            the source of the `TokenArray`.
+        pool (bool, optional): store the source with the tokens, so they can
+            be read back without it. Defaults to True.
+    """
+    if not isinstance(tokens, TokenArray):
+        tokens = TokenArray.from_tokens(tokens, source)
+    source = tokens.source
+    flags = 0
+    data = b""
+    if pool and source is not None:
+        flags |= POOL
+        data = source.encode("utf-8", "surrogatepass") if isinstance(source, str) else bytes(source)
+    if source is not None and not isinstance(source, str):
+        flags |= BINARY
+    table = b"".join(kind.encode("ascii") + b"\0" for kind in token_kinds)
+    count = len(tokens)
+    kinds, starts, ends = tokens.kinds, tokens.starts, tokens.ends
+    if sys.byteorder == "big":
+        starts, ends = array("q", bytes(starts)), array("q", bytes(ends))
+        starts.byteswap()
+        ends.byteswap()
+    return b"".join((
+        header.pack(MAGIC, FORMAT_VERSION, flags, len(token_kinds), len(table), count, len(data)),
+        table, b"\0" * (padded(len(table)) - len(table)),
+        bytes(kinds), b"\0" * (padded(count) - count),
+        bytes(starts), bytes(ends), data))
+
+
+def unpack_tokens(buffer, source: str | bytes = None, copy: bool = False) -> TokenArray:
+    """ read a token stream back into a `TokenArray`.
+
+    Without `copy` the kinds and offsets are memoryviews over `buffer`, so
+    nothing is read until a token is asked for; the `TokenArray` is then read
+    only, and `buffer` must stay open while it is used. With `copy` they are
+    copied into arrays.
+
+    Args:
+        buffer: a bytes like object holding the stream, such as an mmap
+        source (str | bytes, optional): the source the tokens came from.
+            Defaults to the pool of the stream.
+
+    Raises:
+        ValueError: `buffer` is not a token stream, or uses kinds this
+        tokenizer does not know
+    """
+    try:
+        magic, version, flags, kind_count, table_size, count, pool_size = header.unpack_from(buffer, 0)
+    except struct.error:
+        raise ValueError("not a token stream") from None
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a token stream")
+    kinds_offset = header.size + padded(table_size)
+    starts_offset = kinds_offset + padded(count)
+    ends_offset = starts_offset + 8*count
+    pool_offset = ends_offset + 8*count
+    if len(buffer) < pool_offset + pool_size:
+        raise ValueError("truncated token stream")
+
+    view = memoryview(buffer)
+    names = bytes(view[header.size:header.size+table_size]).decode("ascii").split("\0")[:kind_count]
+    kinds = view[kinds_offset:kinds_offset+count]
+    starts = view[starts_offset:ends_offset]
+    ends = view[ends_offset:pool_offset]
+    if names != token_kinds[:len(names)]:
+        try:
+            codes = [token_kinds.index(name) for name in names]
+        except ValueError:
+            raise ValueError("token stream uses unknown token kinds") from None
+        kinds = kinds.tobytes().translate(bytes(codes + [0] * (256 - len(codes))))
+    if copy or sys.byteorder == "big":
+        columns = array("B"), array("q"), array("q")
+        for column, data in zip(columns, (kinds, starts, ends)):
+            column.frombytes(data)
+        kinds, starts, ends = columns
+        if sys.byteorder == "big":
+            starts.byteswap()
+            ends.byteswap()
+    else:
+        starts, ends = starts.cast("q"), ends.cast("q")
+
+    if source is None and flags & POOL:
+        source = view[pool_offset:pool_offset+pool_size]
+        if not flags & BINARY:
+            source = str(source, "utf-8", "surrogatepass")
+        elif copy:
+            source = bytes(source)
+    return TokenArray(source, kinds, starts, ends)
+
+
+def write_tokens(path: str, tokens: TokenArray | Iterable[Token], source: str | bytes = None, pool: bool = True) -> None:
+    """ write `pack_tokens(tokens, source, pool)` to `path` """
+    with open(path, "wb") as f:
+        f.write(pack_tokens(tokens, source, pool))
+
+
+def copy_column(typecode: str, values) -> array:
+    """ an array of `values`, copied out of the buffer they are a view of """
+    if isinstance(values, memoryview):
+        retv = array(typecode)
+        retv.frombytes(values.tobytes())
+        return retv
+    return array(typecode, values)
+
+
+class TokenFile:
+    """ a token stream file, read in place through a memory map.
+
+    Indexing gives one token straight from the mapping, so opening a file
+    of any size costs the same and reading token `i` does not read the
+    tokens before it. Slicing gives a `TokenArray` with its kinds and
+    offsets copied out, so it does not keep the mapping open; its values
+    still come from the file's pool, if it has one. Close the file (or use
+    it as a context manager) only once the tokens taken from it are no
+    longer used.
+    """
+
+    def __init__(self, path: str, source: str | bytes = None):
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.source = source
+        self.tokens = unpack_tokens(self.mapping, source)
+
+    def close(self) -> None:
+        """ unmap the file. Closing it again does nothing.
+
+        Raises:
+            BufferError: something still holds a view of the mapping; the
+                file is left open and usable
+        """
+        if self.tokens is None:
+            return
+        tokens = self.tokens
+        try:
+            for column in (tokens.kinds, tokens.starts, tokens.ends, tokens.source):
+                if isinstance(column, memoryview):
+                    column.release()
+            self.mapping.close()
+        except BufferError:
+            self.tokens = unpack_tokens(self.mapping, self.source)
+            raise BufferError("cannot close a token file while views of its mapping are in use") from None
+        self.tokens = None
+
+    def __enter__(self) -> "TokenFile":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            tokens = self.tokens
+            return TokenArray(tokens.source, copy_column("B", tokens.kinds[index]),
+                              copy_column("q", tokens.starts[index]), copy_column("q", tokens.ends[index]))
+        return self.tokens[index]
+
+    def __iter__(self):
+        return iter(self.tokens)
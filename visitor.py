@@ -0,0 +1,181 @@
+import functools
+from operator import attrgetter
+from typing import Callable, Iterator
+from nodes import Node, value_fields, field_names
+
+
+# returned by a `NodeVisitor` visit method to keep the walk out of the node's children
+SKIP = object()
+
+
+def node_classes(base: type = Node) -> list[type]:
+    """ `base` and every class derived from it """
+    retv = []
+    stack = [base]
+    while stack:
+        cls = stack.pop()
+        retv.append(cls)
+        stack.extend(cls.__subclasses__())
+    return retv
+
+
+@functools.cache
+def child_fields(cls: type) -> tuple[str, ...]:
+    """ the fields of `cls` that can hold a node or a list of nodes, in
+    definition order; spans and plain values are left out """
+    plain = value_fields.get(cls, ())
+    return tuple(name for klass in reversed(cls.__mro__) if klass is not Node
+                 for name in field_names(klass) if name not in plain)
+
+
+@functools.cache
+def field_getter(cls: type) -> Callable[[Node], tuple]:
+    """ a function giving the `child_fields` of a `cls` node as a tuple """
+    names = child_fields(cls)
+    if not names:
+        return lambda node: ()
+    if len(names) == 1:
+        get = attrgetter(names[0])
+        return lambda node: (get(node),)
+    return attrgetter(*names)
+
+
+def iter_child_nodes(node: Node) -> Iterator[Node]:
+    """ the direct children of `node`, in field order """
+    for value in field_getter(type(node))(node):
+        if type(value) is list:
+            for item in value:
+                if isinstance(item, Node):
+                    yield item
+        elif isinstance(value, Node):
+            yield value
+
+
+def walk(node: Node) -> Iterator[Node]:
+    """ every node under `node`, itself included, depth first in source order """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = list(iter_child_nodes(node))
+        children.reverse()
+        stack.extend(children)
+
+
+class NodeVisitor:
+    """ walks an AST depth first, in source order.
+
+    `visit_<Class>(node)` is called on every node of that class before its
+    children and `leave_<Class>(node)` after them; classes without either
+    are just walked through. A visit method returning `SKIP` keeps the walk
+    out of the node's children (its leave method is still called).
+
+    The methods of a visitor class are looked up once per node class, when
+    the visitor class is defined, and the walk keeps its own stack, so there
+    is no attribute lookup by name per node and no limit on tree depth.
+    """
+    dispatch: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {}
+        for node_class in node_classes():
+            cls.resolve(node_class)
+
+    @classmethod
+    def resolve(cls, node_class: type) -> tuple:
+        """ the (visit, leave, field getter, field descriptors) entry of `node_class` """
+        entry = cls.dispatch.get(node_class)
+        if entry is None:
+            name = node_class.__name__
+            descriptors = tuple(getattr(node_class, field) for field in child_fields(node_class))
+            entry = (getattr(cls, "visit_" + name, None), getattr(cls, "leave_" + name, None),
+                     field_getter(node_class), descriptors)
+            cls.dispatch[node_class] = entry
+        return entry
+
+    def visit(self, node: Node) -> None:
+        dispatch = type(self).dispatch
+        resolve = type(self).resolve
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                node[0](self, node[1])
+                continue
+            entry = dispatch.get(type(node)) or resolve(type(node))
+            visit, leave, getter = entry[0], entry[1], entry[2]
+            if leave is not None:
+                stack.append((leave, node))
+            if visit is not None and visit(self, node) is SKIP:
+                continue
+            fields = getter(node)
+            for i in range(len(fields) - 1, -1, -1):
+                value = fields[i]
+                if type(value) is list:
+                    for j in range(len(value) - 1, -1, -1):
+                        if isinstance(value[j], Node):
+                            stack.append(value[j])
+                elif isinstance(value, Node):
+                    stack.append(value)
+
+
+class NodeTransformer(NodeVisitor):
+    """ rewrites an AST bottom up.
+
+    The children of a node are transformed before `visit_<Class>(node)` is
+    called on it, and what the method returns takes the node's place: None
+    drops the node from a list (or leaves None in a single node field), and
+    a list is spliced into the enclosing list. Classes without a visit
+    method are kept. Nodes are updated in place and a node reachable through
+    several fields is transformed once. `visit` returns the new root.
+    """
+
+    def visit(self, node: Node):
+        dispatch = type(self).dispatch
+        resolve = type(self).resolve
+        # id of every finished node -> (node, replacement); holding the node keeps its id unique
+        done = {}
+        stack = [(node, False)]
+        root = node
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in done:
+                continue
+            entry = dispatch.get(type(node)) or resolve(type(node))
+            fields = entry[2](node)
+            if not expanded:
+                stack.append((node, True))
+                for i in range(len(fields) - 1, -1, -1):
+                    value = fields[i]
+                    if type(value) is list:
+                        stack.extend((item, False) for item in reversed(value) if isinstance(item, Node))
+                    elif isinstance(value, Node):
+                        stack.append((value, False))
+                continue
+            for descriptor, value in zip(entry[3], fields):
+                if type(value) is list:
+                    items = []
+                    changed = False
+                    for item in value:
+                        if not isinstance(item, Node):
+                            items.append(item)
+                            continue
+                        new = done[id(item)][1]
+                        if new is item:
+                            items.append(item)
+                            continue
+                        changed = True
+                        if type(new) is list:
+                            items.extend(new)
+                        elif new is not None:
+                            items.append(new)
+                    if changed:
+                        descriptor.__set__(node, items)
+                elif isinstance(value, Node):
+                    new = done[id(value)][1]
+                    if new is not value:
+                        descriptor.__set__(node, new)
+            visit = entry[0]
+            done[id(node)] = (node, visit(self, node) if visit is not None else node)
+        return done[id(root)][1]